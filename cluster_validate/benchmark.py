@@ -0,0 +1,178 @@
+# benchmark of validate_cluster.py against the synthetic cluster of es_standin.py.
+# the collection stage and every analyzer main runs are measured one by one for wall time, requests sent, response bytes
+# received and peak rss. each stage runs in a forked child process so the peak rss belongs to that stage and the stages
+# before it, analyzers collect their snapshot before measuring starts.
+
+# python benchmark.py --indices 5000 --nodes 20 --output bench.json
+# python benchmark.py --indices 5000 --nodes 20 --baseline bench.json
+# the second form exits with status 1 when a stage regressed against the saved results beyond the tolerances,
+# and so does a stage which fails or does not finish within --stage_timeout
+
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import resource
+import sys
+import time
+
+import requests
+
+import es_standin
+import validate_cluster
+
+
+def standinStats(cluster_url):
+    return requests.get("{}/_standin/stats".format(cluster_url)).json()
+
+
+def peakRssMb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def runStage(cluster_url, stage, argv, results):
+    # progress bars of the analyzers would be interleaved with the results
+    validate_cluster.show_progress = False
+    args = validate_cluster.buildArgParser().parse_args(['--cluster_url', cluster_url] + argv)
+    validate_cluster.configureTransport(calls_per_second=args.calls_per_second, max_retries=args.max_retries, timeout=args.request_timeout, pool_maxsize=max(16, args.explain_concurrency))
+
+    if stage != 'collect':
+        snapshot = validate_cluster.collectClusterSnapshot(cluster_url, bulk_index_fetch=not args.per_index_fetch)
+        analyzers = [analyzer for analyzer in validate_cluster.buildAnalyzers(args) if analyzer[0] == stage]
+
+    before = standinStats(cluster_url)
+    started = time.perf_counter()
+    if stage == 'collect':
+        snapshot = validate_cluster.collectClusterSnapshot(cluster_url, bulk_index_fetch=not args.per_index_fetch)
+        findings = len(snapshot.shards)
+    else:
+        findings = len(validate_cluster.runAnalyzers(snapshot, analyzers)[stage])
+    wall_time = time.perf_counter() - started
+    after = standinStats(cluster_url)
+
+    results.put({
+        'wall_time': wall_time,
+        'requests': after['requests'] - before['requests'],
+        'bytes': after['bytes'] - before['bytes'],
+        'peak_rss_mb': peakRssMb(),
+        'findings': findings,
+    })
+
+
+# result of a stage child, RuntimeError when it exits without one (an exception in runStage) or takes longer than timeout
+def stageResult(stage, child, results, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not child.is_alive():
+            # the result may have been put just before the child exited
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError("stage {} exited with code {} without a result".format(stage, child.exitcode))
+        if time.monotonic() > deadline:
+            child.terminate()
+            raise RuntimeError("stage {} did not finish in {:.0f}s".format(stage, timeout))
+
+
+def measureStage(cluster_url, stage, argv, repeat, timeout=3600):
+    context = multiprocessing.get_context('fork')
+    runs = []
+    for attempt in range(repeat):
+        results = context.Queue()
+        child = context.Process(target=runStage, args=(cluster_url, stage, argv, results))
+        child.start()
+        try:
+            runs.append(stageResult(stage, child, results, timeout))
+        finally:
+            child.join()
+    # the fastest run is the least disturbed one, the other numbers do not change between runs
+    return min(runs, key=lambda run: run['wall_time'])
+
+
+"""
+a stage regresses when it sends more requests than the baseline or when bytes, peak rss or wall time grow beyond the tolerance.
+wall time gets its own tolerance as it is the noisiest
+"""
+def findRegressions(results, baseline, tolerance, time_tolerance):
+    regressions = []
+    for stage, result in results.items():
+        previous = baseline.get('results', {}).get(stage)
+        if previous is None:
+            continue
+        if result['requests'] > previous['requests']:
+            regressions.append("{}: requests {} > {}".format(stage, result['requests'], previous['requests']))
+        for metric in ['bytes', 'peak_rss_mb']:
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append("{}: {} {:.1f} > {:.1f} (+{:.0%})".format(stage, metric, result[metric], previous[metric], tolerance))
+        if result['wall_time'] > previous['wall_time'] * (1 + time_tolerance):
+            regressions.append("{}: wall_time {:.3f}s > {:.3f}s (+{:.0%})".format(stage, result['wall_time'], previous['wall_time'], time_tolerance))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cluster_url", help="benchmark against an already running es_standin.py instead of starting one")
+    es_standin.addClusterArguments(parser)
+    parser.add_argument("--stages", help="comma separated stages to run, default is collect and every analyzer")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is reported")
+    parser.add_argument("--output", metavar="FILE", help="save the results as json, to be used as --baseline later")
+    parser.add_argument("--baseline", metavar="FILE", help="results saved with --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed growth of bytes and peak rss over the baseline")
+    parser.add_argument("--time_tolerance", type=float, default=0.5, help="allowed growth of wall time over the baseline")
+    parser.add_argument("--stage_timeout", type=float, default=3600, help="seconds a stage may run before it counts as failed")
+    args, validate_argv = parser.parse_known_args()
+    # anything else is passed on to validate_cluster.py, the stand-in is not rate limited unless asked for
+    if '--calls_per_second' not in validate_argv:
+        validate_argv += ['--calls_per_second', '0']
+    if '--explain_calls_per_second' not in validate_argv:
+        validate_argv += ['--explain_calls_per_second', '0']
+
+    cluster_url = args.cluster_url
+    if cluster_url is None:
+        cluster = es_standin.clusterFromArgs(args)
+        server, cluster_url = es_standin.startStandin(cluster)
+        logging.info("Stand-in cluster with {} indices, {} shards ({} unassigned) and {} nodes on {}".format(len(cluster.indices), len(cluster.shards), cluster.unassigned, len(cluster.nodes), cluster_url))
+
+    validate_args = validate_cluster.buildArgParser().parse_args(['--cluster_url', cluster_url] + validate_argv)
+    stages = ['collect'] + [analyzer[0] for analyzer in validate_cluster.buildAnalyzers(validate_args)]
+    if args.stages:
+        stages = [stage for stage in args.stages.split(',') if stage in stages]
+
+    results = {}
+    failed = []
+    print("{:<28}{:>12}{:>10}{:>14}{:>14}{:>10}".format('stage', 'wall_time_s', 'requests', 'bytes', 'peak_rss_mb', 'findings'))
+    for stage in stages:
+        try:
+            result = measureStage(cluster_url, stage, validate_argv, args.repeat, args.stage_timeout)
+        except RuntimeError as e:
+            logging.error(e)
+            failed.append(stage)
+            continue
+        results[stage] = result
+        print("{:<28}{:>12.3f}{:>10}{:>14}{:>14.1f}{:>10}".format(stage, result['wall_time'], result['requests'], result['bytes'], result['peak_rss_mb'], result['findings']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cluster': {'indices': args.indices, 'max_primaries': args.max_primaries, 'replicas': args.replicas, 'nodes': args.nodes, 'unassigned_ratio': args.unassigned_ratio, 'seed': args.seed}, 'results': results}, f, indent=2)
+        logging.info("Results saved in {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = findRegressions(results, baseline, args.tolerance, args.time_tolerance)
+        for regression in regressions:
+            logging.error("regression in {}".format(regression))
+        if regressions:
+            sys.exit(1)
+        logging.info("No regressions against {}".format(args.baseline))
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+# sliced _delete_by_query and _reindex jobs throttled by the load of the cluster, in place of scripts/delete_status_1.sh,
+# scripts/old_es_status_1_delete.sh and scripts/reindexing.sh which only print one-off curl commands.
+
+# the jobs start with wait_for_completion=false and slices (auto, one slice per primary, unless reindexing from a remote
+# cluster which can not be sliced). every --interval the write thread pools and the nodes are sampled and the rate of
+# all the jobs together is adjusted with _rethrottle: it grows by --increase docs/s while the cluster keeps up and is cut
+# by --decrease on new write rejections, a write queue above --max_write_queue or a node cpu above --max_cpu.
+# the rate is split evenly over the running jobs. a lower rate applies from the next batch of a job, a higher one at once.
+
+# with --replicas or --refresh_interval the index a job writes to (the destination for reindex, the index itself for deletes)
+# gets those settings while the job runs, without them the settings are left alone. a reindex never changes its source.
+# the settings it had are put back when the job finishes, fails or is interrupted, the curl commands to put them back
+# by hand are logged before they change.
+# on ctrl-c the running jobs are cancelled and the settings restored
+
+# nothing runs without --execute, the jobs and settings are only printed
+# python bulk_maintenance.py --cluster_url http://localhost:9200 delete --indices orders-2019,orders-2020 --query '{"bool":{"must":[{"terms":{"payment_status":[4]}},{"range":{"created_at":{"lt":"now-6M"}}}]}}'
+# python bulk_maintenance.py --cluster_url http://localhost:9200 --execute --max_rps 20000 reindex --indices orders-2019 --remote_host http://10.0.45.65:80 --dest '{}'
+# python bulk_maintenance.py --cluster_url http://localhost:9200 --execute reindex --indices orders-2019 --dest '{}-v2' --query @query.json
+
+import argparse
+import json
+import logging
+import time
+
+import requests
+
+import validate_cluster
+from task_monitor import BULK_ACTIONS, docsDone, formatDuration, listTasks, matchTasks
+
+# write was called bulk before elasticsearch 6.3
+WRITE_POOLS = 'write,bulk'
+
+
+def parseQuery(value):
+    if value is None:
+        return None
+    if value.startswith('@'):
+        with open(value[1:]) as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+# one job per index, the url misses requests_per_second which is added at start
+def buildJobs(args):
+    jobs = []
+    query = parseQuery(args.query)
+    for index in args.indices.split(','):
+        if args.command == 'delete':
+            jobs.append({'kind': '_delete_by_query', 'index': index, 'target': index, 'slices': args.slices,
+                         'url': "{}/{}/_delete_by_query?conflicts=proceed&slices={}&wait_for_completion=false".format(args.cluster_url, index, args.slices),
+                         'body': {'query': query}})
+            continue
+        source = {'index': index}
+        if query is not None:
+            source['query'] = query
+        if args.remote_host:
+            source['remote'] = {'host': args.remote_host, 'socket_timeout': '2m'}
+        slices = 1 if args.remote_host else args.slices
+        jobs.append({'kind': '_reindex', 'index': index, 'target': args.dest.format(index), 'slices': slices,
+                     'url': "{}/_reindex?slices={}&wait_for_completion=false".format(args.cluster_url, slices),
+                     'body': {'conflicts': 'proceed', 'source': source, 'dest': {'index': args.dest.format(index)}}})
+    return jobs
+
+
+"""
+number_of_replicas and refresh_interval of an index, None for a refresh_interval left at its default
+
+curl 'localhost:9200/orders-2019/_settings'
+{ "orders-2019" : { "settings" : { "index" : { "number_of_shards" : "5", "number_of_replicas" : "2", "refresh_interval" : "10s", ... } } } }
+"""
+def indexSettings(cluster_url, index):
+    response = validate_cluster.transport.get("{}/{}/_settings".format(cluster_url, index))
+    if response.status_code != 200:
+        return None
+    settings = response.json().get(index, {}).get('settings', {}).get('index', {})
+    return {'number_of_replicas': settings.get('number_of_replicas'), 'refresh_interval': settings.get('refresh_interval')}
+
+
+def putIndexSettings(cluster_url, index, settings):
+    response = validate_cluster.transport.put("{}/{}/_settings".format(cluster_url, index), json={'index': settings})
+    if response.status_code != 200:
+        logging.error("settings {} of {} could not be set: {} {}".format(settings, index, response.status_code, response.text[:200]))
+    return response.status_code == 200
+
+
+# the settings the index had before, None when they were left alone
+def applyTemporarySettings(cluster_url, index, args):
+    temporary = {}
+    if args.replicas is not None:
+        temporary['number_of_replicas'] = args.replicas
+    if args.refresh_interval:
+        temporary['refresh_interval'] = args.refresh_interval
+    if not temporary:
+        return None
+    original = indexSettings(cluster_url, index)
+    if original is None:
+        logging.warning("{} does not exist yet, its settings are left alone. create it with its mappings first to write it without replicas".format(index))
+        return None
+    original = {key: original[key] for key in temporary}
+    logging.info("to restore {} by hand: curl -H 'Content-Type: application/json' -XPUT '{}/{}/_settings' -d '{}'".format(index, cluster_url, index, json.dumps({'index': original})))
+    if not putIndexSettings(cluster_url, index, temporary):
+        return None
+    return original
+
+
+"""
+write thread pool and cpu of every node
+
+curl 'localhost:9200/_cat/thread_pool/write,bulk?format=json&h=node_name,name,active,queue,rejected'
+curl 'localhost:9200/_cat/nodes?format=json&h=name,cpu,load_1m'
+"""
+def clusterPressure(cluster_url):
+    pressure = {'rejected': {}, 'queue': 0, 'cpu': 0, 'cpu_node': None}
+    response = validate_cluster.transport.get("{}/_cat/thread_pool/{}?format=json&h=node_name,name,active,queue,rejected".format(cluster_url, WRITE_POOLS))
+    if response.status_code == 200:
+        for pool in response.json():
+            pressure['rejected'][pool['node_name']] = pressure['rejected'].get(pool['node_name'], 0) + int(pool.get('rejected') or 0)
+            pressure['queue'] = max(pressure['queue'], int(pool.get('queue') or 0))
+    response = validate_cluster.transport.get("{}/_cat/nodes?format=json&h=name,cpu,load_1m".format(cluster_url))
+    if response.status_code == 200:
+        for node in response.json():
+            if int(node.get('cpu') or 0) > pressure['cpu']:
+                pressure['cpu'], pressure['cpu_node'] = int(node['cpu']), node['name']
+    return pressure
+
+
+"""
+additive increase, multiplicative decrease of the rate of all jobs together. returns the new rate and why it was cut, None when it grew.
+rejections are counted from the previous sample, a node restart resets its counter so only growth counts
+"""
+def nextRate(rate, pressure, previous, args):
+    reasons = []
+    if previous is not None:
+        rejected = sum(max(count - previous['rejected'].get(node, count), 0) for node, count in pressure['rejected'].items())
+        if rejected > args.max_rejections:
+            reasons.append("{} write rejections".format(rejected))
+    if pressure['queue'] > args.max_write_queue:
+        reasons.append("write queue {}".format(pressure['queue']))
+    if pressure['cpu'] > args.max_cpu:
+        reasons.append("cpu {}% on {}".format(pressure['cpu'], pressure['cpu_node']))
+    if reasons:
+        return max(args.min_rps, rate * args.decrease), ', '.join(reasons)
+    return min(args.max_rps, rate + args.increase), None
+
+
+# task id of a reindex or delete by query of the job already running in the cluster, started by an earlier run or by a
+# start whose response got lost
+def runningJobTask(cluster_url, job):
+    if job['kind'] == '_delete_by_query':
+        tasks = matchTasks(listTasks(cluster_url, BULK_ACTIONS), action='*delete/byquery', description="[{}]".format(job['index']))
+    else:
+        tasks = matchTasks(listTasks(cluster_url, BULK_ACTIONS), action='*reindex', description="to [{}]".format(job['target']))
+        tasks = {task_id: task for task_id, task in tasks.items() if "[{}]".format(job['index']) in task.get('description', '')}
+    return next(iter(tasks), None)
+
+
+"""
+the start is sent once, ESTransport does not resend a POST which may have reached the cluster. a job already running
+(from an earlier run, or a start whose response was lost) is taken over instead of starting a second one on the same index
+"""
+def startJob(cluster_url, job, rate):
+    task = runningJobTask(cluster_url, job)
+    if task is not None:
+        logging.warning("{} of {} already runs as task {}, taking it over".format(job['kind'], job['index'], task))
+        return task
+    try:
+        response = validate_cluster.transport.post("{}&requests_per_second={:.0f}".format(job['url'], rate), json=job['body'])
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        task = runningJobTask(cluster_url, job)
+        if task is None:
+            logging.error("{} of {} got no answer ({}) and is not running".format(job['kind'], job['index'], e.__class__.__name__))
+        return task
+    if response.status_code != 200:
+        logging.error("{} of {} could not start: {} {}".format(job['kind'], job['index'], response.status_code, response.text[:200]))
+        return None
+    return response.json().get('task')
+
+
+def rethrottleJob(cluster_url, job, rate):
+    response = validate_cluster.transport.post("{}/{}/{}/_rethrottle?requests_per_second={:.0f}".format(cluster_url, job['kind'], job['task'], rate))
+    return response.status_code == 200
+
+
+# the task as GET _tasks/<id> returns it, None once it is gone without a stored result (404) and an empty dict when
+# the cluster did not answer, the job then counts as running until the next interval
+def jobStatus(cluster_url, job):
+    try:
+        response = validate_cluster.transport.get("{}/_tasks/{}".format(cluster_url, job['task']))
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        logging.warning("status of {} of {} unknown: {}".format(job['kind'], job['index'], e.__class__.__name__))
+        return {}
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        logging.warning("status of {} of {} unknown: {}".format(job['kind'], job['index'], response.status_code))
+        return {}
+    return response.json()
+
+
+def finishJob(cluster_url, job, status):
+    outcome = (status or {}).get('response') or {}
+    failures = outcome.get('failures', []) + ([status['error']] if status and 'error' in status else [])
+    logging.log(logging.WARNING if failures else logging.INFO, "{} of {} done in {}, {} of {} docs, {} version conflicts, {} failures{}".format(
+        job['kind'], job['index'], formatDuration(time.monotonic() - job['started']), docsDone(outcome), outcome.get('total', 0),
+        outcome.get('version_conflicts', 0), len(failures), ": {}".format(failures[0]) if failures else ''))
+
+
+def printJobs(cluster_url, jobs, args):
+    for job in jobs:
+        temporary = {key: value for key, value in [('number_of_replicas', args.replicas), ('refresh_interval', args.refresh_interval)] if value is not None}
+        if temporary:
+            print("curl -H 'Content-Type: application/json' -XPUT '{}/{}/_settings' -d '{}'".format(cluster_url, job['target'], json.dumps({'index': temporary})))
+        print("curl -H 'Content-Type: application/json' -XPOST '{}&requests_per_second={:.0f}' -d '{}'".format(job['url'], args.start_rps, json.dumps(job['body'])))
+
+
+def runJobs(cluster_url, jobs, args):
+    pending = list(jobs)
+    running = []
+    restore = {}
+    rate = args.start_rps
+    previous = None
+    try:
+        while pending or running:
+            while pending and len(running) < args.max_jobs:
+                job = pending.pop(0)
+                if job['target'] not in restore:
+                    original = applyTemporarySettings(cluster_url, job['target'], args)
+                    if original is not None:
+                        restore[job['target']] = original
+                job['rate'] = rate / min(len(running) + 1 + len(pending), args.max_jobs)
+                job['task'] = startJob(cluster_url, job, job['rate'])
+                if job['task'] is None:
+                    continue
+                job['started'] = time.monotonic()
+                running.append(job)
+                logging.info("{} of {} started as task {} with {} slices at {:.0f} docs/s, {} pending".format(job['kind'], job['index'], job['task'], job['slices'], job['rate'], len(pending)))
+
+            time.sleep(args.interval)
+
+            for job in list(running):
+                status = jobStatus(cluster_url, job)
+                if status == {}:
+                    continue
+                if status is None or status.get('completed'):
+                    running.remove(job)
+                    finishJob(cluster_url, job, status)
+                    if job['target'] in restore and not any(other['target'] == job['target'] for other in running + pending):
+                        putIndexSettings(cluster_url, job['target'], restore.pop(job['target']))
+                        logging.info("settings of {} restored".format(job['target']))
+                else:
+                    task_status = status.get('task', {}).get('status', {})
+                    job['done'] = docsDone(task_status)
+                    job['total'] = task_status.get('total', 0)
+
+            pressure = clusterPressure(cluster_url)
+            rate, reason = nextRate(rate, pressure, previous, args)
+            previous = pressure
+            if reason:
+                logging.warning("slowing down to {:.0f} docs/s: {}".format(rate, reason))
+            for job in running:
+                job_rate = rate / len(running)
+                if abs(job_rate - job['rate']) >= 1 and rethrottleJob(cluster_url, job, job_rate):
+                    job['rate'] = job_rate
+            if running:
+                logging.info("{:.0f} docs/s over {} jobs: {}".format(rate, len(running), ', '.join("{} {}/{}".format(job['index'], job.get('done', 0), job.get('total', '?')) for job in running)))
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, cancelling {} running jobs, {} not started".format(len(running), len(pending)))
+        for job in running:
+            validate_cluster.transport.post("{}/_tasks/{}/_cancel".format(cluster_url, job['task']))
+    finally:
+        for index, original in restore.items():
+            putIndexSettings(cluster_url, index, original)
+            logging.info("settings of {} restored".format(index))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cluster_url", default="http://localhost:9200", help="URL of the Elasticsearch cluster")
+    parser.add_argument("--execute", action="store_true", help="run the jobs, without it the requests are only printed")
+    parser.add_argument("--max_jobs", type=int, default=1, help="jobs running at once")
+    parser.add_argument("--slices", default="auto", help="slices per job, auto is one per primary shard")
+    parser.add_argument("--start_rps", type=float, default=1000, help="docs per second of all jobs together at the start")
+    parser.add_argument("--min_rps", type=float, default=100, help="the rate is never cut below this")
+    parser.add_argument("--max_rps", type=float, default=50000, help="the rate never grows above this")
+    parser.add_argument("--increase", type=float, default=500, help="docs per second added every interval the cluster keeps up")
+    parser.add_argument("--decrease", type=float, default=0.5, help="factor the rate is cut by when the cluster is under pressure")
+    parser.add_argument("--max_rejections", type=int, default=0, help="new write rejections in an interval above which the rate is cut")
+    parser.add_argument("--max_write_queue", type=int, default=50, help="write queue of a node above which the rate is cut")
+    parser.add_argument("--max_cpu", type=int, default=85, help="cpu percent of a node above which the rate is cut")
+    parser.add_argument("--replicas", type=int, default=None, help="number_of_replicas of the written index while a job runs, left alone when not given. for deletes that is the live index")
+    parser.add_argument("--refresh_interval", default=None, help="refresh_interval of the written index while a job runs, e.g. 30s, left alone when not given")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between samples of the cluster and rethrottles")
+    parser.add_argument("--calls_per_second", type=float, default=10, help="rate limit for calls to the cluster")
+    commands = parser.add_subparsers(dest="command", required=True)
+    delete = commands.add_parser("delete", help="_delete_by_query on every index")
+    delete.add_argument("--indices", required=True, help="comma separated indices")
+    delete.add_argument("--query", required=True, help="query as json, or @file with the json")
+    reindex = commands.add_parser("reindex", help="_reindex of every index")
+    reindex.add_argument("--indices", required=True, help="comma separated source indices")
+    reindex.add_argument("--dest", default="{}-reindexed", help="destination index, {} is the source index")
+    reindex.add_argument("--remote_host", help="reindex from this remote cluster, e.g. http://10.0.45.65:80")
+    reindex.add_argument("--query", help="only reindex the docs matching this query, json or @file")
+    args = parser.parse_args()
+    if args.command == "reindex" and not args.remote_host and args.dest.format('x') == 'x':
+        parser.error("--dest must differ from the source index unless reindexing from --remote_host")
+    validate_cluster.configureTransport(calls_per_second=args.calls_per_second)
+
+    jobs = buildJobs(args)
+    if not args.execute:
+        printJobs(args.cluster_url, jobs, args)
+        return
+
+    started = time.monotonic()
+    runJobs(args.cluster_url, jobs, args)
+    validate_cluster.transport.close()
+    logging.info("{} jobs finished in {}".format(len(jobs), formatDuration(time.monotonic() - started)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,837 @@
+# local stand-in for an elasticsearch cluster, serving synthetic responses for the endpoints validate_cluster.py calls.
+# the cluster is generated from a few parameters (indices, shards, replicas, nodes, unassigned ratio) with a fixed seed,
+# so the same parameters always give the same cluster and collector/analyzer changes can be measured against it.
+
+# only the parts of the responses the collectors read are produced, but the _cat apis honour h=, bytes=b and time=ms
+# like elasticsearch does. responses are gzip compressed when the client asks for it.
+
+# requests and response bytes are counted per endpoint, GET /_standin/stats returns the counters and
+# POST /_standin/reset clears them. these two are not counted themselves
+
+# run it standalone with
+# python es_standin.py --port 9200 --indices 1000 --nodes 10 --unassigned_ratio 0.1
+
+import argparse
+import fnmatch
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+BYTE_UNITS = [('tb', 1024 * GB), ('gb', GB), ('mb', MB), ('kb', KB)]
+DAY_MS = 24 * 3600 * 1000
+THREAD_POOLS = ['search', 'write', 'get', 'force_merge', 'management']
+# pools which scale up to max threads, _cat/thread_pool leaves their size empty
+SCALING_POOLS = {'management'}
+# per second growth of the _cat/nodes counters as (low, high), times are in ms
+NODE_COUNTER_RATES = {
+    'search.query_total': (50, 100),
+    'indexing.index_total': (500, 1000),
+    'bulk.total_operations': (5, 10),
+    'merges.total_time': (50, 100),
+    'refresh.time': (10, 20),
+}
+# bytes per second a single peer recovery copies, two recoveries into a node reach the 200mb throttle of the stand-in
+RECOVERY_SPEED = 100 * MB
+# per second growth of the disk and transport counters of _nodes/stats besides the recoveries
+NODE_IO_RATES = {'disk_read_bytes': 30 * MB, 'disk_write_bytes': 50 * MB, 'network_rx_bytes': 20 * MB, 'network_tx_bytes': 20 * MB}
+# docs per second the bulk tasks of the whole cluster can write before the write thread pools queue up and reject,
+# and the speed of a single task that is not throttled
+WRITE_CAPACITY = 30000
+BULK_TASK_SPEED = 20000
+
+
+def humanBytes(value):
+    for unit, size in BYTE_UNITS:
+        if value >= size:
+            return "{:.1f}{}".format(value / size, unit)
+    return "{}b".format(value)
+
+
+def humanMillis(value):
+    for unit, size in [('d', DAY_MS), ('h', 3600 * 1000), ('m', 60 * 1000), ('s', 1000)]:
+        if value >= size:
+            return "{:.1f}{}".format(value / size, unit)
+    return "{}ms".format(value)
+
+
+"""
+synthetic cluster state. every index gets 1 to max_primaries primaries, shard sizes are log normal around 20gb so that
+both the shard_lt_10gb and shard_gt_50gb rules fire, and unassigned_ratio of the replica copies are unassigned with NODE_LEFT
+"""
+class StandinCluster:
+    def __init__(self, indices=100, max_primaries=5, replicas=1, nodes=5, unassigned_ratio=0.05, seed=42, saturated_pools=True):
+        rng = random.Random(seed)
+        now_ms = int(time.time() * 1000)
+        self.cluster_uuid = "standin-{}".format(seed)
+        self.state_version = 1
+        self.nodes = []
+        for position in range(nodes):
+            ram = rng.choice([32, 64, 128]) * GB
+            self.nodes.append({
+                'name': "standin-node-{}".format(position),
+                'ip': "10.0.{}.{}".format(position // 250, position % 250 + 1),
+                'http_address': "10.0.{}.{}:9200".format(position // 250, position % 250 + 1),
+                # first three nodes are master eligible
+                'node.role': 'cdhimrstw' if position < 3 else 'cdhistw',
+                'master': '*' if position == 0 else '-',
+                'heap.max': rng.choice([ram // 4, ram // 2, 31 * GB if ram >= 64 * GB else ram // 2]),
+                'ram.max': ram,
+            })
+
+        unassigned_at = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(now_ms / 1000 - 3600))
+        self.indices = []
+        self.shards = []
+        for position in range(indices):
+            name = "standin-index-{}".format(position)
+            primaries = rng.randint(1, max_primaries)
+            created = now_ms - rng.randint(0, 365) * DAY_MS
+            index = {
+                'index': name,
+                'uuid': "uuid-{}".format(position),
+                'pri': primaries,
+                'rep': replicas,
+                'creation_date': created,
+                'refresh_interval': '-1' if rng.random() < 0.02 else None,
+                'status': 'close' if rng.random() < 0.01 else 'open',
+                'docs.count': 0,
+                'docs.deleted': 0,
+                'store.size': 0,
+                'pri.store.size': 0,
+            }
+            unassigned_copies = 0
+            for shard in range(primaries):
+                size = int(rng.lognormvariate(0, 1.2) * 20 * GB)
+                docs = size // 1024
+                deleted = int(docs * rng.random() * 0.2)
+                copy_nodes = rng.sample(range(nodes), min(nodes, replicas + 1))
+                for copy in range(replicas + 1):
+                    unassigned = copy > 0 and (copy >= len(copy_nodes) or rng.random() < unassigned_ratio)
+                    node = None if unassigned else self.nodes[copy_nodes[copy]]
+                    self.shards.append({
+                        'index': name,
+                        'shard': shard,
+                        'prirep': 'p' if copy == 0 else 'r',
+                        'state': 'UNASSIGNED' if unassigned else 'STARTED',
+                        'docs': None if unassigned else docs,
+                        'store': None if unassigned else size,
+                        'ip': None if unassigned else node['ip'],
+                        'node': None if unassigned else node['name'],
+                        'unassigned.at': unassigned_at if unassigned else None,
+                        'unassigned.reason': 'NODE_LEFT' if unassigned else None,
+                    })
+                    if unassigned:
+                        unassigned_copies += 1
+                    else:
+                        index['store.size'] += size
+                        index['docs.count'] += docs
+                        index['docs.deleted'] += deleted
+                        if copy == 0:
+                            index['pri.store.size'] += size
+            index['health'] = 'green' if unassigned_copies == 0 else 'yellow'
+            self.indices.append(index)
+
+        self.unassigned = len([shard for shard in self.shards if shard['state'] == 'UNASSIGNED'])
+        self.settings = {
+            'persistent': {'cluster.routing.allocation.enable': 'all'},
+            'transient': {'indices.recovery.max_bytes_per_sec': '200mb'},
+            'defaults': {'indices.recovery.max_bytes_per_sec': '40mb', 'cluster.routing.allocation.node_concurrent_recoveries': '2'},
+        }
+
+        # cumulative node counters grow at a per node rate from the start of the stand-in, the last node takes 4 times the load
+        self.started = time.monotonic()
+        for position, node in enumerate(self.nodes):
+            load = 4 if position == nodes - 1 and nodes > 2 else 1
+            node['counters'] = {counter: rng.randint(0, 10 ** 6) for counter in NODE_COUNTER_RATES}
+            node['rates'] = {counter: rng.uniform(low, high) * load for counter, (low, high) in NODE_COUNTER_RATES.items()}
+
+        # cache counters. the query cache of the first node thrashes, the request cache of the second one rarely hits
+        # and the second node evicts fielddata, every other node and most indices cache well
+        for position, node in enumerate(self.nodes):
+            node['uptime'] = rng.randint(1, 60) * DAY_MS
+            for cache in ['query_cache', 'request_cache']:
+                lookups = rng.randint(10 ** 5, 10 ** 7)
+                hit_ratio = rng.uniform(0.6, 0.95)
+                if cache == 'request_cache' and position == 1:
+                    hit_ratio = rng.uniform(0.01, 0.1)
+                misses = int(lookups * (1 - hit_ratio))
+                node[cache + '.hit_count'] = lookups - misses
+                node[cache + '.miss_count'] = misses
+                node[cache + '.evictions'] = int(misses * (rng.uniform(0.6, 0.9) if cache == 'query_cache' and position == 0 else rng.uniform(0, 0.05)))
+                node[cache + '.memory_size'] = int(node['heap.max'] * (0.098 if cache == 'query_cache' and position == 0 else rng.uniform(0.001, 0.01)))
+            node['fielddata.memory_size'] = int(node['heap.max'] * rng.uniform(0, 0.05))
+            node['fielddata.evictions'] = rng.randint(100, 1000) if position == 1 else 0
+        self.index_cache_stats = {}
+        for index in self.indices:
+            stats = {}
+            for cache in ['query_cache', 'request_cache']:
+                lookups = rng.randint(0, 10 ** 5)
+                hits = int(lookups * (rng.uniform(0, 0.1) if rng.random() < 0.05 else rng.uniform(0.5, 0.95)))
+                stats[cache] = {'memory_size_in_bytes': rng.randint(0, 10 * MB), 'hit_count': hits, 'miss_count': lookups - hits, 'evictions': rng.randint(0, (lookups - hits) // 10 + 1)}
+            stats['fielddata'] = {'memory_size_in_bytes': rng.randint(0, MB), 'evictions': rng.randint(1, 100) if rng.random() < 0.01 else 0}
+            self.index_cache_stats[index['index']] = stats
+
+        # thread pools per node with completed and rejected counters growing at a per pool rate. the 4 times loaded last node
+        # rejects searches from a full search queue, the third node runs a write pool of 2 threads which rejects and the
+        # search queue of the second node keeps growing, unless saturated_pools is off. the write pools of all nodes also
+        # reject while the bulk tasks write more than WRITE_CAPACITY
+        self.pool_layout = {}
+        for position, node in enumerate(self.nodes):
+            for pool in THREAD_POOLS:
+                busy = pool in ('search', 'write')
+                layout = {'size': {'force_merge': 1, 'management': 5}.get(pool, 13), 'queue_size': {'search': 1000, 'write': 10000, 'get': 1000}.get(pool, -1),
+                          'active': rng.randint(0, 4) if busy else 0, 'queue': 0, 'queue_rate': 0, 'rejected': 0, 'rejected_rate': 0,
+                          'completed': rng.randint(10 ** 5, 10 ** 7), 'completed_rate': rng.uniform(50, 200) if busy else rng.uniform(0, 5)}
+                if saturated_pools and pool == 'search' and position == nodes - 1 and nodes > 2:
+                    layout.update({'active': 13, 'queue': 1000, 'rejected': rng.randint(10 ** 3, 10 ** 5), 'rejected_rate': 5, 'completed_rate': 400})
+                elif saturated_pools and pool == 'write' and position == 2 and nodes > 3:
+                    layout.update({'size': 2, 'active': 2, 'queue': 10000, 'rejected': rng.randint(10 ** 3, 10 ** 5), 'rejected_rate': 2, 'completed_rate': 20})
+                elif saturated_pools and pool == 'search' and position == 1:
+                    layout.update({'active': 13, 'queue': 10, 'queue_rate': 5, 'completed_rate': 300})
+                self.pool_layout[(node['name'], pool)] = layout
+
+        # lucene segments per shard copy and the deleted docs share of every index. most indices are healthy,
+        # a few carry many deletes (expunge candidates) or many small segments (merge candidates)
+        self.segment_layout = {}
+        for index in self.indices:
+            segments = rng.randint(60, 120) if rng.random() < 0.03 else rng.randint(5, 30)
+            deleted_ratio = rng.uniform(0.25, 0.5) if rng.random() < 0.05 else rng.uniform(0, 0.1)
+            self.segment_layout[index['index']] = (segments, deleted_ratio)
+        # force merges started with wait_for_completion=false, by task id
+        self.merges = {}
+        self.merges_lock = threading.Lock()
+
+        # running reindex and by query tasks, a sliced reindex, deletes and an update which finish within minutes
+        self.bulk_tasks = {}
+        self.bulk_tasks_lock = threading.Lock()
+        self.next_task_id = 1000
+        # write thread pool rejections accumulate while the bulk tasks write faster than WRITE_CAPACITY
+        self.write_rejected = {node['name']: 0.0 for node in self.nodes}
+        self.write_updated_at = time.monotonic()
+        for action, slices in [('indices:data/write/reindex', 2), ('indices:data/write/reindex', 1), ('indices:data/write/delete/byquery', 1), ('indices:data/write/delete/byquery', 1), ('indices:data/write/update/byquery', 1)]:
+            index = rng.choice(self.indices)['index']
+            total = rng.randint(10 ** 6, 10 ** 7)
+            docs_per_second = rng.uniform(500, 5000)
+            self.startBulkTask(action, index, total, docs_per_second, slices=slices, running_for=rng.uniform(0.1, 0.8) * total / docs_per_second, node=rng.choice(self.nodes))
+
+        # hot and warm tiers by box_type, the first 60% of the nodes are hot. indices younger than 30 days are searched and
+        # written, older ones mostly sit idle and half of those older than 90 days are on warm already, a few old indices are
+        # still searched a lot. shards moved by a box_type change relocate within a second or two
+        hot_nodes = max(1, int(nodes * 0.6 + 0.5))
+        for position, node in enumerate(self.nodes):
+            node['box_type'] = 'hot' if position < hot_nodes or nodes < 2 else 'warm'
+        for index in self.indices:
+            age_days = (now_ms - index['creation_date']) / DAY_MS
+            if age_days < 30:
+                index['search_rate'], index['indexing_rate'] = rng.uniform(1, 20), rng.uniform(10, 500)
+            else:
+                busy = rng.random()
+                index['search_rate'] = rng.uniform(2, 10) if busy < 0.05 else rng.uniform(0.001, 0.05) if busy < 0.15 else 0
+                index['indexing_rate'] = 0
+            index['box_type'] = 'warm' if age_days > 90 and rng.random() < 0.5 else None
+            index['search.query_total'] = rng.randint(0, 10 ** 6)
+            index['indexing.index_total'] = rng.randint(0, 10 ** 7)
+        self.relocations_lock = threading.Lock()
+
+        # peer recoveries of the unassigned replicas, up to node_concurrent_recoveries (2) into every node, copied from the
+        # primary at RECOVERY_SPEED each. a recovered replica turns STARTED the next time the shards are looked at.
+        # searches take 5 to 10ms on average
+        self.recoveries = []
+        incoming = {node['name']: 0 for node in self.nodes}
+        nodes_by_name = {node['name']: node for node in self.nodes}
+        primaries = {(shard['index'], shard['shard']): shard for shard in self.shards if shard['prirep'] == 'p' and shard['state'] == 'STARTED'}
+        for shard in self.shards:
+            primary = primaries.get((shard['index'], shard['shard']))
+            if shard['state'] != 'UNASSIGNED' or primary is None:
+                continue
+            taken = {other['node'] for other in self.shards if other['index'] == shard['index'] and other['shard'] == shard['shard']}
+            free = [name for name, count in incoming.items() if count < 2 and name not in taken]
+            if not free:
+                continue
+            target = nodes_by_name[rng.choice(free)]
+            incoming[target['name']] += 1
+            shard.update({'state': 'INITIALIZING', 'node': target['name'], 'ip': target['ip'], 'unassigned.at': None, 'unassigned.reason': None})
+            self.recoveries.append({'shard': shard, 'source_node': primary['node'], 'target_node': target['name'], 'bytes_total': primary['store'], 'docs': primary['docs'],
+                                    'started_at': time.monotonic() - rng.uniform(0, 60), 'translog_ops': rng.randint(0, 10 ** 4)})
+        self.unassigned = len([shard for shard in self.shards if shard['state'] == 'UNASSIGNED'])
+        for node in self.nodes:
+            node['counters']['search.query_time'] = rng.randint(0, 10 ** 7)
+            node['rates']['search.query_time'] = node['rates']['search.query_total'] * rng.uniform(5, 10)
+            node['io_counters'] = {counter: rng.randint(0, 10 ** 12) for counter in NODE_IO_RATES}
+
+    """
+    bulk tasks progress at docs_per_second from when their rate was last set, a rethrottle keeps the progress made so far.
+    a sliced task is a parent whose status sums up its slices, the slices are tasks of their own with parent_task_id set
+    """
+    def startBulkTask(self, action, index, total, docs_per_second, slices=1, running_for=0, node=None, description=None):
+        node = node or self.nodes[0]
+        with self.bulk_tasks_lock:
+            self.next_task_id += 1
+            task_id = "{}:{}".format(node['name'], self.next_task_id)
+            now = time.monotonic()
+            task = {'id': task_id, 'node': node, 'action': action, 'description': description or "{} [{}]".format(action.split('/', 2)[-1], index),
+                    'total': total, 'docs_per_second': docs_per_second, 'done_base': 0.0, 'rate_changed_at': now - running_for,
+                    'started_at': now - running_for, 'start_time_in_millis': int((time.time() - running_for) * 1000),
+                    'parent_task_id': None, 'slices': [], 'cancelled': False, 'index': index}
+            self.bulk_tasks[task_id] = task
+            if slices > 1:
+                for position in range(slices):
+                    self.next_task_id += 1
+                    slice_id = "{}:{}".format(node['name'], self.next_task_id)
+                    self.bulk_tasks[slice_id] = dict(task, id=slice_id, total=total // slices, docs_per_second=docs_per_second / slices, parent_task_id=task_id, slices=[])
+                    task['slices'].append(slice_id)
+        return task_id
+
+    def bulkTaskStatus(self, task):
+        if task['slices']:
+            statuses = [self.bulkTaskStatus(self.bulk_tasks[slice_id]) for slice_id in task['slices']]
+            status = {key: sum(slice_status[key] for slice_status in statuses) for key in ['total', 'created', 'updated', 'deleted', 'batches', 'version_conflicts', 'noops']}
+            status['requests_per_second'] = sum(slice_status['requests_per_second'] for slice_status in statuses)
+            status['slices'] = statuses
+            return status
+        done = int(min(task['total'], task['done_base'] + task['docs_per_second'] * (time.monotonic() - task['rate_changed_at'])))
+        written = 'deleted' if 'delete' in task['action'] else 'updated' if 'update' in task['action'] else 'created'
+        status = {'total': task['total'], 'created': 0, 'updated': 0, 'deleted': 0, 'batches': done // 1000 + 1, 'version_conflicts': 0, 'noops': 0,
+                  'requests_per_second': task['docs_per_second'], 'throttled_millis': 0}
+        status[written] = done
+        return status
+
+    def bulkTaskDone(self, task):
+        status = self.bulkTaskStatus(task)
+        return task['cancelled'] or status['created'] + status['updated'] + status['deleted'] >= status['total']
+
+    # the task the way GET _tasks reports it
+    def bulkTaskInfo(self, task):
+        return {'node': task['node']['name'], 'id': int(task['id'].split(':')[1]), 'type': 'transport', 'action': task['action'],
+                'status': self.bulkTaskStatus(task), 'description': task['description'], 'start_time_in_millis': task['start_time_in_millis'],
+                'running_time_in_nanos': int((time.monotonic() - task['started_at']) * 10 ** 9), 'cancellable': True,
+                'cancelled': task['cancelled'], 'parent_task_id': task['parent_task_id']}
+
+    def runningBulkTasks(self):
+        with self.bulk_tasks_lock:
+            return [task for task in self.bulk_tasks.values() if not self.bulkTaskDone(task)]
+
+    """
+    requests_per_second of -1 (or missing) runs a task unthrottled at BULK_TASK_SPEED. slices share the rate of their parent
+    """
+    def bulkTaskRate(self, requests_per_second):
+        return BULK_TASK_SPEED if requests_per_second is None or float(requests_per_second) < 0 else min(float(requests_per_second), BULK_TASK_SPEED)
+
+    def rethrottleBulkTask(self, task_id, requests_per_second):
+        self.updateWritePressure()
+        with self.bulk_tasks_lock:
+            task = self.bulk_tasks.get(task_id)
+            if task is None:
+                return None
+            docs_per_second = self.bulkTaskRate(requests_per_second)
+            now = time.monotonic()
+            for changed in ([self.bulk_tasks[slice_id] for slice_id in task['slices']] or [task]):
+                changed['done_base'] = min(changed['total'], changed['done_base'] + changed['docs_per_second'] * (now - changed['rate_changed_at']))
+                changed['rate_changed_at'] = now
+                changed['docs_per_second'] = docs_per_second / max(len(task['slices']), 1)
+            return task
+
+    # docs per second all running bulk tasks write, slices count and their parents do not
+    def bulkLoad(self):
+        return sum(task['docs_per_second'] for task in self.runningBulkTasks() if not task['slices'])
+
+    def updateWritePressure(self):
+        now = time.monotonic()
+        excess = max(self.bulkLoad() - WRITE_CAPACITY, 0)
+        for node in self.write_rejected:
+            self.write_rejected[node] += excess * (now - self.write_updated_at) / 100 / len(self.write_rejected)
+        self.write_updated_at = now
+        return excess
+
+    def cancelBulkTask(self, task_id):
+        with self.bulk_tasks_lock:
+            task = self.bulk_tasks.get(task_id)
+            if task is None:
+                return None
+            for cancelled_id in [task_id] + task['slices']:
+                self.bulk_tasks[cancelled_id]['cancelled'] = True
+            return task
+
+    def indexNodes(self, index):
+        return {shard['node'] for shard in self.shards if shard['index'] == index and shard['node'] is not None}
+
+    # _cat/segments rows, the segments of a shard copy share its store and docs evenly
+    def segmentRows(self):
+        rows = []
+        for shard in self.shards:
+            if shard['node'] is None or shard['state'] == 'INITIALIZING':
+                continue
+            segments, deleted_ratio = self.segment_layout[shard['index']]
+            docs = shard['docs'] // segments
+            for segment in range(segments):
+                rows.append({'index': shard['index'], 'shard': shard['shard'], 'prirep': shard['prirep'], 'node': shard['node'], 'segment': "_{}".format(segment),
+                             'docs.count': docs, 'docs.deleted': int(docs * deleted_ratio), 'size': shard['store'] // segments})
+        return rows
+
+    # starts a force merge which takes a second or two, expunging deletes or merging down to one segment when it completes
+    def startMerge(self, index, query):
+        with self.merges_lock:
+            task = "standin:{}".format(len(self.merges) + 1)
+            self.merges[task] = {'index': index, 'ends': time.monotonic() + 1 + random.random(), 'completed': False,
+                                 'max_num_segments': query.get('max_num_segments', [None])[0]}
+        return task
+
+    def mergeCompleted(self, task):
+        with self.merges_lock:
+            merge = self.merges[task]
+            if not merge['completed'] and time.monotonic() >= merge['ends']:
+                merge['completed'] = True
+                segments, deleted_ratio = self.segment_layout[merge['index']]
+                self.segment_layout[merge['index']] = (1 if merge['max_num_segments'] == '1' else segments, 0)
+            return merge['completed']
+
+    # running force merges per node, a merge of an index runs on every node holding one of its shards
+    def runningMerges(self):
+        running = {}
+        with self.merges_lock:
+            indices = [merge['index'] for merge in self.merges.values() if time.monotonic() < merge['ends']]
+        for index in indices:
+            for node in self.indexNodes(index):
+                running[node] = running.get(node, 0) + 1
+        return running
+
+    # _cat/indices rows with the counters as of now
+    def indexRows(self):
+        elapsed = time.monotonic() - self.started
+        rows = []
+        for index in self.indices:
+            row = dict(index)
+            row['search.query_total'] = index['search.query_total'] + int(index['search_rate'] * elapsed)
+            row['indexing.index_total'] = index['indexing.index_total'] + int(index['indexing_rate'] * elapsed)
+            rows.append(row)
+        return rows
+
+    # moves the shard copies of the index which are not on a node of the tier to one that is, taking a second or two
+    def relocateToTier(self, index, tier):
+        tier_nodes = [node['name'] for node in self.nodes if node['box_type'] == tier]
+        with self.relocations_lock:
+            copies = [shard for shard in self.shards if shard['index'] == index]
+            for shard in copies:
+                if shard['node'] is None or shard['node'] in tier_nodes or shard['state'] != 'STARTED':
+                    continue
+                taken = {other['node'] for other in copies if other['shard'] == shard['shard']} | {other.get('relocating_to') for other in copies if other['shard'] == shard['shard']}
+                free = [node for node in tier_nodes if node not in taken]
+                if free:
+                    shard.update({'state': 'RELOCATING', 'relocating_to': random.choice(free), 'relocated_at': time.monotonic() + 1 + random.random()})
+
+    def settleRelocations(self):
+        nodes = {node['name']: node for node in self.nodes}
+        with self.relocations_lock:
+            relocating = 0
+            for shard in self.shards:
+                if shard['state'] != 'RELOCATING':
+                    continue
+                if time.monotonic() < shard['relocated_at']:
+                    relocating += 1
+                    continue
+                node = nodes[shard.pop('relocating_to')]
+                shard.update({'state': 'STARTED', 'node': node['name'], 'ip': node['ip']})
+            return relocating
+
+    # _cat/recovery rows of the recoveries, the finished ones turn their shard STARTED and are left out with active_only
+    def recoveryRows(self, active_only=False):
+        rows = []
+        now = time.monotonic()
+        with self.relocations_lock:
+            for recovery in self.recoveries:
+                recovered = min(recovery['bytes_total'], int(RECOVERY_SPEED * (now - recovery['started_at'])))
+                done = recovered == recovery['bytes_total']
+                if done and recovery['shard']['state'] == 'INITIALIZING':
+                    recovery['shard'].update({'state': 'STARTED', 'store': recovery['bytes_total'], 'docs': recovery['docs']})
+                if done and active_only:
+                    continue
+                rows.append({'index': recovery['shard']['index'], 'shard': recovery['shard']['shard'], 'time': int((now - recovery['started_at']) * 1000), 'type': 'peer',
+                             'stage': 'done' if done else 'index', 'source_node': recovery['source_node'], 'target_node': recovery['target_node'],
+                             'bytes_total': recovery['bytes_total'], 'bytes_recovered': recovered, 'bytes_percent': "{:.1%}".format(recovered / recovery['bytes_total'] if recovery['bytes_total'] else 1),
+                             'translog_ops': recovery['translog_ops'], 'translog_ops_recovered': recovery['translog_ops'] if done else 0,
+                             'files_total': 100, 'files_recovered': int(100 * recovered / recovery['bytes_total']) if recovery['bytes_total'] else 100})
+        return rows
+
+    # _nodes/stats fs io_stats and transport counters, the recoveries add their bytes to the reads and sends of the source and
+    # the writes and receives of the target
+    def nodeIoStats(self):
+        elapsed = time.monotonic() - self.started
+        recovered = {node['name']: Counter() for node in self.nodes}
+        for row in self.recoveryRows():
+            recovered[row['source_node']].update({'disk_read_bytes': row['bytes_recovered'], 'network_tx_bytes': row['bytes_recovered']})
+            recovered[row['target_node']].update({'disk_write_bytes': row['bytes_recovered'], 'network_rx_bytes': row['bytes_recovered']})
+        stats = {}
+        for node in self.nodes:
+            counters = {counter: start + int(NODE_IO_RATES[counter] * elapsed) + recovered[node['name']][counter] for counter, start in node['io_counters'].items()}
+            stats["id-{}".format(node['name'])] = {
+                'name': node['name'],
+                'fs': {'io_stats': {'total': {'operations': counters['disk_read_bytes'] // (64 * KB) + counters['disk_write_bytes'] // (64 * KB),
+                                              'read_kilobytes': counters['disk_read_bytes'] // KB, 'write_kilobytes': counters['disk_write_bytes'] // KB}}},
+                'transport': {'rx_size_in_bytes': counters['network_rx_bytes'], 'tx_size_in_bytes': counters['network_tx_bytes']},
+            }
+        return stats
+
+    # _cat/nodes rows with the counters as of now
+    def nodeRows(self):
+        elapsed = time.monotonic() - self.started
+        rows = []
+        running = self.runningMerges()
+        load = self.bulkLoad()
+        for node in self.nodes:
+            row = dict(node)
+            for counter, start in node['counters'].items():
+                row[counter] = start + int(node['rates'][counter] * elapsed)
+            row['merges.current'] = running.get(node['name'], 0)
+            row['cpu'] = min(100, int(20 + 70 * load / WRITE_CAPACITY))
+            rows.append(row)
+        return rows
+
+    # _cat/thread_pool rows of the given pools, the force_merge pool is busy while force merges run and the write pool
+    # queues and rejects while the bulk tasks write more than WRITE_CAPACITY
+    def threadPoolRows(self, pools):
+        running = self.runningMerges()
+        excess = self.updateWritePressure()
+        elapsed = time.monotonic() - self.started
+        rows = []
+        for node in self.nodes:
+            for pool in pools:
+                layout = self.pool_layout.get((node['name'], pool))
+                if layout is None:
+                    continue
+                row = {'node_name': node['name'], 'name': pool, 'active': layout['active'], 'size': None if pool in SCALING_POOLS else layout['size'], 'max': layout['size'], 'queue_size': layout['queue_size'],
+                       'queue': min(layout['queue'] + int(layout['queue_rate'] * elapsed), int(layout['queue_size'] * 0.9) if layout['queue_rate'] else layout['queue_size']) if layout['queue_size'] > 0 else layout['queue'],
+                       'rejected': layout['rejected'] + int(layout['rejected_rate'] * elapsed), 'completed': layout['completed'] + int(layout['completed_rate'] * elapsed)}
+                if pool == 'force_merge':
+                    active = running.get(node['name'], 0)
+                    row.update({'active': min(active, 1), 'queue': max(active - 1, 0)})
+                if pool == 'write' and excess:
+                    row.update({'active': layout['size'], 'queue': max(row['queue'], min(int(excess / 100), 200))})
+                if pool == 'write':
+                    row['rejected'] += int(self.write_rejected[node['name']])
+                rows.append(row)
+        return rows
+
+
+# formats a row the way _cat does with format=json: everything is a string, sizes and times are human readable unless bytes= or time= is given
+def catRow(row, columns, bytes_columns, time_columns, query):
+    formatted = {}
+    for column in columns:
+        value = row.get(column)
+        if value is None:
+            formatted[column] = None
+        elif column in bytes_columns and 'bytes' not in query:
+            formatted[column] = humanBytes(value)
+        elif column in time_columns and 'time' not in query:
+            formatted[column] = humanMillis(value)
+        else:
+            formatted[column] = str(value)
+    return formatted
+
+
+def catColumns(query, default_columns):
+    if 'h' in query:
+        columns = query['h'][0].split(',')
+        if columns != ['*']:
+            return columns
+    return default_columns
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handleRequest('GET')
+
+    def do_POST(self):
+        self.handleRequest('POST')
+
+    def do_PUT(self):
+        self.handleRequest('PUT')
+
+    def handleRequest(self, method):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        request_body = json.loads(self.rfile.read(length)) if length else None
+        path = parts.path.rstrip('/')
+
+        if path == '/_standin/stats':
+            return self.respond(200, self.server.stats(), count=False)
+        if path == '/_standin/reset':
+            self.server.resetStats()
+            return self.respond(200, {'acknowledged': True}, count=False)
+
+        endpoint, status, body = self.server.route(method, path, query, request_body)
+        self.respond(status, body, endpoint=endpoint)
+
+    def respond(self, status, body, endpoint=None, count=True):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            data = gzip.compress(data, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if count:
+            self.server.count(endpoint, len(data))
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cluster):
+        super().__init__(address, StandinHandler)
+        self.cluster = cluster
+        self.stats_lock = threading.Lock()
+        self.resetStats()
+
+    def resetStats(self):
+        with self.stats_lock:
+            self.requests = {}
+            self.bytes_sent = {}
+
+    def count(self, endpoint, size):
+        with self.stats_lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + size
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'requests': sum(self.requests.values()),
+                'bytes': sum(self.bytes_sent.values()),
+                'endpoints': {endpoint: {'requests': self.requests[endpoint], 'bytes': self.bytes_sent[endpoint]} for endpoint in self.requests},
+            }
+
+    # returns (endpoint name used for the counters, status, body)
+    def route(self, method, path, query, request_body):
+        cluster = self.cluster
+        if path == '/_cat/indices' or path.startswith('/_cat/indices/'):
+            wanted = {path[len('/_cat/indices/'):]} if path.startswith('/_cat/indices/') else {row['index'] for row in cluster.indices}
+            columns = catColumns(query, ['health', 'status', 'index', 'uuid', 'pri', 'rep', 'docs.count', 'docs.deleted', 'store.size', 'pri.store.size'])
+            return '_cat/indices', 200, [catRow(row, columns, ('store.size', 'pri.store.size'), (), query) for row in cluster.indexRows() if row['index'] in wanted]
+
+        if path == '/_cat/shards':
+            cluster.settleRelocations()
+            cluster.recoveryRows()
+            columns = catColumns(query, ['index', 'shard', 'prirep', 'state', 'docs', 'store', 'ip', 'node'])
+            return '_cat/shards', 200, [catRow(row, columns, ('store',), (), query) for row in cluster.shards]
+
+        if path == '/_cat/recovery' or path.startswith('/_cat/recovery/'):
+            wanted = set(path[len('/_cat/recovery/'):].split(',')) if path.startswith('/_cat/recovery/') else None
+            columns = catColumns(query, ['index', 'shard', 'time', 'type', 'stage', 'source_node', 'target_node', 'files_percent', 'bytes_percent', 'translog_ops_percent'])
+            active_only = query.get('active_only', ['false'])[0] in ('', 'true')
+            return '_cat/recovery', 200, [catRow(row, columns, ('bytes_total', 'bytes_recovered'), ('time',), query) for row in cluster.recoveryRows(active_only) if wanted is None or row['index'] in wanted]
+
+        if path == '/_nodes/stats' or path.startswith('/_nodes/stats/'):
+            return '_nodes/stats', 200, {'nodes': cluster.nodeIoStats()}
+
+        if path == '/_cat/nodeattrs':
+            columns = catColumns(query, ['node', 'host', 'ip', 'attr', 'value'])
+            return '_cat/nodeattrs', 200, [catRow({'node': node['name'], 'host': node['ip'], 'ip': node['ip'], 'attr': 'box_type', 'value': node['box_type']}, columns, (), (), query) for node in cluster.nodes]
+
+        if path == '/_cat/nodes':
+            columns = catColumns(query, ['ip', 'heap.percent', 'ram.percent', 'cpu', 'load_1m', 'node.role', 'master', 'name'])
+            return '_cat/nodes', 200, [catRow(row, columns, ('heap.max', 'ram.max', 'query_cache.memory_size', 'request_cache.memory_size', 'fielddata.memory_size'), ('merges.total_time', 'refresh.time', 'uptime'), query) for row in cluster.nodeRows()]
+
+        if method == 'PUT' and path.endswith('/_settings') and path.count('/') == 2:
+            wanted = set(path.split('/')[1].split(','))
+            changed = dict(request_body.get('index', {}), **{key[len('index.'):]: value for key, value in request_body.items() if key.startswith('index.')})
+            box_type = changed.get('routing.allocation.include.box_type', changed.get('routing.allocation.require.box_type'))
+            for row in cluster.indices:
+                if wanted & {'_all', row['index']}:
+                    if 'number_of_replicas' in changed:
+                        row['rep'] = int(changed['number_of_replicas'])
+                    if 'refresh_interval' in changed:
+                        row['refresh_interval'] = changed['refresh_interval']
+                    if box_type:
+                        row['box_type'] = box_type
+                        cluster.relocateToTier(row['index'], box_type)
+            return '_settings', 200, {'acknowledged': True}
+
+        if path.endswith('/_settings') and path.count('/') == 2:
+            wanted = path.split('/')[1]
+            settings = {}
+            for row in cluster.indices:
+                if wanted in ('_all', row['index']):
+                    index_settings = {'number_of_shards': str(row['pri']), 'number_of_replicas': str(row['rep']), 'creation_date': str(row['creation_date'])}
+                    if row['refresh_interval'] is not None:
+                        index_settings['refresh_interval'] = row['refresh_interval']
+                    if row['box_type'] is not None:
+                        index_settings['routing'] = {'allocation': {'include': {'box_type': row['box_type']}}}
+                    settings[row['index']] = {'settings': {'index': index_settings}}
+            return '_settings', 200, settings
+
+        if path == '/_cat/segments':
+            columns = catColumns(query, ['index', 'shard', 'prirep', 'ip', 'segment', 'generation', 'docs.count', 'docs.deleted', 'size', 'size.memory', 'committed', 'searchable', 'version', 'compound'])
+            return '_cat/segments', 200, [catRow(row, columns, ('size',), (), query) for row in cluster.segmentRows()]
+
+        if path == '/_cat/thread_pool' or path.startswith('/_cat/thread_pool/'):
+            pools = path[len('/_cat/thread_pool/'):].split(',') if path.startswith('/_cat/thread_pool/') else THREAD_POOLS
+            columns = catColumns(query, ['node_name', 'name', 'active', 'queue', 'rejected'])
+            return '_cat/thread_pool', 200, [catRow(row, columns, (), (), query) for row in cluster.threadPoolRows(pools)]
+
+        if method == 'POST' and path.endswith('/_forcemerge') and path.count('/') == 2:
+            index = path.split('/')[1]
+            if index not in cluster.segment_layout:
+                return '_forcemerge', 404, {'error': 'no such index [{}]'.format(index), 'status': 404}
+            task = cluster.startMerge(index, query)
+            if query.get('wait_for_completion', ['true'])[0] == 'false':
+                return '_forcemerge', 200, {'task': task}
+            while not cluster.mergeCompleted(task):
+                time.sleep(0.1)
+            return '_forcemerge', 200, {'_shards': {'failed': 0}}
+
+        if method == 'POST' and (path == '/_reindex' or path.endswith('/_delete_by_query') and path.count('/') == 2):
+            rows = {row['index']: row for row in cluster.indices}
+            index = request_body['source']['index'] if path == '/_reindex' else path.split('/')[1]
+            if index not in rows:
+                return path.split('/')[-1], 404, {'error': 'no such index [{}]'.format(index), 'status': 404}
+            # a delete by query matches a thousandth of the docs
+            total = rows[index]['docs.count'] if path == '/_reindex' else rows[index]['docs.count'] // 1000
+            slices = query.get('slices', ['1'])[0]
+            slices = rows[index]['pri'] if slices == 'auto' else int(slices)
+            action = 'indices:data/write/reindex' if path == '/_reindex' else 'indices:data/write/delete/byquery'
+            description = "reindex from [{}] to [{}]".format(index, request_body['dest']['index']) if path == '/_reindex' else "delete-by-query [{}]".format(index)
+            task = cluster.startBulkTask(action, index, total, cluster.bulkTaskRate(query.get('requests_per_second', [None])[0]), slices=slices, description=description)
+            if query.get('wait_for_completion', ['true'])[0] == 'false':
+                return path.split('/')[-1], 200, {'task': task}
+            while not cluster.bulkTaskDone(cluster.bulk_tasks[task]):
+                time.sleep(0.1)
+            return path.split('/')[-1], 200, dict(cluster.bulkTaskStatus(cluster.bulk_tasks[task]), failures=[])
+
+        if method == 'POST' and path.endswith('/_rethrottle') and path.split('/')[1] in ('_reindex', '_delete_by_query', '_update_by_query'):
+            task = cluster.rethrottleBulkTask(path.split('/')[2], query.get('requests_per_second', ['-1'])[0])
+            if task is None:
+                return '_rethrottle', 404, {'error': 'task not found', 'status': 404}
+            return '_rethrottle', 200, {'nodes': {task['node']['name']: {'tasks': {task['id']: cluster.bulkTaskInfo(task)}}}}
+
+        if path == '/_tasks':
+            actions = query.get('actions', ['*'])[0].split(',')
+            tasks = [task for task in cluster.runningBulkTasks() if any(fnmatch.fnmatch(task['action'], action) for action in actions)]
+            if query.get('group_by', ['nodes'])[0] == 'none':
+                return '_tasks', 200, {'tasks': [cluster.bulkTaskInfo(task) for task in tasks]}
+            nodes = {}
+            for task in tasks:
+                node = nodes.setdefault(task['node']['name'], {'name': task['node']['name'], 'transport_address': task['node']['ip'] + ':9300', 'tasks': {}})
+                node['tasks'][task['id']] = cluster.bulkTaskInfo(task)
+            return '_tasks', 200, {'nodes': nodes}
+
+        if method == 'POST' and path.startswith('/_tasks/') and path.endswith('/_cancel'):
+            task = cluster.cancelBulkTask(path[len('/_tasks/'):-len('/_cancel')])
+            if task is None:
+                return '_tasks', 404, {'error': 'task not found', 'status': 404}
+            return '_tasks', 200, {'nodes': {task['node']['name']: {'tasks': {task['id']: cluster.bulkTaskInfo(task)}}}}
+
+        if path.startswith('/_tasks/') and path[len('/_tasks/'):] in cluster.bulk_tasks:
+            task = cluster.bulk_tasks[path[len('/_tasks/'):]]
+            completed = cluster.bulkTaskDone(task)
+            body = {'completed': completed, 'task': cluster.bulkTaskInfo(task)}
+            if completed:
+                body['response'] = dict(cluster.bulkTaskStatus(task), took=int((time.monotonic() - task['started_at']) * 1000), failures=[], canceled='by user request' if task['cancelled'] else None)
+            return '_tasks', 200, body
+
+        if path.startswith('/_tasks/'):
+            task = path[len('/_tasks/'):]
+            if task not in cluster.merges:
+                return '_tasks', 404, {'error': 'task [{}] isn\'t running and hasn\'t stored its results'.format(task), 'status': 404}
+            return '_tasks', 200, {'completed': cluster.mergeCompleted(task), 'task': {'node': 'standin', 'action': 'indices:admin/forcemerge'}}
+
+        if path.startswith('/_stats/'):
+            return '_stats', 200, {'indices': {index: {'total': stats} for index, stats in cluster.index_cache_stats.items()}}
+
+        if path == '/_cluster/stats':
+            return '_cluster/stats', 200, {'cluster_uuid': cluster.cluster_uuid, 'indices': {'count': len(cluster.indices)}, 'nodes': {'count': {'total': len(cluster.nodes)}}}
+
+        if path == '/_cluster/settings':
+            return '_cluster/settings', 200, cluster.settings
+
+        if path == '/_cluster/health':
+            cluster.recoveryRows()
+            initializing = len([shard for shard in cluster.shards if shard['state'] == 'INITIALIZING'])
+            return '_cluster/health', 200, {
+                'cluster_name': 'standin',
+                'status': 'yellow' if cluster.unassigned or initializing else 'green',
+                'number_of_nodes': len(cluster.nodes),
+                'number_of_data_nodes': len(cluster.nodes),
+                'active_shards': len(cluster.shards) - cluster.unassigned - initializing,
+                'unassigned_shards': cluster.unassigned,
+                'relocating_shards': cluster.settleRelocations(),
+                'initializing_shards': initializing,
+            }
+
+        if path == '/_cluster/state/version':
+            return '_cluster/state', 200, {'cluster_uuid': cluster.cluster_uuid, 'version': cluster.state_version, 'state_uuid': 'standin-state'}
+
+        if path == '/_cluster/allocation/explain':
+            request_body = request_body or {}
+            return '_cluster/allocation/explain', 200, {
+                'index': request_body.get('index'),
+                'shard': request_body.get('shard'),
+                'primary': request_body.get('primary'),
+                'current_state': 'unassigned',
+                'unassigned_info': {'reason': 'NODE_LEFT', 'last_allocation_status': 'no_attempt'},
+                'can_allocate': 'no',
+                'allocate_explanation': 'cannot allocate because allocation is not permitted to any of the nodes',
+                'node_allocation_decisions': [
+                    {'node_name': node['name'], 'transport_address': node['ip'] + ':9300', 'node_decision': 'no',
+                     'deciders': [{'decider': 'same_shard', 'decision': 'NO', 'explanation': 'a copy of this shard is already allocated to this node'}]}
+                    for node in cluster.nodes
+                ],
+            }
+
+        return path, 404, {'error': 'no such endpoint in the stand-in: {} {}'.format(method, path), 'status': 404}
+
+
+def startStandin(cluster, host='127.0.0.1', port=0):
+    server = StandinServer((host, port), cluster)
+    threading.Thread(target=server.serve_forever, name='es-standin', daemon=True).start()
+    return server, "http://{}:{}".format(host, server.server_address[1])
+
+
+def addClusterArguments(parser):
+    parser.add_argument("--indices", type=int, default=100, help="number of indices")
+    parser.add_argument("--max_primaries", type=int, default=5, help="each index gets 1 to max_primaries primary shards")
+    parser.add_argument("--replicas", type=int, default=1, help="replicas per primary")
+    parser.add_argument("--nodes", type=int, default=5, help="number of data nodes")
+    parser.add_argument("--unassigned_ratio", type=float, default=0.05, help="fraction of replica copies left unassigned")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the synthetic cluster")
+    parser.add_argument("--calm_thread_pools", action="store_true", help="no saturated search and write pools, which would hold back force_merge_scheduler.py and bulk_maintenance.py")
+
+
+def clusterFromArgs(args):
+    return StandinCluster(indices=args.indices, max_primaries=args.max_primaries, replicas=args.replicas, nodes=args.nodes, unassigned_ratio=args.unassigned_ratio, seed=args.seed, saturated_pools=not args.calm_thread_pools)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=9200, help="port to listen on")
+    addClusterArguments(parser)
+    args = parser.parse_args()
+
+    cluster = clusterFromArgs(args)
+    server = StandinServer((args.host, args.port), cluster)
+    logging.info("Stand-in cluster with {} indices, {} shards ({} unassigned) and {} nodes listening on http://{}:{}".format(len(cluster.indices), len(cluster.shards), cluster.unassigned, len(cluster.nodes), args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# throttled force merge of the indices validate_cluster.py finds worth it (see analyzeSegments and rankForceMerges).
+# merges start in priority order, most reclaimable bytes first, with at most --max_per_node force merges on a node
+# and --max_concurrent in the whole cluster. a force merge runs on every node holding a shard of the index,
+# so an index starts only when all of its nodes have room.
+
+# backpressure: a node gets no new force merge while it runs more than --max_node_merges merges (merges.current of
+# _cat/nodes, which counts the regular background merges too), while its force_merge thread pool has a queue
+# or while its search queue is longer than --max_search_queue. live search keeps priority over reclaiming disk.
+
+# nothing is merged without --execute, the plan is only printed
+# python force_merge_scheduler.py --cluster_url http://localhost:9200
+# python force_merge_scheduler.py --cluster_url http://localhost:9200 --execute --max_per_node 1 --max_concurrent 4
+
+# force merges can not be cancelled, on ctrl-c no new merge starts and the running ones finish in the cluster
+
+import argparse
+import logging
+import time
+from collections import Counter
+
+import requests
+
+import validate_cluster
+from validate_cluster import GB, formatBytes, rankForceMerges, getAllIndexDetails, getSegmentStats, getShardLevelData
+
+
+# nodes holding a copy of a shard of every index
+def indexNodes(cluster_url):
+    nodes = {}
+    for shard in getShardLevelData(cluster_url):
+        if shard.node is not None:
+            nodes.setdefault(shard.index, set()).add(shard.node)
+    return nodes
+
+
+"""
+per node load the scheduler backs off on
+
+curl 'localhost:9200/_cat/nodes?format=json&h=name,merges.current'
+curl 'localhost:9200/_cat/thread_pool/search,force_merge?format=json&h=node_name,name,active,queue'
+"""
+def nodePressure(cluster_url):
+    pressure = {}
+    response = validate_cluster.transport.get("{}/_cat/nodes?format=json&h=name,merges.current".format(cluster_url))
+    if response.status_code == 200:
+        for node in response.json():
+            pressure.setdefault(node['name'], {})['merges'] = int(node.get('merges.current') or 0)
+    response = validate_cluster.transport.get("{}/_cat/thread_pool/search,force_merge?format=json&h=node_name,name,active,queue".format(cluster_url))
+    if response.status_code == 200:
+        for pool in response.json():
+            pressure.setdefault(pool['node_name'], {})[pool['name'] + '_queue'] = int(pool.get('queue') or 0)
+    return pressure
+
+
+# why a node can not take another force merge, None when it can
+def nodeBusy(node, running_per_node, pressure, args):
+    load = pressure.get(node, {})
+    if running_per_node[node] >= args.max_per_node:
+        return "{} force merges running".format(running_per_node[node])
+    if load.get('merges', 0) > args.max_node_merges:
+        return "{} merges running".format(load['merges'])
+    if load.get('force_merge_queue', 0) > 0:
+        return "force_merge queue {}".format(load['force_merge_queue'])
+    if load.get('search_queue', 0) > args.max_search_queue:
+        return "search queue {}".format(load['search_queue'])
+    return None
+
+
+# the POST is not resent when its response is lost, the merge may have started and a second one would double the load
+def startForceMerge(cluster_url, candidate):
+    url = "{}/{}/_forcemerge?{}&wait_for_completion=false".format(cluster_url, candidate['index'], candidate['params'])
+    try:
+        response = validate_cluster.transport.post(url)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        logging.error("force merge of {} got no answer ({}), it may be running anyway, check _tasks?actions=*forcemerge before starting it again".format(candidate['index'], e.__class__.__name__))
+        return None
+    if response.status_code != 200:
+        logging.error("force merge of {} could not start: {} {}".format(candidate['index'], response.status_code, response.text[:200]))
+        return None
+    return response.json().get('task')
+
+
+# a finished task whose result was not stored is gone from _tasks, that counts as done too
+def taskDone(cluster_url, task):
+    response = validate_cluster.transport.get("{}/_tasks/{}".format(cluster_url, task))
+    if response.status_code == 404:
+        return True
+    return response.status_code == 200 and response.json().get('completed', False)
+
+
+def printPlan(cluster_url, candidates, index_nodes):
+    print("{:>4}  {:<40}{:<18}{:>10}{:>14}{:>14}{:>7}".format('rank', 'index', 'reason', 'deleted', 'segs/shard', 'reclaimable', 'nodes'))
+    for rank, candidate in enumerate(candidates, 1):
+        print("{:>4}  {:<40}{:<18}{:>10.1%}{:>14.1f}{:>14}{:>7}".format(rank, candidate['index'], candidate['reason'], candidate['deleted_ratio'], candidate['segments_per_shard'], formatBytes(candidate['reclaimable_bytes']), len(index_nodes.get(candidate['index'], ()))))
+    for candidate in candidates:
+        print("curl -XPOST '{}/{}/_forcemerge?{}'".format(cluster_url, candidate['index'], candidate['params']))
+
+
+def runSchedule(cluster_url, candidates, index_nodes, args):
+    pending = list(candidates)
+    running = {}
+    reclaimed = 0
+    try:
+        while pending or running:
+            for index, (task, nodes, started, candidate) in list(running.items()):
+                if taskDone(cluster_url, task):
+                    del running[index]
+                    reclaimed += candidate['reclaimable_bytes']
+                    logging.info("force merge of {} done in {:.0f}s, about {} reclaimed".format(index, time.monotonic() - started, formatBytes(candidate['reclaimable_bytes'])))
+
+            pressure = nodePressure(cluster_url)
+            running_per_node = Counter(node for task, nodes, started, candidate in running.values() for node in nodes)
+            for candidate in list(pending):
+                if len(running) >= args.max_concurrent:
+                    break
+                nodes = index_nodes.get(candidate['index'], set())
+                busy = {node: nodeBusy(node, running_per_node, pressure, args) for node in nodes}
+                busy = {node: reason for node, reason in busy.items() if reason}
+                if busy:
+                    logging.debug("{} waits for {}".format(candidate['index'], busy))
+                    continue
+                pending.remove(candidate)
+                task = startForceMerge(cluster_url, candidate)
+                if task is None:
+                    continue
+                running[candidate['index']] = (task, nodes, time.monotonic(), candidate)
+                running_per_node.update(nodes)
+                logging.info("force merge of {} ({}) started on {} nodes as task {}, {} pending".format(candidate['index'], candidate['reason'], len(nodes), task, len(pending)))
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, {} pending force merges not started. running ones will finish in the cluster: {}".format(len(pending), ', '.join(running)))
+    return reclaimed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cluster_url", default="http://localhost:9200", help="URL of the Elasticsearch cluster")
+    parser.add_argument("--execute", action="store_true", help="run the force merges, without it the plan is only printed")
+    parser.add_argument("--indices", help="comma separated indices to consider, default is every index")
+    parser.add_argument("--limit", type=int, default=None, help="force merge at most this many indices")
+    parser.add_argument("--min_deleted_ratio", type=float, default=0.2, help="deleted docs share from which an index is worth expunging")
+    parser.add_argument("--max_segments_per_shard", type=int, default=50, help="segments per shard copy above which an index is merged to one segment")
+    parser.add_argument("--min_reclaimable_gb", type=float, default=1, help="least reclaimable size for an expunge")
+    parser.add_argument("--max_per_node", type=int, default=1, help="force merges running at once on one node")
+    parser.add_argument("--max_concurrent", type=int, default=4, help="force merges running at once in the cluster")
+    parser.add_argument("--max_node_merges", type=int, default=3, help="merges.current of a node above which it gets no new force merge")
+    parser.add_argument("--max_search_queue", type=int, default=0, help="search queue of a node above which it gets no new force merge")
+    parser.add_argument("--poll_interval", type=float, default=10, help="seconds between checks of the running force merges and the node load")
+    parser.add_argument("--calls_per_second", type=float, default=10, help="rate limit for calls to the cluster")
+    args = parser.parse_args()
+    validate_cluster.configureTransport(calls_per_second=args.calls_per_second)
+
+    segment_stats = getSegmentStats(args.cluster_url)
+    if args.indices:
+        wanted = set(args.indices.split(','))
+        segment_stats = {index: stats for index, stats in segment_stats.items() if index in wanted}
+    candidates = rankForceMerges(getAllIndexDetails(args.cluster_url), segment_stats, args.min_deleted_ratio, args.max_segments_per_shard, args.min_reclaimable_gb * GB)[:args.limit]
+    index_nodes = indexNodes(args.cluster_url)
+    logging.info("{} indices to force merge, about {} reclaimable".format(len(candidates), formatBytes(sum(candidate['reclaimable_bytes'] for candidate in candidates))))
+
+    if not args.execute:
+        printPlan(args.cluster_url, candidates, index_nodes)
+        return
+
+    started = time.monotonic()
+    reclaimed = runSchedule(args.cluster_url, candidates, index_nodes, args)
+    validate_cluster.transport.close()
+    logging.info("Force merges finished in {:.0f}s, about {} reclaimed".format(time.monotonic() - started, formatBytes(reclaimed)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# monitor and cancel of the running reindex, delete by query and update by query tasks, in place of scripts/stats.sh and scripts/cancel.sh.
+# every interval costs one _tasks call for all the tasks together. docs/s and batches/s come from the difference to the previous
+# sample (the first sample uses the average since the task started) and the eta from the docs left at that rate.
+# sliced tasks are shown as their parent, whose status sums up the slices, --show_slices lists the slices too
+
+# python task_monitor.py --cluster_url http://localhost:9200 watch --interval 10
+# python task_monitor.py --cluster_url http://localhost:9200 watch --once
+# python task_monitor.py --cluster_url http://localhost:9200 cancel --action '*byquery' --older_than 3600
+# python task_monitor.py --cluster_url http://localhost:9200 cancel --node es-data-3 --yes
+# cancel only lists the matching tasks unless --yes is given
+
+import argparse
+import fnmatch
+import logging
+import time
+
+import validate_cluster
+
+BULK_ACTIONS = '*reindex,*byquery'
+
+
+"""
+running tasks with their node names, keyed by task id
+
+curl 'localhost:9200/_tasks?detailed=true&actions=*reindex,*byquery'
+{
+  "nodes" : {
+    "G78YGQBuTsKwIcJpMQeDbQ" : {
+      "name" : "es-data-1",
+      "tasks" : {
+        "G78YGQBuTsKwIcJpMQeDbQ:84504291" : {
+          "node" : "G78YGQBuTsKwIcJpMQeDbQ", "id" : 84504291, "type" : "transport", "action" : "indices:data/write/reindex",
+          "status" : { "total" : 6154, "updated" : 3500, "created" : 0, "deleted" : 0, "batches" : 4, "version_conflicts" : 0, "noops" : 0, "requests_per_second" : -1.0, "throttled_millis" : 0 },
+          "description" : "reindex from [source] to [dest]", "start_time_in_millis" : 1535149899665, "running_time_in_nanos" : 5926916792, "cancellable" : true,
+          "parent_task_id" : "G78YGQBuTsKwIcJpMQeDbQ:84504290"
+        }
+      }
+    }
+  }
+}
+"""
+def listTasks(cluster_url, actions=BULK_ACTIONS):
+    response = validate_cluster.transport.get("{}/_tasks?detailed=true&actions={}".format(cluster_url, actions))
+    if response.status_code != 200:
+        return {}
+    tasks = {}
+    for node_id, node in response.json().get('nodes', {}).items():
+        for task_id, task in node.get('tasks', {}).items():
+            task['node_name'] = node.get('name', node_id)
+            tasks[task_id] = task
+    return tasks
+
+
+# docs a bulk task has gone through, written or skipped
+def docsDone(status):
+    return sum(status.get(key, 0) for key in ['created', 'updated', 'deleted', 'version_conflicts', 'noops'])
+
+
+"""
+progress of every task from this sample and the previous one (taken sampled_at seconds ago, None for the first sample)
+as dicts with docs_per_second, batches_per_second and eta_seconds, None when the task made no progress
+"""
+def taskProgress(tasks, previous, elapsed):
+    progress = {}
+    for task_id, task in tasks.items():
+        status = task.get('status', {})
+        done = docsDone(status)
+        before = previous.get(task_id) if previous else None
+        if before is not None and elapsed:
+            docs_per_second = (done - docsDone(before.get('status', {}))) / elapsed
+            batches_per_second = (status.get('batches', 0) - before.get('status', {}).get('batches', 0)) / elapsed
+        else:
+            running = task.get('running_time_in_nanos', 0) / 1e9
+            docs_per_second = done / running if running else 0
+            batches_per_second = status.get('batches', 0) / running if running else 0
+        left = max(status.get('total', 0) - done, 0)
+        progress[task_id] = {
+            'done': done,
+            'total': status.get('total', 0),
+            'docs_per_second': docs_per_second,
+            'batches_per_second': batches_per_second,
+            'eta_seconds': left / docs_per_second if docs_per_second > 0 else None,
+        }
+    return progress
+
+
+def formatDuration(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return "{}h{:02d}m{:02d}s".format(seconds // 3600, seconds % 3600 // 60, seconds % 60) if seconds >= 3600 else "{}m{:02d}s".format(seconds // 60, seconds % 60)
+
+
+def printTasks(tasks, progress, show_slices=False):
+    print("{:<32}{:<18}{:<16}{:>10}{:>22}{:>8}{:>11}{:>10}{:>11}  {}".format('task', 'action', 'node', 'age', 'done/total', '%', 'docs/s', 'batch/s', 'eta', 'description'))
+    total_rate = 0
+    for task_id, task in sorted(tasks.items(), key=lambda item: item[1].get('start_time_in_millis', 0)):
+        if task.get('parent_task_id') in tasks and not show_slices:
+            continue
+        task_progress = progress[task_id]
+        if not task.get('parent_task_id') in tasks:
+            total_rate += task_progress['docs_per_second']
+        percent = task_progress['done'] / task_progress['total'] if task_progress['total'] else 0
+        print("{:<32}{:<18}{:<16}{:>10}{:>22}{:>8.1%}{:>11.0f}{:>10.1f}{:>11}  {}".format(
+            ('  ' if task.get('parent_task_id') in tasks else '') + task_id, task.get('action', '').split('/', 2)[-1], task.get('node_name', ''),
+            formatDuration(task.get('running_time_in_nanos', 0) / 1e9), "{}/{}".format(task_progress['done'], task_progress['total']), percent,
+            task_progress['docs_per_second'], task_progress['batches_per_second'], formatDuration(task_progress['eta_seconds']), task.get('description', '')[:80]))
+    print("{} tasks, {:.0f} docs/s together".format(len([task for task in tasks.values() if task.get('parent_task_id') not in tasks]), total_rate))
+
+
+"""
+outcome of a task that left the task list, one call per finished task. tasks started with wait_for_completion=false keep
+their result in the .tasks index, the others are gone once finished
+
+curl 'localhost:9200/_tasks/G78YGQBuTsKwIcJpMQeDbQ:84504291'
+{ "completed" : true, "task" : {...}, "response" : { "took" : 63420, "total" : 6154, "updated" : 6154, "failures" : [ ] } }
+"""
+def reportFinished(cluster_url, task_id, task):
+    response = validate_cluster.transport.get("{}/_tasks/{}".format(cluster_url, task_id))
+    if response.status_code != 200:
+        logging.info("{} ({}) is no longer running, its result was not stored".format(task_id, task.get('description', '')))
+        return
+    result = response.json()
+    outcome = result.get('response') or {}
+    failures = outcome.get('failures', []) + ([result['error']] if 'error' in result else [])
+    logging.log(logging.WARNING if failures else logging.INFO, "{} ({}) ended after {}, {} of {} docs, {} version conflicts, {} failures{}".format(
+        task_id, task.get('description', ''), formatDuration(outcome.get('took', 0) / 1000), docsDone(outcome), outcome.get('total', 0),
+        outcome.get('version_conflicts', 0), len(failures), ", cancelled {}".format(outcome['canceled']) if outcome.get('canceled') else ": {}".format(failures[0]) if failures else ''))
+
+
+def watchTasks(cluster_url, interval=10, count=None, show_slices=False):
+    previous = None
+    sampled_at = None
+    samples = 0
+    try:
+        while count is None or samples < count:
+            tasks = listTasks(cluster_url)
+            now = time.monotonic()
+            progress = taskProgress(tasks, previous, now - sampled_at if sampled_at else None)
+            if previous:
+                for task_id in previous:
+                    if task_id not in tasks and previous[task_id].get('parent_task_id') not in previous:
+                        reportFinished(cluster_url, task_id, previous[task_id])
+            printTasks(tasks, progress, show_slices)
+            previous, sampled_at = tasks, now
+            samples += 1
+            if count is None or samples < count:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+# tasks matching all of the given filters. slices are left out, cancelling their parent cancels them
+def matchTasks(tasks, action=None, node=None, older_than=None, description=None):
+    matched = {}
+    for task_id, task in tasks.items():
+        if task.get('parent_task_id') in tasks:
+            continue
+        if action and not fnmatch.fnmatch(task.get('action', ''), action if '*' in action else '*' + action + '*'):
+            continue
+        if node and node not in (task.get('node_name'), task.get('node')):
+            continue
+        if older_than is not None and task.get('running_time_in_nanos', 0) / 1e9 < older_than:
+            continue
+        if description and description not in task.get('description', ''):
+            continue
+        matched[task_id] = task
+    return matched
+
+
+def cancelTasks(cluster_url, tasks, confirm=False):
+    for task_id, task in tasks.items():
+        command = "curl -XPOST '{}/_tasks/{}/_cancel'".format(cluster_url, task_id)
+        if not confirm:
+            print(command + "  # {} on {}, running {}".format(task.get('description', ''), task.get('node_name'), formatDuration(task.get('running_time_in_nanos', 0) / 1e9)))
+            continue
+        response = validate_cluster.transport.post("{}/_tasks/{}/_cancel".format(cluster_url, task_id))
+        if response.status_code == 200:
+            logging.info("cancelled {} ({})".format(task_id, task.get('description', '')))
+        else:
+            logging.error("cancel of {} returned {}: {}".format(task_id, response.status_code, response.text[:200]))
+    if not confirm and tasks:
+        logging.info("{} tasks match, run again with --yes to cancel them".format(len(tasks)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cluster_url", default="http://localhost:9200", help="URL of the Elasticsearch cluster")
+    parser.add_argument("--calls_per_second", type=float, default=10, help="rate limit for calls to the cluster")
+    commands = parser.add_subparsers(dest="command")
+    watch = commands.add_parser("watch", help="show progress, rates and eta of the running tasks")
+    watch.add_argument("--interval", type=float, default=10, help="seconds between samples")
+    watch.add_argument("--count", type=int, default=None, help="stop after this many samples")
+    watch.add_argument("--once", action="store_true", help="take a single sample, rates are the averages since each task started")
+    watch.add_argument("--show_slices", action="store_true", help="list the slices of sliced tasks under their parent")
+    cancel = commands.add_parser("cancel", help="cancel the running tasks matching all of the filters")
+    cancel.add_argument("--action", help="action pattern like '*byquery' or a part of it like reindex")
+    cancel.add_argument("--node", help="name or id of the node the task runs on")
+    cancel.add_argument("--older_than", type=float, default=None, help="only tasks running longer than this many seconds")
+    cancel.add_argument("--description", help="part of the task description, like an index name")
+    cancel.add_argument("--yes", action="store_true", help="cancel, without it the matching tasks are only listed")
+    args = parser.parse_args()
+    validate_cluster.configureTransport(calls_per_second=args.calls_per_second)
+
+    if args.command == "cancel":
+        if not (args.action or args.node or args.older_than is not None or args.description):
+            parser.error("cancel needs at least one of --action, --node, --older_than and --description")
+        cancelTasks(args.cluster_url, matchTasks(listTasks(args.cluster_url), args.action, args.node, args.older_than, args.description), confirm=args.yes)
+    else:
+        watchTasks(args.cluster_url, interval=getattr(args, 'interval', 10), count=1 if getattr(args, 'once', False) else getattr(args, 'count', None), show_slices=getattr(args, 'show_slices', False))
+    validate_cluster.transport.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# hot/warm placement of the indices from their age, search and indexing rate and size (see analyzeTiering), in place of
+# the hand kept index lists of scripts/designate_warm.sh and scripts/designate_hot.sh.
+# the cluster is sampled twice, --window seconds apart, for the rates. the moves are batched into settings updates of many
+# indices at once, box_type when the nodes have a box_type attribute and _tier_preference when they have data_hot/data_warm roles.
+
+# pacing: relocations are limited per node by indices.recovery.max_bytes_per_sec, the sweep may use --budget_share of it
+# on every pair of hot and warm nodes. a batch holds at most --batch_seconds of relocations at that budget, and the next
+# batch starts once the relocations of the last one are done and its bytes took at least that long at the budget,
+# so the sweep never takes more recovery bandwidth than the budget on average and live recoveries keep their share.
+# with indices.recovery.max_bytes_per_sec 0 (not throttled) or --budget_share 0 there is no budget and batches are not paced.
+
+# nothing changes without --execute, the plan is only printed
+# python tier_planner.py --cluster_url http://localhost:9200 --warm_after_days 30
+# python tier_planner.py --cluster_url http://localhost:9200 --execute --budget_share 0.5 --batch_seconds 600
+
+# after every batch the shards of its indices are checked to be on the target tier, an allocation filter or decider which
+# keeps them where they are is logged rather than taken for a finished batch.
+# on ctrl-c no new batch starts, the shards of the batches already sent keep relocating
+
+import argparse
+import logging
+import time
+
+import requests
+
+import validate_cluster
+from validate_cluster import ClusterSnapshot, analyzeTiering, formatBytes, gatherIndexLevelData, getAllNodeLevelDetails, getClusterLevelSettings, getNodeAttributes, getShardLevelData
+
+
+# only the parts of the snapshot analyzeTiering reads
+def collectTieringSnapshot(cluster_url):
+    snapshot = ClusterSnapshot(cluster_url)
+    snapshot.nodes = getAllNodeLevelDetails(cluster_url)
+    snapshot.node_attrs = getNodeAttributes(cluster_url)
+    snapshot.shards = getShardLevelData(cluster_url)
+    snapshot.cluster_settings = getClusterLevelSettings(cluster_url)
+    snapshot.index_data = gatherIndexLevelData(cluster_url)
+    snapshot.sampled_at['index_data'] = time.monotonic()
+    return snapshot
+
+
+# None when the cluster did not answer, the relocations then count as still running
+def relocatingShards(cluster_url):
+    try:
+        response = validate_cluster.transport.get("{}/_cluster/health?filter_path=relocating_shards".format(cluster_url))
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        logging.warning("relocating shards unknown: {}".format(e.__class__.__name__))
+        return None
+    if response.status_code != 200:
+        return None
+    return response.json().get('relocating_shards', 0)
+
+
+def waitForRelocations(cluster_url, poll_interval):
+    while relocatingShards(cluster_url) != 0:
+        time.sleep(poll_interval)
+
+
+# indices of the batch with shard copies on nodes outside its target tier, tiers is {node: tier} of nodeTiers
+def misplacedIndices(cluster_url, batch, tiers):
+    indices = set(batch['indices'])
+    return sorted({shard.index for shard in getShardLevelData(cluster_url) if shard.index in indices and shard.node is not None and tiers.get(shard.node) != batch['to_tier']})
+
+
+def printPlan(moves, plan):
+    print("{:>4}  {:<40}{:<12}{:>8}{:>12}{:>12}{:>12}".format('rank', 'index', 'move', 'age', 'queries/s', 'docs/s', 'relocate'))
+    for move in moves:
+        print("{:>4}  {:<40}{:<12}{:>8}{:>12.2f}{:>12.2f}{:>12}".format(move['rank'], move['index'], "{}->{}".format(move['from_tier'], move['to_tier']),
+              "{:.0f}d".format(move['age_days']) if move['age_days'] is not None else '-', move['search_rate'], move['indexing_rate'], formatBytes(move['relocate_bytes'])))
+    if plan:
+        logging.info(plan['message'])
+        for batch in plan['batches']:
+            print(batch['command'])
+
+
+def runBatches(cluster_url, batches, budget, poll_interval, tiers):
+    done = 0
+    try:
+        for number, batch in enumerate(batches, 1):
+            started = time.monotonic()
+            response = validate_cluster.transport.put("{}/{}/_settings".format(cluster_url, ','.join(batch['indices'])), json=batch['settings'])
+            if response.status_code != 200:
+                logging.error("batch {} could not be applied: {} {}".format(number, response.status_code, response.text[:200]))
+                continue
+            logging.info("batch {}/{}: {} indices to {}, {} to relocate".format(number, len(batches), len(batch['indices']), batch['to_tier'], formatBytes(batch['relocate_bytes'])))
+            # the shards start relocating with the next reroute, give the first poll a moment
+            time.sleep(poll_interval)
+            waitForRelocations(cluster_url, poll_interval)
+            took = time.monotonic() - started
+            misplaced = misplacedIndices(cluster_url, batch, tiers)
+            if misplaced:
+                logging.warning("batch {}: {} indices still have shards outside the {} tier, check their allocation with _cluster/allocation/explain: {}".format(number, len(misplaced), batch['to_tier'], ', '.join(misplaced[:20])))
+            done += 1
+            if budget <= 0:
+                logging.info("batch {} relocated in {:.0f}s, {}/s".format(number, took, formatBytes(batch['relocate_bytes'] / took)))
+                continue
+            logging.info("batch {} relocated in {:.0f}s, {}/s against a budget of {}/s".format(number, took, formatBytes(batch['relocate_bytes'] / took), formatBytes(budget)))
+            remaining = batch['relocate_bytes'] / budget - took
+            if remaining > 0 and number < len(batches):
+                time.sleep(remaining)
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, {} of {} batches sent, the shards already moving keep relocating".format(done, len(batches)))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cluster_url", default="http://localhost:9200", help="URL of the Elasticsearch cluster")
+    parser.add_argument("--execute", action="store_true", help="apply the settings batch by batch, without it the plan is only printed")
+    parser.add_argument("--window", type=float, default=30, help="seconds between the two _cat/indices samples the rates are computed from")
+    parser.add_argument("--warm_after_days", type=float, default=30, help="age from which an index may move to warm")
+    parser.add_argument("--max_warm_search_rate", type=float, default=0.1, help="queries/s up to which an old index moves to warm")
+    parser.add_argument("--max_warm_indexing_rate", type=float, default=0.1, help="docs/s up to which an old index moves to warm, more brings a warm index back")
+    parser.add_argument("--hot_search_rate", type=float, default=1, help="queries/s above which a warm index moves back to hot")
+    parser.add_argument("--budget_share", type=float, default=0.5, help="share of indices.recovery.max_bytes_per_sec the relocations may use")
+    parser.add_argument("--batch_seconds", type=float, default=600, help="most seconds of relocations at the budget in one batch")
+    parser.add_argument("--max_batch_indices", type=int, default=50, help="most indices in one settings update")
+    parser.add_argument("--limit", type=int, default=None, help="apply at most this many batches")
+    parser.add_argument("--poll_interval", type=float, default=10, help="seconds between checks of the relocating shards")
+    parser.add_argument("--calls_per_second", type=float, default=10, help="rate limit for calls to the cluster")
+    args = parser.parse_args()
+    validate_cluster.configureTransport(calls_per_second=args.calls_per_second)
+
+    snapshot = collectTieringSnapshot(args.cluster_url)
+    findings = analyzeTiering(snapshot, window=args.window, warm_after_days=args.warm_after_days, max_warm_search_rate=args.max_warm_search_rate,
+                              max_warm_indexing_rate=args.max_warm_indexing_rate, hot_search_rate=args.hot_search_rate, budget_share=args.budget_share,
+                              batch_seconds=args.batch_seconds, max_batch_indices=args.max_batch_indices)
+    moves = [finding for finding in findings if finding['callout_name'].startswith('tier_move_to_')]
+    plan = next((finding for finding in findings if finding['callout_name'] == 'tiering_plan'), None)
+    if plan is None:
+        logging.info("No index needs to change tier" if validate_cluster.nodeTiers(snapshot)[0] else "The cluster has no hot and warm nodes, by box_type attribute or data_hot/data_warm role")
+        return
+    printPlan(moves, plan)
+    if not args.execute:
+        return
+
+    started = time.monotonic()
+    done = runBatches(args.cluster_url, plan['batches'][:args.limit], plan['budget_bytes_per_sec'], args.poll_interval, validate_cluster.nodeTiers(snapshot)[1])
+    validate_cluster.transport.close()
+    logging.info("{} batches applied in {:.0f}s".format(done, time.monotonic() - started))
+
+if __name__ == "__main__":
+    main()
@@ -29,34 +29,320 @@ from json2html import *
 import requests
 import json
 import argparse
+import numpy as np
+import os
+import sys
+import codecs
+import gzip
+import base64
+from html import escape
+from collections import deque, Counter
+from urllib.parse import urlsplit
 import time
+import random
+import bisect
+import threading
+import queue
+import inspect
 import logging
 from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 # API call throttling
-class APIThrottle:
-    def __init__(self, calls_per_second):
+# token bucket shared by all threads. tokens refill at calls_per_second up to burst, every call takes one token.
+# calls_per_second <= 0 disables the limit
+class TokenBucket:
+    def __init__(self, calls_per_second, burst=None):
         self.calls_per_second = calls_per_second
-        self.last_call = 0
+        self.capacity = burst if burst is not None else max(1, calls_per_second)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
 
     def wait(self):
-        current_time = time.time()
-        time_since_last_call = current_time - self.last_call
-        if time_since_last_call < 1 / self.calls_per_second:
-            time.sleep((1 / self.calls_per_second) - time_since_last_call)
-        self.last_call = time.time()
+        if self.calls_per_second <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.calls_per_second)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                sleep_for = (1 - self.tokens) / self.calls_per_second
+            time.sleep(sleep_for)
+
+
+# status codes worth retrying, es returns 429 when its queues are full and 503 while the master is being elected
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# a POST may have started something (a force merge or reindex task) even when its response got lost, so it is only
+# retried when es rejected it (429) or when it never left the client
+NON_IDEMPOTENT_METHODS = ('POST',)
+NON_IDEMPOTENT_RETRY_STATUS_CODES = (429,)
+
+
+# connection refused or connect timeout, the request never reached the cluster
+def requestNotSent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    return bool(error.args) and isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
 
-throttle = APIThrottle(10)  # Limit to 10 calls per second
+
+"""
+one transport for every call made to the cluster.
+- keep-alive connection pool shared by all threads, so each call does not open a new tcp/tls connection
+- gzip compressed responses, _cat apis compress very well
+- bounded retries with jittered exponential backoff on 429, 5xx, timeouts and connection errors. Retry-After is honoured for 429.
+  POSTs are only retried on 429 and on errors before the request was sent, a resent POST could start a second task
+- token bucket rate limit enforced on every attempt including retries
+once retries are exhausted the last response is returned so callers keep their status_code checks, and the last exception is raised for timeouts
+"""
+class ESTransport:
+    def __init__(self, calls_per_second=10, max_retries=3, backoff=0.5, max_backoff=30, timeout=30, pool_maxsize=16):
+        self.limiter = TokenBucket(calls_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip'})
+
+    def backoffDelay(self, attempt, response=None):
+        # full jitter so that parallel workers do not retry in lock step
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, min(self.max_backoff, int(response.headers['Retry-After'])))
+        return delay
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method not in NON_IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRY_STATUS_CODES
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if attempt == self.max_retries or not (idempotent or requestNotSent(e)):
+                    raise
+                logging.warning("{} {} failed with {}, retrying".format(method, url, e.__class__.__name__))
+            else:
+                if response.status_code not in retry_status_codes or attempt == self.max_retries:
+                    if response.status_code != 200:
+                        logging.warning("{} {} returned {}".format(method, url, response.status_code))
+                    return response
+                logging.warning("{} {} returned {}, retrying".format(method, url, response.status_code))
+                response.close()
+            time.sleep(self.backoffDelay(attempt, response))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+"""
+record and replay of every raw response the collectors and analyzers receive, so a run can be analysed again offline.
+a recording is a gzip compressed json lines file, a header line and then one line per response
+{"method": "GET", "path": "/_cat/shards?format=json&bytes=b&h=...", "body": null, "status": 200, "content": "[...]"}
+the path leaves out the cluster url and body is the json request body (allocation explain), together they are the key on replay.
+a key requested more than once (the samples taken by rate based analyzers) is replayed in the recorded order and the last one repeats
+"""
+RECORDING_FORMAT = 'es-validate-recording'
+
+def recordingKey(method, url, body):
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    return method, path, json.dumps(body, sort_keys=True) if body is not None else None
+
+
+# stands in for requests.Response with the parts the collectors use
+class RecordedResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# transport which saves every response it receives. responses are read fully before they are handed over,
+# so streamed collectors keep the whole body in memory while recording
+class RecordingTransport(ESTransport):
+    def __init__(self, record_file, cluster_url=None, **kwargs):
+        super().__init__(**kwargs)
+        self.record_lock = threading.Lock()
+        self.record_out = gzip.open(record_file, 'wt', encoding='utf-8')
+        self.record_out.write(json.dumps({'format': RECORDING_FORMAT, 'version': 1, 'cluster_url': cluster_url, 'recorded_at': time.time()}) + "\n")
+
+    # seconds between the two samples of a rate based analyzer, replayed in place of its window
+    def recordSample(self, sample, elapsed):
+        with self.record_lock:
+            self.record_out.write(json.dumps({'sample': sample, 'elapsed': elapsed}) + "\n")
+
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        content = response.content
+        method, path, body = recordingKey(method, url, kwargs.get('json'))
+        line = json.dumps({'method': method, 'path': path, 'body': body, 'status': response.status_code, 'content': content.decode('utf-8', errors='replace')})
+        with self.record_lock:
+            self.record_out.write(line + "\n")
+        return RecordedResponse(response.status_code, content)
+
+    def close(self):
+        super().close()
+        with self.record_lock:
+            self.record_out.close()
+
+
+# transport which answers from a recording and never touches the network
+class ReplayTransport:
+    def __init__(self, replay_file):
+        self.responses = {}
+        self.samples = {}
+        self.replay_lock = threading.Lock()
+        with gzip.open(replay_file, 'rt', encoding='utf-8') as replay_in:
+            self.header = json.loads(replay_in.readline())
+            if self.header.get('format') != RECORDING_FORMAT:
+                raise ValueError("{} is not a recording made with --record".format(replay_file))
+            for line in replay_in:
+                recorded = json.loads(line)
+                if 'sample' in recorded:
+                    self.samples.setdefault(recorded['sample'], deque()).append(recorded['elapsed'])
+                    continue
+                key = (recorded['method'], recorded['path'], recorded['body'])
+                self.responses.setdefault(key, deque()).append((recorded['status'], recorded['content'].encode('utf-8')))
+
+    def request(self, method, url, **kwargs):
+        key = recordingKey(method, url, kwargs.get('json'))
+        with self.replay_lock:
+            recorded = self.responses.get(key)
+            if not recorded:
+                logging.warning("{} {} is not in the recording".format(key[0], key[1]))
+                return RecordedResponse(404, b'{}')
+            status_code, content = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        return RecordedResponse(status_code, content)
+
+    # recorded seconds between the samples of an analyzer, default for recordings made before they were kept
+    def sampleElapsed(self, sample, default):
+        with self.replay_lock:
+            recorded = self.samples.get(sample)
+            if not recorded:
+                return default
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def close(self):
+        pass
+
+
+transport = ESTransport(calls_per_second=10)  # Limit to 10 calls per second
+
+# progress bars are turned off in --watch mode where they would repeat on every scan
+show_progress = True
+
+
+def configureTransport(record_file=None, replay_file=None, cluster_url=None, **kwargs):
+    global transport
+    if replay_file:
+        transport = ReplayTransport(replay_file)
+    elif record_file:
+        transport = RecordingTransport(record_file, cluster_url=cluster_url, **kwargs)
+    else:
+        transport = ESTransport(**kwargs)
+    return transport
+
+
+# the _cat apis are always called with bytes=b and time=ms so sizes and durations come back as plain numbers.
+# _cat still sends them as json strings, parseCatRow turns the listed columns into numbers once at collection time
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+TB = 1024 * GB
+PB = 1024 * TB
+BYTE_UNITS = {'b': 1, 'kb': KB, 'mb': MB, 'gb': GB, 'tb': TB, 'pb': PB}
+
+def parseCatRow(row, numeric_columns):
+    for column in numeric_columns:
+        value = row.get(column)
+        if value is None or value == '':
+            row[column] = None
+        elif isinstance(value, str):
+            row[column] = float(value) if '.' in value else int(value)
+    return row
+
+
+# only for values which es cannot return in bytes, like the byte size settings in _cluster/settings e.g. "40mb".
+# es also takes the short units "200m" or "1g" for those
+def parseByteSize(value):
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    number = value.rstrip('kmgtpb')
+    unit = value[len(number):] or 'b'
+    if not unit.endswith('b'):
+        unit += 'b'
+    return float(number) * BYTE_UNITS[unit]
+
+
+def formatBytes(value):
+    if value is None:
+        return None
+    for unit in ['pb', 'tb', 'gb', 'mb', 'kb']:
+        if value >= BYTE_UNITS[unit]:
+            return "{:.1f}{}".format(value / BYTE_UNITS[unit], unit)
+    return "{}b".format(int(value))
 
 
 def getAllIndices(cluster_url="http://localhost:9200"):
     indices = []
-    url = "{}/_cat/indices?format=json".format(cluster_url)
-    response = requests.get(url)
+    url = "{}/_cat/indices?format=json&h=index".format(cluster_url)
+    response = transport.get(url)
     if response.status_code == 200:
         for index in response.json():
             indices.append(index['index'])
@@ -92,7 +378,7 @@ curl -H 'User-Agent: python-requests/2.31.0' 'http://orderes-staging.paytm.inter
 
 def getIndexLevelSettings(index, cluster_url="http://localhost:9200"):
     url = "{}/{}/_settings".format(cluster_url, index)
-    response = requests.get(url)
+    response = transport.get(url)
     # print(to_curl(response.request))
     if response.status_code == 200:
         index_dict = {}
@@ -100,6 +386,7 @@ def getIndexLevelSettings(index, cluster_url="http://localhost:9200"):
         index_dict['refresh_interval'] =  response.json()[index]['settings']['index'].get('refresh_interval',0)
         index_dict['number_of_shards'] =  response.json()[index]['settings']['index'].get('number_of_shards',0)
         index_dict['creation_date'] =  response.json()[index]['settings']['index'].get('creation_date',0)        
+        index_dict.update(indexTier(response.json()[index]['settings']['index']))
         return index_dict
     else:
         return {}
@@ -107,7 +394,7 @@ def getIndexLevelSettings(index, cluster_url="http://localhost:9200"):
 
 """
 index details are retrieved in this way
-curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0' 'http://orderes-staging.paytm.internal/_cat/indices/mktorders-10005?format=json&pretty'
+curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0' 'http://orderes-staging.paytm.internal/_cat/indices/mktorders-10005?format=json&bytes=b&h=health,status,index,uuid,pri,rep,docs.count,docs.deleted,store.size,pri.store.size&pretty'
 [
   {
     "health" : "green",
@@ -118,18 +405,22 @@ curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0'
     "rep" : "1",
     "docs.count" : "33010",
     "docs.deleted" : "780",
-    "store.size" : "19.5mb",
-    "pri.store.size" : "9.7mb"
+    "store.size" : "20447232",
+    "pri.store.size" : "10171187"
   }
 ]
+counts and sizes are converted to numbers, sizes are in bytes
 """
+INDEX_COLUMNS = ['health', 'status', 'index', 'uuid', 'pri', 'rep', 'docs.count', 'docs.deleted', 'store.size', 'pri.store.size', 'search.query_total', 'indexing.index_total']
+INDEX_NUMERIC_COLUMNS = ['pri', 'rep', 'docs.count', 'docs.deleted', 'store.size', 'pri.store.size', 'search.query_total', 'indexing.index_total']
+
 def getIndexDetails(index, cluster_url="http://localhost:9200"):
-    url = "{}/_cat/indices/{}?format=json".format(cluster_url, index)
-    response = requests.get(url)
+    url = "{}/_cat/indices/{}?format=json&bytes=b&h={}".format(cluster_url, index, ",".join(INDEX_COLUMNS))
+    response = transport.get(url)
     if response.status_code == 200:
         # print(to_curl(response.request))
         if(len(response.json())>0):
-            return response.json()[0]
+            return parseCatRow(response.json()[0], INDEX_NUMERIC_COLUMNS)
         else:
             return {}
 
@@ -147,21 +438,27 @@ output of index level data will be in this format
     "status": "open",
     "index": "dashboard-2017-7-86",
     "uuid": "sHaZ_Y8MTTSw0mFvhSuchg",
-    "pri": "1",
-    "rep": "1",
-    "docs.count": "10",
-    "docs.deleted": "0",
-    "store.size": "103.6kb",
-    "pri.store.size": "69.4kb"
+    "pri": 1,
+    "rep": 1,
+    "docs.count": 10,
+    "docs.deleted": 0,
+    "store.size": 106086,
+    "pri.store.size": 71065
   }
 }
 
 """
-def gatherIndexLevelData(cluster_url="http://localhost:9200"):
+def gatherIndexLevelData(cluster_url="http://localhost:9200", bulk=True):
+    # bulk mode needs 2 requests for the whole cluster instead of 2 per index
+    if bulk:
+        all_settings = getAllIndexLevelSettings(cluster_url)
+        all_details = getAllIndexDetails(cluster_url)
+        return joinIndexLevelData(all_settings, all_details)
+
     indices = getAllIndices(cluster_url)
     # print(indices)
-    index_data = {}    
-    for index in tqdm(indices, desc="Processing indices"):
+    index_data = {}
+    for index in tqdm(indices, desc="Processing indices", disable=not show_progress):
         index_level_settings = getIndexLevelSettings(index, cluster_url)
         index_level_details = getIndexDetails(index, cluster_url)
         # put the data in json dict
@@ -169,9 +466,202 @@ def gatherIndexLevelData(cluster_url="http://localhost:9200"):
         # merge index_level_settings in index_data
         index_data[index].update(index_level_settings)
         # merge index_level_details in index_data
-        index_data[index].update(index_level_details)        
+        index_data[index].update(index_level_details)
+    return index_data
+
+
+"""
+settings of all the indices are retrieved in one call, filter_path keeps only the fields we read
+
+curl 'http://localhost:9200/_all/_settings?filter_path=*.settings.index.number_of_replicas,*.settings.index.refresh_interval,*.settings.index.number_of_shards,*.settings.index.creation_date'
+{
+  "mktorders-10005" : {
+    "settings" : {
+      "index" : {
+        "number_of_shards" : "1",
+        "creation_date" : "1697014386369",
+        "number_of_replicas" : "1"
+      }
+    }
+  }
+}
+returns dict of index name to the same dict getIndexLevelSettings returns for that index
+"""
+INDEX_SETTINGS_FIELDS = ['number_of_replicas', 'refresh_interval', 'number_of_shards', 'creation_date', 'routing.allocation']
+
+
+# box_type and _tier_preference an index is allocated by, from the index settings
+# "routing" : { "allocation" : { "include" : { "box_type" : "warm", "_tier_preference" : "data_warm,data_hot" } } }
+def indexTier(index_settings):
+    allocation = index_settings.get('routing', {}).get('allocation', {})
+    return {
+        'box_type': allocation.get('require', {}).get('box_type') or allocation.get('include', {}).get('box_type'),
+        'tier_preference': allocation.get('include', {}).get('_tier_preference'),
+    }
+
+def getAllIndexLevelSettings(cluster_url="http://localhost:9200"):
+    filter_path = ",".join("*.settings.index.{}".format(field) for field in INDEX_SETTINGS_FIELDS)
+    url = "{}/_all/_settings?filter_path={}".format(cluster_url, filter_path)
+    response = transport.get(url)
+    all_settings = {}
+    if response.status_code == 200:
+        for index, settings in response.json().items():
+            index_settings = settings.get('settings', {}).get('index', {})
+            index_dict = {}
+            index_dict['number_of_replicas'] = index_settings.get('number_of_replicas')
+            index_dict['refresh_interval'] = index_settings.get('refresh_interval', 0)
+            index_dict['number_of_shards'] = index_settings.get('number_of_shards', 0)
+            index_dict['creation_date'] = index_settings.get('creation_date', 0)
+            index_dict.update(indexTier(index_settings))
+            all_settings[index] = index_dict
+    return all_settings
+
+
+"""
+_cat/indices rows of all the indices in one call, keyed by index name.
+each row is the same dict getIndexDetails returns for that index
+"""
+def getAllIndexDetails(cluster_url="http://localhost:9200"):
+    url = "{}/_cat/indices?format=json&bytes=b&h={}".format(cluster_url, ",".join(INDEX_COLUMNS))
+    response = transport.get(url)
+    all_details = {}
+    if response.status_code == 200:
+        for row in response.json():
+            all_details[row['index']] = parseCatRow(row, INDEX_NUMERIC_COLUMNS)
+    return all_details
+
+
+"""
+joins the bulk settings and _cat/indices rows in memory by index name.
+output is in the same format as gatherIndexLevelData, settings first and then _cat/indices fields on top
+"""
+def joinIndexLevelData(all_settings, all_details):
+    index_data = {}
+    for index, details in all_details.items():
+        index_data[index] = {}
+        index_data[index].update(all_settings.get(index, {}))
+        index_data[index].update(details)
     return index_data
 
+"""
+segments of every shard copy, one row per lucene segment
+
+curl 'localhost:9200/_cat/segments?format=json&bytes=b&h=index,shard,prirep,node,docs.count,docs.deleted,size'
+[
+  { "index" : "my_index", "shard" : "0", "prirep" : "p", "node" : "node-1", "docs.count" : "10250", "docs.deleted" : "312", "size" : "1843212" },
+  ...
+]
+
+large clusters have millions of segments so the rows are streamed and summed per index right away:
+segments, shard copies, size, docs, deleted docs and reclaimable bytes, the part of every segment's size taken by its deleted docs
+"""
+SEGMENT_COLUMNS = ['index', 'shard', 'prirep', 'node', 'docs.count', 'docs.deleted', 'size']
+
+def getSegmentStats(cluster_url="http://localhost:9200"):
+    url = "{}/_cat/segments?format=json&bytes=b&h={}".format(cluster_url, ",".join(SEGMENT_COLUMNS))
+    response = transport.get(url, stream=True)
+    if response.status_code != 200:
+        response.close()
+        return {}
+    stats = {}
+    copies = {}
+    with response:
+        for row in iterJsonArray(response):
+            index = sys.intern(row['index'])
+            docs = int(row.get('docs.count') or 0)
+            deleted = int(row.get('docs.deleted') or 0)
+            size = int(row.get('size') or 0)
+            index_stats = stats.get(index)
+            if index_stats is None:
+                index_stats = stats[index] = {'segments': 0, 'size': 0, 'docs': 0, 'deleted_docs': 0, 'reclaimable_bytes': 0}
+                copies[index] = set()
+            index_stats['segments'] += 1
+            index_stats['size'] += size
+            index_stats['docs'] += docs
+            index_stats['deleted_docs'] += deleted
+            if deleted:
+                index_stats['reclaimable_bytes'] += size * deleted // (docs + deleted)
+            copies[index].add((row.get('shard'), row.get('prirep'), row.get('node')))
+    for index, index_stats in stats.items():
+        index_stats['shard_copies'] = len(copies[index])
+    return stats
+
+
+"""
+force merge candidates in the order they should run, most reclaimable bytes first.
+  an index whose deleted docs are at least min_deleted_ratio of its docs with at least min_reclaimable_bytes to gain
+  gets _forcemerge?only_expunge_deletes=true, which only rewrites the segments with deletes
+  an index with more than max_segments_per_shard segments per shard copy gets _forcemerge?max_num_segments=1,
+  only worth it for indices which are no longer written to
+closed indices and system indices (starting with a dot) are left out. used by analyzeSegments and force_merge_scheduler.py
+"""
+def rankForceMerges(index_data, segment_stats, min_deleted_ratio=0.2, max_segments_per_shard=50, min_reclaimable_bytes=GB):
+    candidates = []
+    for index, stats in segment_stats.items():
+        details = index_data.get(index, {})
+        if index.startswith('.') or details.get('status', 'open') != 'open':
+            continue
+        total_docs = stats['docs'] + stats['deleted_docs']
+        deleted_ratio = stats['deleted_docs'] / total_docs if total_docs else 0
+        segments_per_shard = stats['segments'] / stats['shard_copies'] if stats['shard_copies'] else 0
+        if deleted_ratio >= min_deleted_ratio and stats['reclaimable_bytes'] >= min_reclaimable_bytes:
+            reason, params = 'expunge_deletes', 'only_expunge_deletes=true'
+        elif segments_per_shard > max_segments_per_shard:
+            reason, params = 'merge_segments', 'max_num_segments=1'
+        else:
+            continue
+        candidates.append({
+            'index': index,
+            'reason': reason,
+            'params': params,
+            'deleted_ratio': deleted_ratio,
+            'segments': stats['segments'],
+            'segments_per_shard': segments_per_shard,
+            'reclaimable_bytes': stats['reclaimable_bytes'],
+            'store_bytes': stats['size'],
+        })
+    candidates.sort(key=lambda candidate: (candidate['reclaimable_bytes'], candidate['segments_per_shard']), reverse=True)
+    return candidates
+
+
+"""
+indices worth a force merge from the deleted docs and segments in _cat/segments, ranked the way force_merge_scheduler.py runs them.
+the docs.deleted of _cat/indices is reported too but the ratio is taken from the segments, which cover the replicas as well
+"""
+def analyzeSegments(snapshot, min_deleted_ratio=0.2, max_segments_per_shard=50, min_reclaimable_gb=1):
+    merge_data = []
+    candidates = rankForceMerges(snapshot.index_data, snapshot.segment_stats, min_deleted_ratio, max_segments_per_shard, min_reclaimable_gb * GB)
+    for rank, candidate in enumerate(candidates, 1):
+        index = candidate['index']
+        temp = {}
+        temp['type'] = 'index_level'
+        temp['callout_type'] = 'recommendation'
+        temp['callout_name'] = 'index_deleted_docs_high' if candidate['reason'] == 'expunge_deletes' else 'index_too_many_segments'
+        temp['index'] = index
+        temp['rank'] = rank
+        temp['value'] = candidate['reclaimable_bytes']
+        temp['store_bytes'] = candidate['store_bytes']
+        temp['deleted_ratio'] = candidate['deleted_ratio']
+        temp['segments'] = candidate['segments']
+        temp['segments_per_shard'] = candidate['segments_per_shard']
+        temp['index_docs_deleted'] = snapshot.index_data.get(index, {}).get('docs.deleted')
+        temp['command'] = "curl -XPOST '{}/{}/_forcemerge?{}'".format(snapshot.cluster_url, index, candidate['params'])
+        if candidate['reason'] == 'expunge_deletes':
+            temp['message'] = "#{} index {} has {:.0%} deleted docs, expunging them reclaims about {}".format(rank, index, candidate['deleted_ratio'], formatBytes(candidate['reclaimable_bytes']))
+        else:
+            temp['message'] = "#{} index {} has {:.0f} segments per shard copy, merging it to one segment per shard speeds up searches if it is no longer written to".format(rank, index, candidate['segments_per_shard'])
+        merge_data.append(temp)
+    if candidates:
+        temp_obj = {}
+        temp_obj['type'] = 'cluster_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'force_merge_candidates'
+        temp_obj['value'] = sum(candidate['reclaimable_bytes'] for candidate in candidates)
+        temp_obj['message'] = "{} indices would gain from a force merge, reclaiming about {}. run them throttled with python force_merge_scheduler.py --cluster_url {} --execute".format(len(candidates), formatBytes(temp_obj['value']), snapshot.cluster_url)
+        merge_data.append(temp_obj)
+    return merge_data
+
+
 """
 in this we will find index level inefficiencies in the cluster
 
@@ -187,67 +677,49 @@ following things will be reported
 
 """
 
-def analyzeIndexLevelDetails(cluster_url="localhost:9200"):
-    index_data = gatherIndexLevelData(cluster_url)
-    # print(index_data)
+def analyzeIndexLevelDetails(snapshot):
+    columns = snapshot.indexColumns()
+    rules = [
+        ('index_not_green', ~columns.health.equals('green')),
+        ('index_not_open', ~columns.status.equals('open')),
+        ('index_replication_factor_zero', columns.number_of_replicas == 0),
+        ('index_refresh_interval_negative', columns.refresh_disabled),
+    ]
     index_level_inefficiencies = []
-    for index in index_data:
-        # print(index)
-        # print(index_data[index])
-        # print("======================")
+    for row, callout_name in matchingRows(rules):
+        index = columns.names[row]
         temp = {}
         temp['type'] = 'index_level'
         temp['index'] = index
-        
-        if index_data[index]['health'] != 'green':
-            # make a copy of temp and add the reason
-            temp1 = temp.copy()
-            temp1['message'] = "index {} is not green. Its {}".format(index,index_data[index]['health'] )
-            #add callout_type
-            temp1['callout_type'] = 'warning' if index_data[index]['health']=='yellow' else 'alert'
-            temp1['index_health'] = index_data[index]['health']
-            temp1['callout_name'] = 'index_not_green'
-            index_level_inefficiencies.append(temp1)
-
-        if index_data[index]['status'] != 'open':
-            # make a copy of temp and add the reason
-            temp1 = temp.copy()
-            temp1['message'] = "index {} is not open".format(index)
-            #add callout_type
-            temp1['callout_type'] = 'warning'
-            temp1['callout_name'] = 'index_not_open'
-            index_level_inefficiencies.append(temp1)
-
-        if 'number_of_replicas' in index_data[index] and int(index_data[index]['number_of_replicas']) == 0:
-            # make a copy of temp and add the reason
-            temp1 = temp.copy()
-            temp1['message'] = "index {} has number_of_replicas 0".format(index)
-            #add callout_type
-            temp1['callout_type'] = 'alert'
-            temp1['callout_name'] = 'index_replication_factor_zero'
-            index_level_inefficiencies.append(temp1)
-
-        if 'refresh_interval' in index_data[index] and index_data[index]['refresh_interval'] == -1:
-            # make a copy of temp and add the reason
-            temp1 = temp.copy()
-            temp1['message'] = "index {} has refresh_interval -1. So new changes will not be searchable.".format(index)
-            #add callout_type
-            temp1['callout_type'] = 'alert'
-            temp1['callout_name'] = 'index_refresh_interval_negative'
-            index_level_inefficiencies.append(temp1)
-            
+        temp['store_bytes'] = int(columns.store_size[row])
+        if callout_name == 'index_not_green':
+            health = columns.health.value(row)
+            temp['message'] = "index {} is not green. Its {}".format(index, health)
+            temp['callout_type'] = 'warning' if health == 'yellow' else 'alert'
+            temp['index_health'] = health
+        elif callout_name == 'index_not_open':
+            temp['message'] = "index {} is not open".format(index)
+            temp['callout_type'] = 'warning'
+        elif callout_name == 'index_replication_factor_zero':
+            temp['message'] = "index {} has number_of_replicas 0".format(index)
+            temp['callout_type'] = 'alert'
+        else:
+            temp['message'] = "index {} has refresh_interval -1. So new changes will not be searchable.".format(index)
+            temp['callout_type'] = 'alert'
+        temp['callout_name'] = callout_name
+        index_level_inefficiencies.append(temp)
     return index_level_inefficiencies
             
 
 """
-call this api 'http://localhost:9200/_cat/shards?&format=json&pretty' to get the shard level details
+call this api 'http://localhost:9200/_cat/shards?format=json&bytes=b&h=index,shard,prirep,state,docs,store,ip,node&pretty' to get the shard level details
 [  {
     "index" : "mktorders_merged_data-480",
     "shard" : "63",
     "prirep" : "r",
     "state" : "STARTED",
     "docs" : "25238192",
-    "store" : "10.2gb",
+    "store" : "10952166604",
     "ip" : "10.60.54.130",
     "node" : "pawscartorderelasticsearch54130"
   },
@@ -257,61 +729,661 @@ call this api 'http://localhost:9200/_cat/shards?&format=json&pretty' to get the
     "prirep" : "p",
     "state" : "STARTED",
     "docs" : "25238192",
-    "store" : "10.7gb",
+    "store" : "11489037516",
     "ip" : "10.60.62.115",
     "node" : "pawscartorderelasticsearch62115"
   }
 ]
 loop through all the shards and create list of shards with store size less than 10gb or greater than 50gb
+
+the response is parsed incrementally as it is downloaded and every row is kept as a ShardRecord,
+so the full body and a dict per shard with its own copy of every key are never held in memory
 """
+SHARD_COLUMNS = ['index', 'shard', 'prirep', 'state', 'docs', 'store', 'ip', 'node', 'unassigned.at', 'unassigned.reason']
+
 def getShardLevelData(cluster_url="http://localhost:9200"):
-    url = "{}/_cat/shards?&format=json&pretty".format(cluster_url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        shards = response.json()
-        return shards
-    else:        
+    url = "{}/_cat/shards?format=json&bytes=b&h={}".format(cluster_url, ",".join(SHARD_COLUMNS))
+    response = transport.get(url, stream=True)
+    if response.status_code != 200:
+        response.close()
         return []
+    with response:
+        return [ShardRecord(row) for row in iterJsonArray(response)]
+
+
+# compact form of a _cat/shards row. __slots__ drops the per row dict and the repeated names are interned
+# so that all the shards of an index or a node share one string. docs and store (bytes) are ints, None when the shard is unassigned
+class ShardRecord:
+    __slots__ = ('index', 'shard', 'prirep', 'state', 'docs', 'store', 'ip', 'node', 'unassigned_at', 'unassigned_reason')
 
+    def __init__(self, row):
+        self.index = sys.intern(row['index'])
+        self.shard = int(row['shard'])
+        self.prirep = sys.intern(row['prirep'])
+        self.state = sys.intern(row['state'])
+        self.docs = int(row['docs']) if row.get('docs') else None
+        self.store = int(row['store']) if row.get('store') else None
+        self.ip = sys.intern(row['ip']) if row.get('ip') else None
+        self.node = sys.intern(row['node']) if row.get('node') else None
+        self.unassigned_at = sys.intern(row['unassigned.at']) if row.get('unassigned.at') else None
+        self.unassigned_reason = sys.intern(row['unassigned.reason']) if row.get('unassigned.reason') else None
 
-def analyzeShardLevelDetails(cluster_url="http://localhost:9200"):
-    shards = getShardLevelData(cluster_url)
+
+"""
+yields the elements of a json array response one at a time while it is being downloaded.
+meant for the _cat apis with format=json, which return an array of flat objects
+"""
+def iterJsonArray(response, chunk_size=1024 * 1024):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer += text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            # skip the opening bracket, whitespace and the commas between elements
+            while pos < len(buffer) and buffer[pos] in '[, \t\r\n':
+                pos += 1
+            if pos >= len(buffer) or buffer[pos] == ']':
+                break
+            try:
+                item, pos_after = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # element is cut at the chunk boundary, wait for the next chunk
+                break
+            yield item
+            pos = pos_after
+        buffer = buffer[pos:]
+
+
+def analyzeShardLevelDetails(snapshot):
+    columns = snapshot.shardColumns()
+    # store is in bytes, shard store does not exist for unassigned shards so it counts as 0
+    store_size = columns.store / GB
+    # generating recommendation for shards to be around 10 to 50 gb
+    rules = [
+        ('shard_lt_10gb', store_size < 10),
+        ('shard_gt_50gb', store_size > 50),
+    ]
     shard_wise = []
-    for shard in tqdm(shards, 'Processing shards'):        
-        # check shard store does not exist
-        if not shard.get('store'):
-            store_size = 0
-        # store size can be in mb or gb so convert them to gb and then compare. put culprit shards in array
-        elif shard['store'].endswith('gb'):
-            store_size = float(shard.get('store').split('gb')[0])
-        elif shard['store'].endswith('mb'):
-            store_size = float(shard.get('store').split('mb')[0])/1024
-        elif shard['store'].endswith('kb'):
-            store_size = float(shard.get('store').split('kb')[0])/(1024*1024)
+    for row, callout_name in matchingRows(rules):
+        index = columns.index.value(row)
+        shard = int(columns.shard[row])
+        store = formatBytes(int(columns.store[row])) if columns.assigned[row] else None
+        temp = {}
+        temp['type'] = 'shard_level'
+        temp['callout_name'] = callout_name
+        temp['callout_type'] = 'recommendation'
+        temp['index'] = index
+        temp['shard'] = shard
+        temp['node'] = columns.node.value(row)
+        temp['primary_or_replica'] = 'primary' if columns.primary[row] else 'replica'
+        temp['store_bytes'] = int(columns.store[row]) if columns.assigned[row] else None
+        if callout_name == 'shard_lt_10gb':
+            temp['message'] = "Index {} shard {} has store size {} which is less than 10gb".format(index, shard, store)
         else:
-            store_size = 0
-
-        # generating recommendation for shards to be around 10 to 50 gb
-        if store_size < 10:
-            temp = {}
-            temp['type'] = 'shard_level'
-            temp['callout_name'] = 'shard_lt_10gb'
-            temp['callout_type'] = 'recommendation'
-            temp['index'] = shard.get('index')
-            temp['shard'] = shard.get('shard')
-            temp['message'] = "Index {} shard {} has store size {} which is less than 10gb".format(shard.get('index')  ,shard.get('shard'), shard.get('store'))            
-            shard_wise.append(temp)
-        elif store_size > 50:
-            temp = {}
-            temp['type'] = 'shard_level'
-            temp['index'] = shard.get('index')
-            temp['shard'] = shard.get('shard')
-            temp['callout_name'] = 'shard_gt_50gb'
-            temp['callout_type'] = 'recommendation'
-            temp['message'] = "Index {} shard {} has store size {} which is greater than 50gb".format(shard.get('index')  ,shard.get('shard'), shard.get('store'))
-            shard_wise.append(temp)            
+            temp['message'] = "Index {} shard {} has store size {} which is greater than 50gb".format(index, shard, store)
+        shard_wise.append(temp)
     return shard_wise
 
+"""
+shard balance over the data nodes by shard count and by bytes, and indices piling up on one node.
+a node is skewed when its shard count or bytes are more than tolerance away from the mean of the data nodes.
+an index is co-located on a node when the node holds at least 2 more of its shard copies than an even share,
+losing that node hurts the index the most and searches on it all queue on the same node.
+
+the rebalance plan is a list of _cluster/reroute moves found greedily, see planShardMoves.
+its transfer time is estimated from indices.recovery.max_bytes_per_sec, which limits every node separately,
+so the node sending or receiving the most bytes decides it
+"""
+def analyzeShardBalance(snapshot, tolerance=0.1, max_moves=200, reroute_batch=20):
+    columns = snapshot.shardColumns()
+    data_nodes = [node.get('name') for node in snapshot.nodes if DATA_ROLES & set(node.get('node.role') or '')]
+    if len(data_nodes) < 2:
+        return []
+    node_positions = {name: position for position, name in enumerate(data_nodes)}
+    # position of every shard's node among the data nodes, -1 for unassigned shards and unknown nodes
+    shard_node = np.array([node_positions.get(name, -1) for name in columns.node.names], dtype=np.int64)[columns.node.codes] if len(columns.node.codes) else np.zeros(0, dtype=np.int64)
+    placed = shard_node >= 0
+    node_count = len(data_nodes)
+    shard_counts = np.bincount(shard_node[placed], minlength=node_count)
+    shard_bytes = np.bincount(shard_node[placed], weights=columns.store[placed], minlength=node_count)
+    mean_count = shard_counts.mean()
+    mean_bytes = shard_bytes.mean()
+
+    balance_data = []
+    rules = [
+        ('shard_count_skew', np.abs(shard_counts - mean_count) > mean_count * tolerance),
+        ('shard_bytes_skew', np.abs(shard_bytes - mean_bytes) > mean_bytes * tolerance),
+    ]
+    for row, callout_name in matchingRows(rules):
+        temp_obj = {}
+        temp_obj['type'] = 'node_level'
+        temp_obj['callout_type'] = 'warning'
+        temp_obj['callout_name'] = callout_name
+        temp_obj['node'] = data_nodes[row]
+        temp_obj['shards'] = int(shard_counts[row])
+        temp_obj['store_bytes'] = int(shard_bytes[row])
+        if callout_name == 'shard_count_skew':
+            temp_obj['value'] = int(shard_counts[row])
+            temp_obj['message'] = "node {} holds {} shards while the data nodes average {:.1f}".format(data_nodes[row], int(shard_counts[row]), mean_count)
+        else:
+            temp_obj['value'] = int(shard_bytes[row])
+            temp_obj['message'] = "node {} holds {} of shards while the data nodes average {}".format(data_nodes[row], formatBytes(int(shard_bytes[row])), formatBytes(int(mean_bytes)))
+        balance_data.append(temp_obj)
+
+    # copies of every index per node, an index's even share is its copies spread over all data nodes
+    pairs = columns.index.codes[placed].astype(np.int64) * node_count + shard_node[placed]
+    index_node_copies = np.bincount(pairs, minlength=len(columns.index.names) * node_count).reshape(len(columns.index.names), node_count)
+    even_share = np.ceil(index_node_copies.sum(axis=1) / node_count)[:, None]
+    for index_code, row in zip(*np.nonzero(index_node_copies > even_share + 1)):
+        temp = {}
+        temp['type'] = 'index_level'
+        temp['callout_type'] = 'recommendation'
+        temp['callout_name'] = 'index_shards_colocated'
+        temp['index'] = columns.index.names[index_code]
+        temp['node'] = data_nodes[row]
+        temp['value'] = int(index_node_copies[index_code, row])
+        temp['message'] = "node {} holds {} shard copies of index {} while an even spread is {}".format(data_nodes[row], int(index_node_copies[index_code, row]), columns.index.names[index_code], int(even_share[index_code, 0]))
+        balance_data.append(temp)
+
+    started = np.fromiter((shard.state == 'STARTED' for shard in snapshot.shards), dtype=bool, count=len(snapshot.shards))
+    moves = planShardMoves(columns, shard_node, started & placed, data_nodes, shard_counts, shard_bytes, tolerance, max_moves)
+    if moves:
+        max_bytes_per_sec = parseByteSize(clusterSetting(snapshot.cluster_settings, 'indices.recovery.max_bytes_per_sec', '40mb'))
+        moved_per_node = Counter()
+        for move in moves:
+            moved_per_node[move['from_node']] += move['bytes']
+            moved_per_node[move['to_node']] += move['bytes']
+        total_bytes = sum(move['bytes'] for move in moves)
+        # 0 means recoveries are not throttled, there is no rate to estimate the time with
+        estimated_seconds = max(moved_per_node.values()) / max_bytes_per_sec if max_bytes_per_sec > 0 else None
+        commands = []
+        for start in range(0, len(moves), reroute_batch):
+            body = {'commands': [{'move': {key: move[key] for key in ['index', 'shard', 'from_node', 'to_node']}} for move in moves[start:start + reroute_batch]]}
+            commands.append("curl -XPOST '{}/_cluster/reroute' -H 'Content-Type: application/json' -d '{}'".format(snapshot.cluster_url, json.dumps(body)))
+        counts_after = np.array(shard_counts, dtype=np.float64)
+        bytes_after = np.array(shard_bytes, dtype=np.float64)
+        for move in moves:
+            for name, sign in [(move['from_node'], -1), (move['to_node'], 1)]:
+                counts_after[node_positions[name]] += sign
+                bytes_after[node_positions[name]] += sign * move['bytes']
+        temp_obj = {}
+        temp_obj['type'] = 'cluster_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'shard_rebalance_plan'
+        temp_obj['value'] = len(moves)
+        temp_obj['store_bytes'] = total_bytes
+        temp_obj['estimated_seconds'] = estimated_seconds
+        temp_obj['max_bytes_per_sec'] = max_bytes_per_sec
+        temp_obj['count_spread'] = [int(shard_counts.min()), int(shard_counts.max()), int(counts_after.min()), int(counts_after.max())]
+        temp_obj['bytes_spread'] = [int(shard_bytes.min()), int(shard_bytes.max()), int(bytes_after.min()), int(bytes_after.max())]
+        temp_obj['moves'] = moves
+        temp_obj['commands'] = commands
+        if estimated_seconds is not None:
+            duration = "it takes about {:.0f} minutes at indices.recovery.max_bytes_per_sec {}/s".format(estimated_seconds / 60, formatBytes(max_bytes_per_sec))
+        else:
+            duration = "indices.recovery.max_bytes_per_sec is 0 so recoveries are not throttled and run as fast as disks and network allow"
+        temp_obj['message'] = "moving {} shards ({}) balances the data nodes from {} to {} shards and {} to {} per node into {} to {} shards and {} to {}. {}".format(
+            len(moves), formatBytes(total_bytes), int(shard_counts.min()), int(shard_counts.max()), formatBytes(int(shard_bytes.min())), formatBytes(int(shard_bytes.max())),
+            int(counts_after.min()), int(counts_after.max()), formatBytes(int(bytes_after.min())), formatBytes(int(bytes_after.max())), duration)
+        temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/cluster-reroute.html"
+        balance_data.append(temp_obj)
+    return balance_data
+
+
+"""
+greedy plan of shard moves which brings every data node within tolerance of the mean shard count and bytes while moving few bytes.
+  first the nodes with most shards give shards to the nodes with fewest. when the destination is also short of bytes the shard
+  that best fits the byte gap goes, otherwise the smallest one as small shards fix counts cheaply.
+  then the nodes above the mean bytes give the largest shard which fits both the excess of the source and the room
+  of the destination below the mean (best fit), so each move closes as much of the gap as possible without overshooting.
+a shard never goes to a node which already has a copy of it (elasticsearch refuses that) and a move is only taken when it does not
+push the destination over either target. stops after max_moves
+"""
+# largest of the rows (sorted by store, stores holds their sizes) whose store fits room and which is allowed, None when there is none
+def pickShard(rows, stores, room, allowed):
+    if room <= 0:
+        return None
+    for position in range(bisect.bisect_right(stores, room) - 1, -1, -1):
+        if allowed(rows[position]):
+            return rows[position]
+    return None
+
+
+# smallest of the rows (sorted by store) whose store fits room and which is allowed, None when there is none
+def smallestShard(rows, stores, room, allowed):
+    for position in range(bisect.bisect_right(stores, room)):
+        if allowed(rows[position]):
+            return rows[position]
+    return None
+
+
+def planShardMoves(columns, shard_node, movable, data_nodes, shard_counts, shard_bytes, tolerance=0.1, max_moves=200):
+    counts = shard_counts.astype(np.int64).copy()
+    sizes = shard_bytes.astype(np.float64).copy()
+    count_target = int(np.ceil(counts.mean() * (1 + tolerance)))
+    bytes_target = sizes.mean() * (1 + tolerance)
+    # (index code, shard number) -> nodes holding a copy, for the same shard rule
+    copies = {}
+    for row in np.nonzero(shard_node >= 0)[0].tolist():
+        copies.setdefault((int(columns.index.codes[row]), int(columns.shard[row])), set()).add(int(shard_node[row]))
+    rows_by_node = [[] for name in data_nodes]
+    for row in np.nonzero(movable)[0].tolist():
+        rows_by_node[int(shard_node[row])].append(row)
+    for rows in rows_by_node:
+        rows.sort(key=lambda row: columns.store[row])
+    # store of the rows of every node in the same order, sorted once and kept sorted by move for bisect
+    stores_by_node = [[float(columns.store[row]) for row in rows] for rows in rows_by_node]
+
+    moves = []
+
+    def move(row, source, destination):
+        store = float(columns.store[row])
+        position = rows_by_node[source].index(row, bisect.bisect_left(stores_by_node[source], store))
+        del rows_by_node[source][position]
+        del stores_by_node[source][position]
+        position = bisect.bisect_left(stores_by_node[destination], store)
+        rows_by_node[destination].insert(position, row)
+        stores_by_node[destination].insert(position, store)
+        key = (int(columns.index.codes[row]), int(columns.shard[row]))
+        copies[key].discard(source)
+        copies[key].add(destination)
+        counts[source] -= 1
+        counts[destination] += 1
+        sizes[source] -= columns.store[row]
+        sizes[destination] += columns.store[row]
+        moves.append({'index': columns.index.value(row), 'shard': int(columns.shard[row]), 'from_node': data_nodes[source], 'to_node': data_nodes[destination], 'bytes': int(columns.store[row])})
+
+    def allowed(row, destination):
+        return destination not in copies[(int(columns.index.codes[row]), int(columns.shard[row]))]
+
+    count_mean = counts.mean()
+    count_lower = int(np.floor(count_mean * (1 - tolerance)))
+    while len(moves) < max_moves and (counts.max() > count_target or counts.min() < count_lower):
+        moved = False
+        for source in np.argsort(-counts, kind='stable').tolist():
+            if counts[source] <= count_mean:
+                break
+            for destination in np.argsort(counts, kind='stable').tolist():
+                if counts[destination] >= count_mean or counts[source] - counts[destination] < 2:
+                    break
+                row = pickShard(rows_by_node[source], stores_by_node[source], min(sizes[source] - sizes.mean(), sizes.mean() - sizes[destination]), lambda row: allowed(row, destination))
+                if row is None:
+                    row = smallestShard(rows_by_node[source], stores_by_node[source], bytes_target - sizes[destination], lambda row: allowed(row, destination))
+                if row is not None:
+                    move(row, source, destination)
+                    moved = True
+                    break
+            if moved:
+                break
+        if not moved:
+            break
+
+    bytes_mean = sizes.mean()
+    bytes_lower = bytes_mean * (1 - tolerance)
+    while len(moves) < max_moves and (sizes.max() > bytes_target or sizes.min() < bytes_lower):
+        moved = False
+        for source in np.argsort(-sizes, kind='stable').tolist():
+            if sizes[source] <= bytes_mean:
+                break
+            for destination in np.argsort(sizes, kind='stable').tolist():
+                if sizes[destination] >= bytes_mean:
+                    break
+                if counts[destination] + 1 > count_target:
+                    continue
+                row = pickShard(rows_by_node[source], stores_by_node[source], min(sizes[source] - bytes_mean, bytes_mean - sizes[destination]), lambda row: allowed(row, destination))
+                if row is not None:
+                    move(row, source, destination)
+                    moved = True
+                    break
+            if moved:
+                break
+        if not moved:
+            break
+    return moves
+
+
+# heap every shard copy costs on its node whatever its size (segments, mappings, cluster state), used to rank the sizing plans
+SHARD_HEAP_OVERHEAD = 50 * MB
+# elastic advises to keep shards below 200 million documents
+MAX_DOCS_PER_SHARD = 200 * 1000 * 1000
+
+"""
+per index plan to bring its primaries between min_gb and max_gb, instead of one shard_lt_10gb / shard_gt_50gb line per shard.
+the index is assumed to have grown evenly since creation_date, its primary store size horizon_days from now is
+  pri.store.size + pri.store.size / age in days * min(horizon_days, age in days)
+and the target primary count is that size over target_gb, at least enough primaries to keep below MAX_DOCS_PER_SHARD.
+the target is then fitted to what elasticsearch can do in place:
+  _shrink to a factor of the current primaries, the smallest factor not below the target
+  _split to the current primaries times a power of 2, the default number_of_routing_shards allows those
+  reindex into a new index when shrinking can not get closer (a prime number of primaries)
+plans are ranked by shard copies saved (primaries and replicas) and the heap that frees, splits rank last as they add shards
+"""
+def analyzeShardSizing(snapshot, target_gb=30, min_gb=10, max_gb=50, horizon_days=30):
+    columns = snapshot.indexColumns()
+    now_ms = time.time() * 1000
+    primaries = columns.primaries.astype(np.float64)
+    age_days = np.maximum((now_ms - columns.creation_date) / (24 * 3600 * 1000), 1)
+    known_age = columns.creation_date > 0
+    # an index younger than the horizon is only expected to grow as much again, a day old index is not projected 30 times its size
+    growth_factor = np.where(known_age, 1 + np.minimum(horizon_days, age_days) / age_days, 1)
+    projected = columns.pri_store_size * growth_factor
+    # docs.count of _cat/indices counts the primaries only
+    projected_docs = columns.docs * growth_factor
+    target = np.maximum(np.ceil(projected / (target_gb * GB)), np.ceil(projected_docs / MAX_DOCS_PER_SHARD))
+    target = np.maximum(target, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shard_size = projected / primaries
+    rules = [
+        ('shard_sizing_plan', columns.status.equals('open') & (primaries > 0) & ((shard_size < min_gb * GB) | (shard_size > max_gb * GB)) & (target != primaries)),
+    ]
+
+    plans = []
+    for row, callout_name in matchingRows(rules):
+        index = columns.names[row]
+        current = int(primaries[row])
+        wanted = int(target[row])
+        replicas = max(int(columns.number_of_replicas[row]), 0)
+        if wanted < current:
+            factor = min(factor for factor in range(1, current + 1) if current % factor == 0 and factor >= wanted)
+            if factor < current:
+                operation, new_primaries = 'shrink', factor
+            else:
+                operation, new_primaries = 'reindex', wanted
+        else:
+            new_primaries = current
+            while new_primaries < wanted:
+                new_primaries *= 2
+            operation = 'split'
+        saved = (current - new_primaries) * (1 + replicas)
+        plans.append({
+            'index': index,
+            'operation': operation,
+            'current_primaries': current,
+            'target_primaries': new_primaries,
+            'replicas': replicas,
+            'pri_store_bytes': int(columns.pri_store_size[row]),
+            'projected_bytes': int(projected[row]),
+            'shard_copies_saved': saved,
+            'heap_saved_bytes': saved * SHARD_HEAP_OVERHEAD,
+        })
+    plans.sort(key=lambda plan: (plan['shard_copies_saved'], plan['pri_store_bytes']), reverse=True)
+
+    sizing_data = []
+    holders = primaryHolders(snapshot)
+    for rank, plan in enumerate(plans, 1):
+        index = plan['index']
+        temp = {}
+        temp['type'] = 'index_level'
+        temp['callout_type'] = 'recommendation'
+        temp['callout_name'] = 'shard_sizing_' + plan['operation']
+        temp.update(plan)
+        temp['rank'] = rank
+        temp['store_bytes'] = plan['pri_store_bytes']
+        temp['value'] = plan['shard_copies_saved']
+        temp['steps'] = shardSizingSteps(snapshot.cluster_url, plan, holders.get(index))
+        size_now = formatBytes(plan['pri_store_bytes'] / plan['current_primaries'])
+        size_then = formatBytes(plan['projected_bytes'] / plan['target_primaries'])
+        if plan['shard_copies_saved'] >= 0:
+            effect = "saves {} shard copies and about {} of heap".format(plan['shard_copies_saved'], formatBytes(plan['heap_saved_bytes']))
+        else:
+            effect = "adds {} shard copies".format(-plan['shard_copies_saved'])
+        temp['message'] = "#{} {} index {} from {} to {} primaries: {} per primary now, {} in {} days. {}. the last step deletes {} once the doc counts match".format(
+            rank, plan['operation'], index, plan['current_primaries'], plan['target_primaries'], size_now, size_then, horizon_days, effect, index)
+        sizing_data.append(temp)
+    if plans:
+        saved = sum(plan['shard_copies_saved'] for plan in plans)
+        temp_obj = {}
+        temp_obj['type'] = 'cluster_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'shard_sizing_summary'
+        temp_obj['value'] = saved
+        temp_obj['operations'] = dict(Counter(plan['operation'] for plan in plans))
+        temp_obj['message'] = "{} indices can be resized ({}), together they change the shard copies by {} and the heap used for shards by about {}".format(
+            len(plans), ', '.join("{} {}".format(count, operation) for operation, count in Counter(plan['operation'] for plan in plans).items()), -saved, formatBytes(abs(saved) * SHARD_HEAP_OVERHEAD) if saved >= 0 else "+" + formatBytes(-saved * SHARD_HEAP_OVERHEAD))
+        temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/size-your-shards.html"
+        sizing_data.append(temp_obj)
+    return sizing_data
+
+
+# node holding most primaries of every index, a shrink needs a copy of every shard on one node and this one needs the fewest moves
+def primaryHolders(snapshot):
+    counts = {}
+    for shard in snapshot.shards:
+        if shard.prirep == 'p' and shard.node is not None:
+            counts.setdefault(shard.index, Counter())[shard.node] += 1
+    return {index: nodes.most_common(1)[0][0] for index, nodes in counts.items()}
+
+
+def curlStep(method, url, body=None):
+    if body is None:
+        return "curl -X{} '{}'".format(method, url)
+    return "curl -X{} '{}' -H 'Content-Type: application/json' -d '{}'".format(method, url, json.dumps(body))
+
+
+"""
+ready to run steps of a sizing plan, to be run one after the other. the resized index gets a new name and then takes the place
+of the old one through an alias of the old name (remove_index and add in one _aliases call), so clients keep working.
+writes are blocked while it runs. remove_index DELETES the original index, so the swap step only runs when the doc counts
+of the old and the new index match (_cat/count after a refresh of the new one) and prints a warning instead otherwise.
+the reindex runs with wait_for_completion=true so the next steps only start once every document is copied
+"""
+def shardSizingSteps(cluster_url, plan, holder=None):
+    index = plan['index']
+    new_index = "{}-{}{}".format(index, plan['operation'], plan['target_primaries'])
+    wait_green = curlStep('GET', "{}/_cluster/health/{}?wait_for_status=green&timeout=60m".format(cluster_url, new_index))
+    refresh = curlStep('POST', "{}/{}/_refresh".format(cluster_url, new_index))
+    swap = "# the swap deletes {} (remove_index), it only runs when both indices hold the same number of docs\n".format(index) + \
+        "old=$(curl -sf '{0}/_cat/count/{1}?h=count'); new=$(curl -sf '{0}/_cat/count/{2}?h=count'); [ -n \"$old\" ] && [ \"$old\" = \"$new\" ] && {3} || echo \"doc counts of {1} ($old) and {2} ($new) differ, not swapping\"".format(
+            cluster_url, index, new_index, curlStep('POST', "{}/_aliases".format(cluster_url), {'actions': [{'remove_index': {'index': index}}, {'add': {'index': new_index, 'alias': index}}]}))
+    if plan['operation'] == 'shrink':
+        return [
+            curlStep('PUT', "{}/{}/_settings".format(cluster_url, index), {'settings': {'index.number_of_replicas': 0, 'index.routing.allocation.require._name': holder, 'index.blocks.write': True}}),
+            curlStep('GET', "{}/_cluster/health/{}?wait_for_no_relocating_shards=true&timeout=60m".format(cluster_url, index)),
+            curlStep('POST', "{}/{}/_shrink/{}".format(cluster_url, index, new_index), {'settings': {'index.number_of_shards': plan['target_primaries'], 'index.number_of_replicas': plan['replicas'], 'index.routing.allocation.require._name': None, 'index.blocks.write': None}}),
+            wait_green,
+            refresh,
+            swap,
+        ]
+    if plan['operation'] == 'split':
+        return [
+            curlStep('PUT', "{}/{}/_settings".format(cluster_url, index), {'settings': {'index.blocks.write': True}}),
+            curlStep('POST', "{}/{}/_split/{}".format(cluster_url, index, new_index), {'settings': {'index.number_of_shards': plan['target_primaries'], 'index.blocks.write': None}}),
+            wait_green,
+            refresh,
+            swap,
+        ]
+    return [
+        "# create {} with the mappings of {} (curl '{}/{}/_mapping') and the settings below".format(new_index, index, cluster_url, index),
+        curlStep('PUT', "{}/{}".format(cluster_url, new_index), {'settings': {'index.number_of_shards': plan['target_primaries'], 'index.number_of_replicas': 0, 'index.refresh_interval': '-1'}}),
+        curlStep('PUT', "{}/{}/_settings".format(cluster_url, index), {'settings': {'index.blocks.write': True}}),
+        curlStep('POST', "{}/_reindex?slices=auto&wait_for_completion=true".format(cluster_url), {'source': {'index': index}, 'dest': {'index': new_index}}),
+        curlStep('PUT', "{}/{}/_settings".format(cluster_url, new_index), {'settings': {'index.number_of_replicas': plan['replicas'], 'index.refresh_interval': None}}),
+        wait_green,
+        refresh,
+        swap,
+    ]
+
+
+"""
+box_type and other custom attributes of every node, keyed by node name
+
+curl 'localhost:9200/_cat/nodeattrs?format=json&h=node,attr,value'
+[ { "node" : "es-data-1", "attr" : "box_type", "value" : "hot" }, { "node" : "es-data-1", "attr" : "xpack.installed", "value" : "true" } ]
+"""
+def getNodeAttributes(cluster_url="http://localhost:9200"):
+    response = transport.get("{}/_cat/nodeattrs?format=json&h=node,attr,value".format(cluster_url))
+    attributes = {}
+    if response.status_code == 200:
+        for row in response.json():
+            attributes.setdefault(row['node'], {})[row['attr']] = row['value']
+    return attributes
+
+
+# node.role letters of the data tiers
+TIER_ROLES = {'hot': 'h', 'warm': 'w'}
+
+"""
+tier of every data node and how indices are pinned to a tier. box_type node attributes (the older hot/warm setup the
+scripts/designate_*.sh use) win over the data_hot/data_warm roles of 7.10+ since a cluster moving between them still
+allocates by box_type. returns (mode, {node: tier}), mode None when the cluster has no hot and warm nodes
+"""
+def nodeTiers(snapshot):
+    data_nodes = [node.get('name') for node in snapshot.nodes if DATA_ROLES & set(node.get('node.role') or '')]
+    box_types = {node: snapshot.node_attrs.get(node, {}).get('box_type') for node in data_nodes}
+    if {'hot', 'warm'} <= set(box_types.values()):
+        return 'box_type', {node: tier for node, tier in box_types.items() if tier in TIER_ROLES}
+    roles = {node.get('name'): node.get('node.role') or '' for node in snapshot.nodes}
+    # a node with both roles belongs to the hot tier
+    tiers = {node: 'hot' if 'h' in roles[node] else 'warm' for node in data_nodes if set(TIER_ROLES.values()) & set(roles[node])}
+    if {'hot', 'warm'} <= set(tiers.values()):
+        return '_tier_preference', tiers
+    return None, {}
+
+
+# settings which pin an index to a tier, the box_type key is the one the scripts/designate_*.sh use. a require.box_type
+# left from an earlier setup would keep the shards on the old tier whatever include says, so it is cleared
+def tierSettings(mode, tier):
+    if mode == 'box_type':
+        return {'index.routing.allocation.include.box_type': tier, 'index.routing.allocation.require.box_type': None}
+    return {'index.routing.allocation.include._tier_preference': 'data_warm,data_hot' if tier == 'warm' else 'data_hot'}
+
+
+"""
+hot/warm placement of every open index from its age, search and indexing rate and size.
+rates are the difference of two _cat/indices samples, the snapshot's own and one taken window seconds after it.
+  an index older than warm_after_days which gets at most max_warm_search_rate queries/s and max_warm_indexing_rate docs/s
+  belongs on the warm tier, the coldest first: fewest queries and writes, then oldest, then largest.
+  a warm index searched more than hot_search_rate queries/s or written to more than max_warm_indexing_rate goes back to hot
+  first, it is slowing down searches now. the gap between the two search rates keeps indices from flapping between tiers.
+indices whose counters went down between the samples (a shard moved or restarted) or which are closed are left where they are.
+an index without a tier setting counts as hot.
+
+the moves are batched into settings updates of many indices at once (PUT /a,b,c/_settings). relocations are limited by
+indices.recovery.max_bytes_per_sec on every node, so the sweep may use budget_share of that times the nodes of the smaller tier,
+and a batch holds at most batch_seconds of relocations at that budget. tier_planner.py runs the batches one after the other.
+a max_bytes_per_sec of 0 means recoveries are not throttled, then (or with budget_share 0) there is no budget, batches only
+hold max_batch_indices and the plan has no time estimate
+"""
+def analyzeTiering(snapshot, window=30, warm_after_days=30, max_warm_search_rate=0.1, max_warm_indexing_rate=0.1, hot_search_rate=1,
+                   budget_share=0.5, batch_seconds=600, max_batch_indices=50, findings=None, cancel=None):
+    findings = [] if findings is None else findings
+    mode, tiers = nodeTiers(snapshot)
+    if mode is None or not snapshot.index_data:
+        return findings
+
+    elapsed = waitForSecondSample(snapshot, 'index_details' if 'index_details' in snapshot.sampled_at else 'index_data', window, cancel)
+    if elapsed is None:
+        return findings
+    second = getAllIndexDetails(snapshot.cluster_url)
+
+    columns = snapshot.indexColumns()
+    rows = [snapshot.index_data[index] for index in columns.names]
+    count = len(rows)
+
+    def rate(counter):
+        before = np.fromiter((row.get(counter) if row.get(counter) is not None else np.nan for row in rows), dtype=np.float64, count=count)
+        after = np.fromiter((second.get(index, {}).get(counter) if second.get(index, {}).get(counter) is not None else np.nan for index in columns.names), dtype=np.float64, count=count)
+        delta = after - before
+        return np.where(delta >= 0, delta / elapsed, np.nan)
+    search_rate = rate('search.query_total')
+    indexing_rate = rate('indexing.index_total')
+    age_days = np.where(columns.creation_date > 0, (time.time() * 1000 - columns.creation_date) / (24 * 3600 * 1000), np.nan)
+    if mode == 'box_type':
+        current = [row.get('box_type') or 'hot' for row in rows]
+    else:
+        current = [(row.get('tier_preference') or 'data_hot').split(',')[0][len('data_'):] for row in rows]
+    warm_now = np.array([tier == 'warm' for tier in current], dtype=bool)
+    is_open = columns.status.equals('open')
+    with np.errstate(invalid='ignore'):
+        rules = [
+            ('tier_move_to_hot', is_open & warm_now & ((search_rate > hot_search_rate) | (indexing_rate > max_warm_indexing_rate))),
+            ('tier_move_to_warm', is_open & ~warm_now & (age_days >= warm_after_days) & (search_rate <= max_warm_search_rate) & (indexing_rate <= max_warm_indexing_rate)),
+        ]
+
+    # bytes of every index on nodes outside its target tier, what the move actually relocates
+    shard_columns = snapshot.shardColumns()
+    node_tier = np.array([{'hot': 0, 'warm': 1}.get(tiers.get(name), -1) for name in shard_columns.node.names], dtype=np.int64)[shard_columns.node.codes] if len(shard_columns.node.codes) else np.zeros(0, dtype=np.int64)
+    index_rows = {index: position for position, index in enumerate(columns.names)}
+    shard_index = np.array([index_rows.get(index, -1) for index in shard_columns.index.names], dtype=np.int64)[shard_columns.index.codes] if len(shard_columns.index.codes) else np.zeros(0, dtype=np.int64)
+    placed = (node_tier >= 0) & (shard_index >= 0) & shard_columns.assigned
+    bytes_on = [np.bincount(shard_index[placed & (node_tier == tier)], weights=shard_columns.store[placed & (node_tier == tier)], minlength=count) for tier in (0, 1)]
+
+    moves = []
+    for row, callout_name in matchingRows(rules):
+        target = 'hot' if callout_name == 'tier_move_to_hot' else 'warm'
+        moves.append({
+            'index': columns.names[row],
+            'from_tier': current[row],
+            'to_tier': target,
+            'age_days': None if np.isnan(age_days[row]) else float(age_days[row]),
+            'search_rate': float(search_rate[row]),
+            'indexing_rate': float(indexing_rate[row]),
+            'store_bytes': int(columns.store_size[row]),
+            'relocate_bytes': int(bytes_on[1 if target == 'hot' else 0][row]),
+        })
+    # back to hot first, the busiest first. then to warm, the coldest first
+    moves.sort(key=lambda move: (move['to_tier'] != 'hot', -move['search_rate'] if move['to_tier'] == 'hot' else move['search_rate'] + move['indexing_rate'],
+                                 -(move['age_days'] or 0), -move['store_bytes']))
+
+    max_bytes_per_sec = parseByteSize(clusterSetting(snapshot.cluster_settings, 'indices.recovery.max_bytes_per_sec', '40mb'))
+    tier_nodes = Counter(tiers.values())
+    budget = max_bytes_per_sec * min(tier_nodes['hot'], tier_nodes['warm']) * budget_share
+    batches = []
+    for move in moves:
+        batch = batches[-1] if batches else None
+        over_budget = budget > 0 and batch is not None and batch['relocate_bytes'] and batch['relocate_bytes'] + move['relocate_bytes'] > budget * batch_seconds
+        if batch is None or batch['to_tier'] != move['to_tier'] or len(batch['indices']) >= max_batch_indices or over_budget:
+            batch = {'to_tier': move['to_tier'], 'indices': [], 'relocate_bytes': 0, 'settings': tierSettings(mode, move['to_tier'])}
+            batches.append(batch)
+        batch['indices'].append(move['index'])
+        batch['relocate_bytes'] += move['relocate_bytes']
+    for batch in batches:
+        batch['estimated_seconds'] = batch['relocate_bytes'] / budget if budget > 0 else None
+        batch['command'] = curlStep('PUT', "{}/{}/_settings".format(snapshot.cluster_url, ','.join(batch['indices'])), batch['settings'])
+
+    for rank, move in enumerate(moves, 1):
+        temp = {}
+        temp['type'] = 'index_level'
+        temp['callout_type'] = 'warning' if move['to_tier'] == 'hot' else 'recommendation'
+        temp['callout_name'] = 'tier_move_to_' + move['to_tier']
+        temp.update(move)
+        temp['rank'] = rank
+        temp['value'] = move['relocate_bytes']
+        age = "{:.0f} days old".format(move['age_days']) if move['age_days'] is not None else "of unknown age"
+        if move['to_tier'] == 'hot':
+            temp['message'] = "#{} warm index {} gets {:.2f} queries/s and {:.2f} docs/s, move it back to hot ({} to relocate)".format(rank, move['index'], move['search_rate'], move['indexing_rate'], formatBytes(move['relocate_bytes']))
+        else:
+            temp['message'] = "#{} index {} is {} with {:.2f} queries/s and {:.2f} docs/s, move it to warm ({} to relocate)".format(rank, move['index'], age, move['search_rate'], move['indexing_rate'], formatBytes(move['relocate_bytes']))
+        findings.append(temp)
+    if batches:
+        total_bytes = sum(batch['relocate_bytes'] for batch in batches)
+        temp_obj = {}
+        temp_obj['type'] = 'cluster_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'tiering_plan'
+        temp_obj['value'] = len(moves)
+        temp_obj['mode'] = mode
+        temp_obj['store_bytes'] = total_bytes
+        temp_obj['budget_bytes_per_sec'] = budget
+        temp_obj['max_bytes_per_sec'] = max_bytes_per_sec
+        temp_obj['estimated_seconds'] = total_bytes / budget if budget > 0 else None
+        temp_obj['window_seconds'] = elapsed
+        temp_obj['batches'] = batches
+        temp_obj['commands'] = [batch['command'] for batch in batches]
+        if budget > 0:
+            pacing = "takes about {:.0f} minutes at {}/s ({:.0%} of indices.recovery.max_bytes_per_sec {}/s on {} node pairs)".format(
+                total_bytes / budget / 60, formatBytes(budget), budget_share, formatBytes(max_bytes_per_sec), min(tier_nodes['hot'], tier_nodes['warm']))
+        else:
+            pacing = "is not paced, batches hold up to {} indices (indices.recovery.max_bytes_per_sec {}, budget share {:.0%}, {} node pairs)".format(
+                max_batch_indices, clusterSetting(snapshot.cluster_settings, 'indices.recovery.max_bytes_per_sec', '40mb'), budget_share, min(tier_nodes['hot'], tier_nodes['warm']))
+        temp_obj['message'] = "{} indices change tier by {} in {} batches, {} to relocate {}".format(len(moves), mode, len(batches), formatBytes(total_bytes), pacing)
+        temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/shard-allocation-filtering.html"
+        findings.append(temp_obj)
+    return findings
+
+
 """
 gets why shard is in unassigned state
 
@@ -355,11 +1427,14 @@ output is of the format
   ]
 }
 """
-def getAllocationDetailsForShard(cluster_url="http://localhost:9200", index=None, shard=None, primary=False):
+def getAllocationDetailsForShard(cluster_url="http://localhost:9200", index=None, shard=None, primary=False, limiter=None):
     url = "{}/_cluster/allocation/explain?pretty".format(cluster_url)
     payload = {"index": index, "shard": shard}
-    payload['primary'] = primary    
-    response = requests.get(url, json=payload)
+    payload['primary'] = primary
+    # explain calls can have their own budget on top of the transport wide limit
+    if limiter is not None:
+        limiter.wait()
+    response = transport.get(url, json=payload)
     if response.status_code == 200:
         return response.json()
     else:
@@ -368,44 +1443,187 @@ def getAllocationDetailsForShard(cluster_url="http://localhost:9200", index=None
 """
  create a function which fetches all the shards in the cluster and then loops through them and checks if the shard is UNASSIGNED state,
 if yes then call allocation explain api to get the reason why shard is in unassigned state
+
+explain calls are independent of each other so they are fanned out on a thread pool of max_concurrency workers,
+with calls_per_second as the budget for explain calls. the transport wide limit still applies and wins when it is lower,
+so the budget only matters below it (it keeps room for the other stages). results keep the order of the shards in _cat/shards.
+max_concurrency=1 makes the calls one after another
+
+findings are appended to the findings list as they complete and the remaining calls are dropped once cancel is set,
+so the scheduler can use whatever was explained when this stage times out
+
+with state_file the explanations are kept on disk between runs (see loadIncrementalState) and only shards which became
+unassigned since the previous run are explained again. cached explanations older than max_age seconds are refreshed
+
+with group the unassigned shards are grouped by index, unassigned.reason and prirep, only the first shard of each group
+is explained and its verdict is used for the rest of the group (they carry explained_via). when a node leaves, thousands of
+shards share one verdict so this takes the explain calls from one per shard to one per group. group=False explains every shard.
+a group verdict is cached under the group key, so on the next run the members still carry explained_via. the key has the
+latest unassigned.at of the group, a shard joining the group gets it explained again
 """
-def analyseUnassignedShards(cluster_url="http://localhost:9200"):
-    shards = getShardLevelData(cluster_url)
-    unassigned_shards = []
-    for shard in tqdm(shards, 'Analysing unassigned shards'):
-        if shard['state'] == 'UNASSIGNED':
-            temp = {}
-            temp['type'] = 'shard_level'
-            temp['index'] = shard.get('index')
-            temp['shard'] = shard.get('shard')
-            temp['primary_or_replica'] = 'primary' if shard.get('prirep') == 'p' else 'replica'
-            temp['callout_name'] = 'unassigned_shard'
-            temp['callout_type'] = 'alert'
-            temp['message'] = "Index {} shard {} is in unassigned state".format(shard.get('index')  ,shard.get('shard'))
-            reason = getAllocationDetailsForShard(cluster_url, index=shard.get('index'), shard=shard.get('shard'), primary=True if shard.get('prirep') == 'p' else False)
-            temp['unassigned_reason'] = reason.get('allocate_explanation')
-            temp['can_allocate'] = reason.get('can_allocate')
-            if ('node_allocation_decisions' in reason):
-                node_based_decider = []
-                for node in reason.get('node_allocation_decisions'):                    
-                    if node.get('node_decision') == 'no':
-                        temp_decider = {}
-                        # temp_decider['node_id'] = node.get('node_id')
-                        temp_decider['node_name'] = node.get('node_name')
-                        temp_decider['transport_address'] = node.get('transport_address')
-                        temp_decider['node_decision'] = node.get('node_decision')
-                        temp_decider['deciders'] = node.get('deciders')
-                        node_based_decider.append(temp_decider)
-                temp['node_allocation_decisions'] = node_based_decider
-            unassigned_shards.append(temp)
+def analyseUnassignedShards(snapshot, max_concurrency=8, calls_per_second=5, findings=None, cancel=None, state_file=None, max_age=None, group=True):
+    cluster_url = snapshot.cluster_url
+    unassigned = [shard for shard in snapshot.shards if shard.state == 'UNASSIGNED']
+    explain_limiter = TokenBucket(calls_per_second)
+    unassigned_shards = findings if findings is not None else []
+    cached = loadIncrementalState(state_file, snapshot, max_age) if state_file else {}
+    explained = {}
+
+    # position of the shard whose explanation is used for each unassigned shard
+    if group:
+        groups = {}
+        representative_of = [groups.setdefault((shard.index, shard.unassigned_reason, shard.prirep), position) for position, shard in enumerate(unassigned)]
+        latest = {}
+        for shard in unassigned:
+            group_key = (shard.index, shard.unassigned_reason, shard.prirep)
+            latest[group_key] = max(latest.get(group_key) or '', shard.unassigned_at or '')
+        keys = ["{}/{}/{}/{}".format(shard.index, shard.unassigned_reason, shard.prirep, latest[(shard.index, shard.unassigned_reason, shard.prirep)]) for shard in unassigned]
+    else:
+        representative_of = list(range(len(unassigned)))
+        keys = unassignedShardKeys(unassigned)
+    representatives = sorted(set(representative_of))
+
+    def explain(position):
+        shard, key = unassigned[position], keys[position]
+        if key in cached:
+            return cached[key]['explanation']
+        if cancel is not None and cancel.is_set():
+            return None
+        reason = getAllocationDetailsForShard(cluster_url, index=shard.index, shard=shard.shard, primary=True if shard.prirep == 'p' else False, limiter=explain_limiter)
+        if reason:
+            explained[key] = {'explanation': reason, 'explained_at': time.time()}
+        return reason
+
+    current = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    try:
+        # representatives come before the rest of their group, so the results are consumed in order as they complete
+        representative_results = zip(representatives, executor.map(explain, representatives))
+        reasons = {}
+        for position, shard in enumerate(tqdm(unassigned, desc='Analysing unassigned shards', disable=not show_progress)):
+            representative = representative_of[position]
+            key = keys[position]
+            if key in cached:
+                entry = cached[key]
+            else:
+                while representative not in reasons:
+                    done_position, reason = next(representative_results)
+                    reasons[done_position] = reason
+                if reasons[representative] is None:
+                    break
+                entry = cached.get(keys[representative]) or explained.get(keys[representative]) or {'explanation': reasons[representative], 'explained_at': time.time()}
+            finding = buildUnassignedShardFinding(shard, entry['explanation'])
+            if representative != position:
+                finding['explained_via'] = "Index {} shard {} ({})".format(unassigned[representative].index, unassigned[representative].shard, 'primary' if unassigned[representative].prirep == 'p' else 'replica')
+            unassigned_shards.append(finding)
+            if entry['explanation']:
+                current[key] = entry
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    logging.info("{} unassigned shards in {} groups, {} explained".format(len(unassigned), len(representatives), len(explained)))
+    if state_file:
+        logging.info("explanations of {} unassigned shards reused from {}".format(len([key for key in keys if key in cached]), state_file))
+        saveIncrementalState(state_file, snapshot, current)
     return unassigned_shards
 
 
+"""
+identity of an unassigned shard copy across runs. unassigned.at and unassigned.reason change whenever the copy becomes
+unassigned again, so a shard which was allocated and then lost again between two runs gets a new key and is explained again.
+replicas of one shard unassigned at the same time are told apart by their position in _cat/shards
+"""
+def unassignedShardKeys(unassigned):
+    keys = []
+    seen = {}
+    for shard in unassigned:
+        key = "{}/{}/{}/{}/{}".format(shard.index, shard.shard, shard.prirep, shard.unassigned_at, shard.unassigned_reason)
+        seen[key] = seen.get(key, -1) + 1
+        keys.append("{}/{}".format(key, seen[key]))
+    return keys
+
+
+"""
+the state file holds the explanations of the unassigned shards of the last run per cluster uuid, along with the cluster state
+version they were taken at
+{
+  "wUrfObFwQlC0bdO16V2Rkg": {
+    "state_version": 4513,
+    "saved_at": 1703858969.2,
+    "shards": {
+      "my_index_286/0/r/2023-12-29T12:58:57.373Z/NODE_LEFT/0": {"explanation": {...}, "explained_at": 1703858969.1},
+      "my_index_287/NODE_LEFT/r/2023-12-29T12:58:57.373Z": {"explanation": {...}, "explained_at": 1703858969.1}
+    }
+  }
+}
+the second key is the verdict of a group (see analyseUnassignedShards). entries are reused whatever the cluster state version,
+it changes on every shard start, relocation or mapping update, max_age bounds how stale a verdict can get.
+explanations of shards which are no longer unassigned are dropped when the state is saved, so a shard is only reused
+when it stayed unassigned between the two runs
+"""
+def loadIncrementalState(state_file, snapshot, max_age=None):
+    cluster_uuid = snapshot.cluster_state_version.get('cluster_uuid') or snapshot.cluster_stats.get('cluster_uuid')
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        previous = json.load(f).get(cluster_uuid)
+    if not previous:
+        return {}
+    if previous.get('state_version') == snapshot.cluster_state_version.get('version'):
+        logging.info("cluster state version {} is unchanged since the last run".format(previous.get('state_version')))
+    shards = previous.get('shards', {})
+    if max_age is not None:
+        now = time.time()
+        shards = {key: entry for key, entry in shards.items() if now - entry.get('explained_at', 0) <= max_age}
+    return shards
+
+
+def saveIncrementalState(state_file, snapshot, shards):
+    cluster_uuid = snapshot.cluster_state_version.get('cluster_uuid') or snapshot.cluster_stats.get('cluster_uuid')
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    state[cluster_uuid] = {'state_version': snapshot.cluster_state_version.get('version'), 'saved_at': time.time(), 'shards': shards}
+    # write to a temporary file and move it in place so an interrupted run does not leave a broken state file
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def buildUnassignedShardFinding(shard, reason):
+    temp = {}
+    temp['type'] = 'shard_level'
+    temp['index'] = shard.index
+    temp['shard'] = shard.shard
+    temp['primary_or_replica'] = 'primary' if shard.prirep == 'p' else 'replica'
+    temp['callout_name'] = 'unassigned_shard'
+    temp['callout_type'] = 'alert'
+    temp['message'] = "Index {} shard {} is in unassigned state".format(shard.index  ,shard.shard)
+    temp['unassigned_reason'] = reason.get('allocate_explanation')
+    temp['can_allocate'] = reason.get('can_allocate')
+    if ('node_allocation_decisions' in reason):
+        node_based_decider = []
+        for node in reason.get('node_allocation_decisions'):
+            if node.get('node_decision') == 'no':
+                temp_decider = {}
+                # temp_decider['node_id'] = node.get('node_id')
+                temp_decider['node_name'] = node.get('node_name')
+                temp_decider['transport_address'] = node.get('transport_address')
+                temp_decider['node_decision'] = node.get('node_decision')
+                temp_decider['deciders'] = node.get('deciders')
+                node_based_decider.append(temp_decider)
+        temp['node_allocation_decisions'] = node_based_decider
+    return temp
+
+
 # curl to cat es nodes in verbose mode with lots of details, give the full names use the apis in https://www.elastic.co/guide/en/elasticsearch/reference/current/cat-nodes.html
 # fetch all the possible columns
 # curl
 
 """
+all the columns available with h=* are below, see NODE_COLUMNS for the ones actually fetched. bytes=b and time=ms make sizes and
+durations plain numbers, e.g. heap.max is 4080218931 instead of 3.8gb
 curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0' 'http://localhost:9200/_cat/nodes?v&pretty&h=*&format=json'
 {
     "id" : "3-Ya",
@@ -508,96 +1726,698 @@ curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0'
     "mappings.total_estimated_overhead_in_bytes" : "7.6mb"
   }
 """
+# cumulative counters since node start, analyzeHotNodes and analyzeRecoveries turn two samples of them into rates. the times are in ms
+NODE_COUNTER_COLUMNS = ['search.query_total', 'search.query_time', 'indexing.index_total', 'bulk.total_operations', 'merges.total_time', 'refresh.time']
+# cache usage and counters since node start, read by analyzeCaches together with the uptime in ms
+NODE_CACHE_COLUMNS = ['uptime', 'query_cache.memory_size', 'query_cache.evictions', 'query_cache.hit_count', 'query_cache.miss_count',
+                      'request_cache.memory_size', 'request_cache.evictions', 'request_cache.hit_count', 'request_cache.miss_count',
+                      'fielddata.memory_size', 'fielddata.evictions']
+NODE_COLUMNS = ['name', 'http_address', 'node.role', 'master', 'heap.max', 'ram.max'] + NODE_COUNTER_COLUMNS + NODE_CACHE_COLUMNS
+NODE_NUMERIC_COLUMNS = ['heap.max', 'ram.max'] + NODE_COUNTER_COLUMNS + NODE_CACHE_COLUMNS
+
 def getAllNodeLevelDetails(cluster_url="http://localhost:9200"):
-    url = "{}/_cat/nodes?v&h=*&format=json".format(cluster_url)
-    response = requests.get(url)
+    url = "{}/_cat/nodes?format=json&bytes=b&time=ms&h={}".format(cluster_url, ",".join(NODE_COLUMNS))
+    response = transport.get(url)
     if response.status_code == 200:
         # print(to_curl(response.request))
-        return response.json()
+        return [parseCatRow(node, NODE_NUMERIC_COLUMNS) for node in response.json()]
     else:
-        return {}
+        return []
 
 """
-{    "heap.current" : "648mb",
-    "heap.percent" : "16",
-    "heap.max" : "3.8gb",
-    "ram.current" : "7.4gb",
-    "ram.percent" : "97",
-    "ram.max" : "7.6gb",
+{    "heap.max" : 4080218931,
+    "ram.max" : 8160437862,
 }
-given above fields in an object, find the ram.max and heap.max and return the percentage of ram.max and heap.max handling gb and mb separately
+given above fields in an object (both in bytes), return heap.max as a percentage of ram.max
 """
 def heapAllocationPercentage(heap):
-    # if heap.get(heap.max).endswith("gb"): then handle it differently else handle it differently
-    # convert both heap.max and ram.max to mb and then find the percentage
+    if heap.get('heap.max') is None or not heap.get('ram.max'):
+        return None
     # heap.max/ram.max * 100
-
-    if heap.get('heap.max').endswith("gb"):
-        heap_max = float(heap.get('heap.max').replace("gb","")) * 1024
-    else:
-        heap_max = float(heap.get('heap.max').replace("mb",""))
-
-    if heap.get('ram.max').endswith("gb"):
-        ram_max = float(heap.get('ram.max').replace("gb","")) * 1024
-    else:
-        ram_max = float(heap.get('ram.max').replace("mb",""))
-
-    return (heap_max/ram_max) * 100
+    return (heap.get('heap.max')/heap.get('ram.max')) * 100
             
         
 
     
-def analyzeAllNodeLevelDetails(cluster_url="http://localhost:9200"):
-    nodes = getAllNodeLevelDetails(cluster_url)
-    total_indices = getAllIndices(cluster_url)
-
+def analyzeAllNodeLevelDetails(snapshot):
+    columns = snapshot.nodeColumns()
+    total_indices = len(snapshot.index_data)
+    # heap.max/ram.max * 100, same as heapAllocationPercentage
+    heap_percent = columns.heap_max / columns.ram_max * 100
+    # a master node can safely manage 3000 indices per 1gb of heap
+    total_allowed_indices = columns.heap_max / GB * 3000
+    rules = [
+        ('heap_percent_less_than_40', heap_percent < 40),
+        # if node is master then check the total number of indices in cluster against its heap, node.role will have values like dm , m , d etc
+        ('indices_count_more_than_3000_per_1gb_master_node', columns.master_eligible & (total_indices > total_allowed_indices)),
+    ]
     node_data = []
-    for node in tqdm(nodes, desc="Analyzing nodes"):
-        # identify what to analyse at node level
-        heap_percent = heapAllocationPercentage(node)
-        if(heap_percent < 40):
-            temp_obj = {}
+    for row, callout_name in matchingRows(rules):
+        node = snapshot.nodes[row]
+        temp_obj = {}
+        if callout_name == 'heap_percent_less_than_40':
             temp_obj['type'] = 'node_level'
-            temp_obj['value'] = heap_percent
-            temp_obj['heap'] = node.get('heap.max')
-            temp_obj['ram'] = node.get('ram.max')
+            temp_obj['value'] = float(heap_percent[row])
+            temp_obj['heap'] = formatBytes(node.get('heap.max'))
+            temp_obj['ram'] = formatBytes(node.get('ram.max'))
+            temp_obj['heap_bytes'] = node.get('heap.max')
+            temp_obj['ram_bytes'] = node.get('ram.max')
+            temp_obj['node'] = node.get('name')
             temp_obj['callout_type'] = 'warning'
-            temp_obj['callout_name'] = 'heap_percent_less_than_40'
-            # get http_address
+            temp_obj['callout_name'] = callout_name
             temp_obj['http_address'] = node.get('http_address')
-            # type a message
-            temp_obj['message'] = "heap percent is less than 40% on node {} with heap {} and ram {}".format(node.get('http_address'), node.get('heap.max'), node.get('ram.max'))
-            # add to node_data
-            # add temp_obj to node_data
-            node_data.append(temp_obj)
-
-        # if node is master then check the total number of indices in cluster and if it is more than 3000 then callout and push it in node_data, node.role will have values like dm , m , d etc
-        # check if node is master by checking if node.role has m in string or not
-        if 'm' in node.get('node.role'):
-            # extract heap max of node
-            if node.get('heap.max').endswith("gb"):
-                heap_max = float(node.get('heap.max').replace("gb","")) 
-            else:
-                heap_max = float(node.get('heap.max').replace("mb",""))/1024
-            total_allowed_indices = heap_max * 3000
-            
-            if len(total_indices) > total_allowed_indices:
-                temp_obj = {}
-                temp_obj['type'] = 'cluster_level'
-                temp_obj['value'] = node.get('indices.count')
-                temp_obj['callout_type'] = 'warning'
-                temp_obj['callout_name'] = 'indices_count_more_than_3000_per_1gb_master_node'
-                # get http_address
-                temp_obj['http_address'] = node.get('http_address')
-                # type a message
-                temp_obj['message'] = "indices count is {} while cluster can safely support {} total indices".format(len(total_indices),total_allowed_indices )
-                temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/size-your-shards.html"
-                # add to node_data
-                node_data.append(temp_obj)
-                
+            temp_obj['message'] = "heap percent is less than 40% on node {} with heap {} and ram {}".format(node.get('http_address'), formatBytes(node.get('heap.max')), formatBytes(node.get('ram.max')))
+        else:
+            temp_obj['type'] = 'cluster_level'
+            temp_obj['value'] = node.get('indices.count')
+            temp_obj['callout_type'] = 'warning'
+            temp_obj['callout_name'] = callout_name
+            temp_obj['http_address'] = node.get('http_address')
+            temp_obj['heap_bytes'] = node.get('heap.max')
+            temp_obj['node'] = node.get('name')
+            temp_obj['message'] = "indices count is {} while cluster can safely support {} total indices".format(total_indices, float(total_allowed_indices[row]))
+            temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/size-your-shards.html"
+        node_data.append(temp_obj)
     return node_data
 
 
+# (callout_name, counter, divisor to get the rate per second, unit, rate below which a node is never called hot)
+HOT_NODE_RATES = [
+    ('hot_node_search_rate', 'search.query_total', 1, 'queries/s', 1),
+    ('hot_node_indexing_rate', 'indexing.index_total', 1, 'docs/s', 1),
+    ('hot_node_bulk_rate', 'bulk.total_operations', 1, 'bulk operations/s', 1),
+    ('hot_node_merge_time', 'merges.total_time', 1000, 'merge seconds/s', 0.01),
+    ('hot_node_refresh_time', 'refresh.time', 1000, 'refresh seconds/s', 0.01),
+]
+# data roles of node.role, d is the generic data role and h, w, c, f, s the tiers and content
+DATA_ROLES = set('dhwcfs')
+
+"""
+waits until window seconds have passed since the snapshot's collector named sample got its response and returns the seconds
+since then, the time the rates of the second sample are taken over. None when the analyzer was cancelled while waiting.
+a recording keeps the seconds so that a replay computes the same rates whatever window it is given
+"""
+def waitForSecondSample(snapshot, sample, window, cancel=None):
+    if isinstance(transport, ReplayTransport):
+        return transport.sampleElapsed(sample, window)
+    sampled_at = snapshot.sampled_at.get(sample, time.monotonic())
+    remaining = sampled_at + window - time.monotonic()
+    if remaining > 0:
+        if cancel is None:
+            time.sleep(remaining)
+        elif cancel.wait(remaining):
+            return None
+    elapsed = time.monotonic() - sampled_at
+    if isinstance(transport, RecordingTransport):
+        transport.recordSample(sample, elapsed)
+    return elapsed
+
+
+"""
+the counters of _cat/nodes only grow, so the load of a node is the difference of two samples divided by the time between them.
+the first sample is the snapshot's own _cat/nodes, the second one is taken window seconds after it.
+a data node whose rate is more than skew times the median of the data nodes is hot, these are the nodes which decide the tail latency.
+nodes which restarted between the samples (a counter went down) or are missing in one of them are left out
+
+curl 'localhost:9200/_cat/nodes?format=json&time=ms&h=name,node.role,search.query_total,indexing.index_total,bulk.total_operations,merges.total_time,refresh.time'
+"""
+def analyzeHotNodes(snapshot, window=30, skew=2.0, findings=None, cancel=None):
+    findings = [] if findings is None else findings
+    first = {node.get('name'): node for node in snapshot.nodes if DATA_ROLES & set(node.get('node.role') or '')}
+    if not first:
+        return findings
+
+    elapsed = waitForSecondSample(snapshot, 'nodes', window, cancel)
+    if elapsed is None:
+        return findings
+    second = [node for node in getAllNodeLevelDetails(snapshot.cluster_url) if node.get('name') in first]
+    if not second:
+        return findings
+
+    rates = {}
+    valid = np.ones(len(second), dtype=bool)
+    for callout_name, counter, divisor, unit, minimum in HOT_NODE_RATES:
+        before = np.array([first[node.get('name')].get(counter) if first[node.get('name')].get(counter) is not None else np.nan for node in second], dtype=np.float64)
+        after = np.array([node.get(counter) if node.get(counter) is not None else np.nan for node in second], dtype=np.float64)
+        delta = after - before
+        valid &= ~(delta < 0)
+        rates[counter] = delta / divisor / elapsed
+
+    rules = []
+    medians = {}
+    for callout_name, counter, divisor, unit, minimum in HOT_NODE_RATES:
+        rate = np.where(valid, rates[counter], np.nan)
+        if np.all(np.isnan(rate)):
+            continue
+        medians[counter] = float(np.nanmedian(rate))
+        with np.errstate(invalid='ignore'):
+            rules.append((callout_name, (rate > skew * medians[counter]) & (rate >= minimum)))
+
+    units = {callout_name: (counter, unit) for callout_name, counter, divisor, unit, minimum in HOT_NODE_RATES}
+    for row, callout_name in matchingRows(rules):
+        node = second[row]
+        counter, unit = units[callout_name]
+        rate = float(rates[counter][row])
+        median = medians[counter]
+        temp_obj = {}
+        temp_obj['type'] = 'node_level'
+        temp_obj['callout_type'] = 'warning'
+        temp_obj['callout_name'] = callout_name
+        temp_obj['node'] = node.get('name')
+        temp_obj['http_address'] = node.get('http_address')
+        temp_obj['value'] = rate
+        temp_obj['cluster_median'] = median
+        temp_obj['skew'] = rate / median if median else None
+        temp_obj['window_seconds'] = elapsed
+        if median:
+            temp_obj['message'] = "node {} does {:.2f} {}, {:.1f}x the median of {:.2f} {} over the data nodes".format(node.get('name'), rate, unit, rate / median, median, unit)
+        else:
+            temp_obj['message'] = "node {} does {:.2f} {} while most data nodes do none".format(node.get('name'), rate, unit)
+        findings.append(temp_obj)
+    return findings
+
+
+"""
+every thread pool of every node, one row per node and pool. rejected and completed count since node start,
+active and queue are the threads busy and the tasks waiting right now, size the threads and queue_size the queue limit (-1 unbounded).
+scaling pools (generic, management, flush, refresh, snapshot, warmer...) leave size empty and grow up to max threads
+
+curl 'localhost:9200/_cat/thread_pool?format=json&h=node_name,name,active,queue,rejected,completed,size,max,queue_size'
+[
+  { "node_name" : "es-data-1", "name" : "write", "active" : "8", "queue" : "112", "rejected" : "4021", "completed" : "92811310", "size" : "8", "max" : "8", "queue_size" : "10000" },
+  { "node_name" : "es-data-1", "name" : "management", "active" : "1", "queue" : "0", "rejected" : "0", "completed" : "2810321", "size" : "", "max" : "5", "queue_size" : "-1" },
+  ...
+]
+"""
+THREAD_POOL_COLUMNS = ['node_name', 'name', 'active', 'queue', 'rejected', 'completed', 'size', 'max', 'queue_size']
+THREAD_POOL_NUMERIC_COLUMNS = ['active', 'queue', 'rejected', 'completed', 'size', 'max', 'queue_size']
+
+def getThreadPoolStats(cluster_url="http://localhost:9200"):
+    url = "{}/_cat/thread_pool?format=json&h={}".format(cluster_url, ",".join(THREAD_POOL_COLUMNS))
+    response = transport.get(url)
+    if response.status_code == 200:
+        return [parseCatRow(pool, THREAD_POOL_NUMERIC_COLUMNS) for pool in response.json()]
+    else:
+        return []
+
+
+# pools bulk requests run in, write was called bulk before elasticsearch 6.3
+WRITE_POOLS = {'write', 'bulk'}
+# seconds a task of a pool takes on average above which its tasks are too big rather than too many
+SLOW_TASK_SECONDS = 1
+
+"""
+likely cause of a saturated pool on a node as (cause, explanation). size is the threads of the pool, max for scaling pools, None when
+the node does not report it. in order:
+  under-sized pool, the node runs fewer threads for the pool than the median of the nodes (fewer cores or a thread_pool setting)
+  hot shards, the pool saturates on at most half of the nodes, so the shards taking the load are concentrated there
+  for write and search the average task time by little's law (threads busy / tasks completed per second) tells big tasks
+  (large bulks, expensive queries) from many small ones (small bulks or many clients, searches fanning out to many shards)
+"""
+def threadPoolCause(pool, size, median_size, saturated_nodes, pool_nodes, task_seconds, completed_rate):
+    if size is not None and not np.isnan(median_size) and size < median_size:
+        return 'undersized_pool', "the {} pool has {} threads while the median node has {:.0f}, check the cpu count of the node and thread_pool.{}.size or node.processors in its elasticsearch.yml".format(pool, size, median_size, pool)
+    if pool_nodes > 1 and saturated_nodes <= pool_nodes / 2:
+        return 'hot_shards', "only {} of {} nodes saturate their {} pool, the shards taking the load sit on them. spread the busiest indices over more nodes (see the hot node and shard balance findings)".format(saturated_nodes, pool_nodes, pool)
+    if pool in WRITE_POOLS:
+        if task_seconds > SLOW_TASK_SECONDS:
+            return 'large_bulks', "write tasks take {:.2f}s each, the bulk requests are too large. send bulks of 5-15mb".format(task_seconds)
+        return 'small_bulks', "write tasks finish in {:.3f}s at {:.0f}/s, many small bulk requests or too many bulk clients. batch into bulks of 5-15mb from fewer clients".format(task_seconds, completed_rate)
+    if pool == 'search':
+        if task_seconds > SLOW_TASK_SECONDS:
+            return 'expensive_queries', "search tasks take {:.2f}s each, look for heavy aggregations, wildcard or regex queries and deep pagination in the search slow log".format(task_seconds)
+        return 'shard_fan_out', "{:.0f} shard searches/s, every search runs one task per shard it hits. fewer, larger shards or routing cut the tasks per search".format(completed_rate)
+    return 'overloaded', "the {} pool takes more tasks than its {} threads finish".format(pool, size if size is not None else 'unknown number of')
+
+
+"""
+rejections and queue growth per node and pool from two samples of _cat/thread_pool, the snapshot's own and one taken
+window seconds after it. rejections are the main sign of overload: the queue of the pool was full and the request failed
+with a 429 (write) or a partial search failure. a queue growing by min_queue_growth tasks/s to at least min_queue tasks
+means the pool saturates and rejections are next. every finding names the likely cause (see threadPoolCause).
+nodes which restarted between the samples (a counter went down) or are missing in one of them are left out
+
+curl 'localhost:9200/_cat/thread_pool?format=json&h=node_name,name,active,queue,rejected,completed,size,queue_size'
+"""
+def analyzeThreadPools(snapshot, window=30, min_queue=10, min_queue_growth=1, findings=None, cancel=None):
+    findings = [] if findings is None else findings
+    first = {(pool.get('node_name'), pool.get('name')): pool for pool in snapshot.thread_pools}
+    if not first:
+        return findings
+
+    elapsed = waitForSecondSample(snapshot, 'thread_pools', window, cancel)
+    if elapsed is None:
+        return findings
+    second = [pool for pool in getThreadPoolStats(snapshot.cluster_url) if (pool.get('node_name'), pool.get('name')) in first]
+    if not second:
+        return findings
+
+    def column(rows, name):
+        return np.array([row.get(name) if row.get(name) is not None else np.nan for row in rows], dtype=np.float64)
+    before = [first[(pool.get('node_name'), pool.get('name'))] for pool in second]
+    rejected_delta = column(second, 'rejected') - column(before, 'rejected')
+    completed_delta = column(second, 'completed') - column(before, 'completed')
+    valid = ~(rejected_delta < 0) & ~(completed_delta < 0)
+    rejection_rate = rejected_delta / elapsed
+    completed_rate = completed_delta / elapsed
+    queue = column(second, 'queue')
+    queue_growth = (queue - column(before, 'queue')) / elapsed
+    active = (column(second, 'active') + column(before, 'active')) / 2
+    # scaling pools have no size, their max is the most threads they run
+    size = np.where(np.isnan(column(second, 'size')), column(second, 'max'), column(second, 'size'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        task_seconds = np.where(completed_rate > 0, active / completed_rate, np.inf)
+        rules = [
+            ('thread_pool_rejections', valid & (rejection_rate > 0)),
+            ('thread_pool_queue_growing', valid & ~(rejection_rate > 0) & (queue_growth >= min_queue_growth) & (queue >= min_queue)),
+        ]
+
+    # per pool the nodes it runs on, their median size and how many of them saturate, for threadPoolCause
+    names = np.array([pool.get('name') for pool in second])
+    saturated = rules[0][1] | rules[1][1]
+    pool_stats = {}
+    for name in set(names.tolist()):
+        rows = names == name
+        pool_stats[name] = (float(np.nanmedian(size[rows])) if np.any(~np.isnan(size[rows])) else np.nan, int(np.sum(saturated & rows)), int(np.sum(rows)))
+
+    for row, callout_name in matchingRows(rules):
+        pool = second[row]
+        median_size, saturated_nodes, pool_nodes = pool_stats[pool.get('name')]
+        cause, explanation = threadPoolCause(pool.get('name'), None if np.isnan(size[row]) else int(size[row]), median_size, saturated_nodes, pool_nodes, float(task_seconds[row]), float(completed_rate[row]))
+        temp_obj = {}
+        temp_obj['type'] = 'node_level'
+        temp_obj['callout_type'] = 'alert' if callout_name == 'thread_pool_rejections' else 'warning'
+        temp_obj['callout_name'] = callout_name
+        temp_obj['node'] = pool.get('node_name')
+        temp_obj['pool'] = pool.get('name')
+        temp_obj['value'] = float(rejection_rate[row]) if callout_name == 'thread_pool_rejections' else float(queue_growth[row])
+        temp_obj['rejections_per_second'] = float(rejection_rate[row])
+        temp_obj['completed_per_second'] = float(completed_rate[row])
+        temp_obj['queue'] = pool.get('queue')
+        temp_obj['queue_growth_per_second'] = float(queue_growth[row])
+        temp_obj['queue_size'] = pool.get('queue_size')
+        temp_obj['active'] = pool.get('active')
+        temp_obj['size'] = None if np.isnan(size[row]) else int(size[row])
+        temp_obj['cause'] = cause
+        temp_obj['window_seconds'] = elapsed
+        if callout_name == 'thread_pool_rejections':
+            temp_obj['message'] = "node {} rejects {:.2f} {} tasks/s with {} of {} queued. {}".format(pool.get('node_name'), rejection_rate[row], pool.get('name'), pool.get('queue'), pool.get('queue_size'), explanation)
+        else:
+            temp_obj['message'] = "the {} queue of node {} grows by {:.1f} tasks/s to {} of {}. {}".format(pool.get('name'), pool.get('node_name'), queue_growth[row], pool.get('queue'), pool.get('queue_size'), explanation)
+        temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/modules-threadpool.html"
+        findings.append(temp_obj)
+    return findings
+
+
+"""
+shard recoveries running now, peer recoveries (replicas, relocations) have a source node and store recoveries do not
+
+curl 'localhost:9200/_cat/recovery?active_only=true&format=json&bytes=b&time=ms&h=index,shard,time,type,stage,source_node,target_node,bytes_total,bytes_recovered,translog_ops,translog_ops_recovered'
+[
+  { "index" : "my_index", "shard" : "0", "time" : "52013", "type" : "peer", "stage" : "index", "source_node" : "es-data-1", "target_node" : "es-data-4",
+    "bytes_total" : "21474836480", "bytes_recovered" : "5234491392", "translog_ops" : "0", "translog_ops_recovered" : "0" }
+]
+"""
+RECOVERY_COLUMNS = ['index', 'shard', 'time', 'type', 'stage', 'source_node', 'target_node', 'bytes_total', 'bytes_recovered', 'translog_ops', 'translog_ops_recovered']
+RECOVERY_NUMERIC_COLUMNS = ['shard', 'time', 'bytes_total', 'bytes_recovered', 'translog_ops', 'translog_ops_recovered']
+
+def getActiveRecoveries(cluster_url="http://localhost:9200"):
+    url = "{}/_cat/recovery?active_only=true&format=json&bytes=b&time=ms&h={}".format(cluster_url, ",".join(RECOVERY_COLUMNS))
+    response = transport.get(url)
+    if response.status_code == 200:
+        return [parseCatRow(recovery, RECOVERY_NUMERIC_COLUMNS) for recovery in response.json()]
+    else:
+        return []
+
+
+"""
+disk and network bytes every node moved since it started, keyed by node name. io_stats is only there on linux
+
+curl 'localhost:9200/_nodes/stats/fs,transport?filter_path=nodes.*.name,nodes.*.fs.io_stats.total,nodes.*.transport.rx_size_in_bytes,nodes.*.transport.tx_size_in_bytes'
+{ "nodes" : { "G78YGQBuTsKwIcJpMQeDbQ" : { "name" : "es-data-1",
+      "fs" : { "io_stats" : { "total" : { "operations" : 1039216, "read_kilobytes" : 15823912, "write_kilobytes" : 98120310 } } },
+      "transport" : { "rx_size_in_bytes" : 881203911, "tx_size_in_bytes" : 1031829123 } } } }
+"""
+def getNodeIoStats(cluster_url="http://localhost:9200"):
+    url = "{}/_nodes/stats/fs,transport?filter_path=nodes.*.name,nodes.*.fs.io_stats.total,nodes.*.transport.rx_size_in_bytes,nodes.*.transport.tx_size_in_bytes".format(cluster_url)
+    response = transport.get(url)
+    io_stats = {}
+    if response.status_code == 200:
+        for node in response.json().get('nodes', {}).values():
+            disk = node.get('fs', {}).get('io_stats', {}).get('total', {})
+            io_stats[node.get('name')] = {
+                'disk_read_bytes': disk['read_kilobytes'] * KB if 'read_kilobytes' in disk else None,
+                'disk_write_bytes': disk['write_kilobytes'] * KB if 'write_kilobytes' in disk else None,
+                'network_rx_bytes': node.get('transport', {}).get('rx_size_in_bytes'),
+                'network_tx_bytes': node.get('transport', {}).get('tx_size_in_bytes'),
+            }
+    return io_stats
+
+
+# per second growth of a counter between two samples of a dict keyed by node name, None when it is missing or went down
+def counterRate(before, after, node, counter, elapsed):
+    first = before.get(node, {}).get(counter)
+    second = after.get(node, {}).get(counter)
+    if first is None or second is None or second < first:
+        return None
+    return (second - first) / elapsed
+
+
+# setting values are rounded to 10mb so the advice reads like a setting someone would pick
+def roundedMb(value):
+    return "{}mb".format(max(10, int(value / MB / 10) * 10))
+
+
+"""
+recovery throughput from two samples of _cat/recovery?active_only, the snapshot's own and one taken window seconds after it.
+the bytes a recovery copied between the samples count for its link (source to target node) and for both nodes, a recovery which
+finished in between counts with the rest of its bytes. time to green is the bytes still to copy (the rest of the active recoveries
+and a copy of the primary for every unassigned replica) over the throughput of the whole cluster. replicas waiting while nothing
+recovers are a warning of their own, the cluster will not turn green without a change to its allocation.
+
+indices.recovery.max_bytes_per_sec limits what every node sends and receives and cluster.routing.allocation.node_concurrent_recoveries
+how many recoveries a node takes at once. the advice, as transient settings to reset once the cluster is green:
+  searches slower than max_search_latency_ms (query time over queries of _cat/nodes in the window) while recovering, recovery
+  competes with search for disk and network, so the throttle goes down to half of what the busiest node achieves
+  a node reaching 90% of the throttle with disk and network headroom left (disk_mb_per_sec and network_mb_per_sec less what
+  _nodes/stats shows it moving now), the throttle goes up by half of that headroom
+  nodes below the throttle with all their recovery slots in use and more to recover, node_concurrent_recoveries goes up by 2.
+  the throttle is per node whatever the concurrency, so more concurrency only helps nodes which do not reach it
+a max_bytes_per_sec of 0 means recoveries are not throttled, then there is no throttle share and no advice on it
+"""
+def analyzeRecoveries(snapshot, window=30, max_search_latency_ms=100, disk_mb_per_sec=500, network_mb_per_sec=1250, findings=None, cancel=None):
+    findings = [] if findings is None else findings
+    first = {(recovery.get('index'), recovery.get('shard'), recovery.get('target_node')): recovery for recovery in snapshot.recoveries}
+    # a copy of the primary for every unassigned replica, unassigned primaries have nothing to copy from
+    primary_store = {(shard.index, shard.shard): shard.store for shard in snapshot.shards if shard.prirep == 'p' and shard.store is not None}
+    waiting = [primary_store[(shard.index, shard.shard)] for shard in snapshot.shards if shard.state == 'UNASSIGNED' and (shard.index, shard.shard) in primary_store]
+    if not first and not waiting:
+        return findings
+
+    elapsed = waitForSecondSample(snapshot, 'recoveries', window, cancel)
+    if elapsed is None:
+        return findings
+    second_recoveries = getActiveRecoveries(snapshot.cluster_url)
+    second_io = getNodeIoStats(snapshot.cluster_url)
+    second_nodes = {node.get('name'): node for node in getAllNodeLevelDetails(snapshot.cluster_url)}
+    second = {(recovery.get('index'), recovery.get('shard'), recovery.get('target_node')): recovery for recovery in second_recoveries}
+
+    links = Counter()
+    received = Counter()
+    sent = Counter()
+    incoming = Counter(recovery.get('target_node') for recovery in second_recoveries)
+    for key in set(first) | set(second):
+        before = first.get(key)
+        after = second.get(key)
+        if before is None:
+            copied = after.get('bytes_recovered') or 0
+        elif after is None:
+            copied = (before.get('bytes_total') or 0) - (before.get('bytes_recovered') or 0)
+        else:
+            copied = max((after.get('bytes_recovered') or 0) - (before.get('bytes_recovered') or 0), 0)
+        recovery = after or before
+        received[recovery.get('target_node')] += copied
+        if recovery.get('source_node'):
+            sent[recovery.get('source_node')] += copied
+            links[(recovery.get('source_node'), recovery.get('target_node'))] += copied
+
+    remaining = sum(max((recovery.get('bytes_total') or 0) - (recovery.get('bytes_recovered') or 0), 0) for recovery in second_recoveries) + sum(waiting)
+    throughput = sum(received.values()) / elapsed
+
+    max_bytes_per_sec = parseByteSize(clusterSetting(snapshot.cluster_settings, 'indices.recovery.max_bytes_per_sec', '40mb'))
+    throttled_recoveries = max_bytes_per_sec > 0
+    concurrent_recoveries = int(clusterSetting(snapshot.cluster_settings, 'cluster.routing.allocation.node_concurrent_recoveries', 2))
+    before_nodes = {node.get('name'): node for node in snapshot.nodes}
+    query_time = sum(counterRate(before_nodes, second_nodes, node, 'search.query_time', elapsed) or 0 for node in second_nodes)
+    queries = sum(counterRate(before_nodes, second_nodes, node, 'search.query_total', elapsed) or 0 for node in second_nodes)
+    search_latency_ms = query_time / queries if queries else None
+
+    recovery_data = []
+    node_rates = {}
+    for node in sorted(set(received) | set(sent)):
+        node_rate = max(received[node], sent[node]) / elapsed
+        disk = sum(counterRate(snapshot.node_io, second_io, node, counter, elapsed) or 0 for counter in ['disk_read_bytes', 'disk_write_bytes'])
+        network = max(counterRate(snapshot.node_io, second_io, node, 'network_rx_bytes', elapsed) or 0, counterRate(snapshot.node_io, second_io, node, 'network_tx_bytes', elapsed) or 0)
+        has_disk_stats = second_io.get(node, {}).get('disk_write_bytes') is not None
+        headroom = min(disk_mb_per_sec * MB - disk if has_disk_stats else np.inf, network_mb_per_sec * MB - network)
+        node_rates[node] = (node_rate, headroom)
+        temp_obj = {}
+        temp_obj['type'] = 'node_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'recovery_node_throughput'
+        temp_obj['node'] = node
+        temp_obj['value'] = node_rate
+        temp_obj['received_bytes_per_sec'] = received[node] / elapsed
+        temp_obj['sent_bytes_per_sec'] = sent[node] / elapsed
+        temp_obj['throttle_share'] = node_rate / max_bytes_per_sec if throttled_recoveries else None
+        temp_obj['incoming_recoveries'] = incoming[node]
+        temp_obj['disk_bytes_per_sec'] = disk if has_disk_stats else None
+        temp_obj['network_bytes_per_sec'] = network
+        temp_obj['links'] = {"{}->{}".format(source, target): copied / elapsed for (source, target), copied in links.items() if node in (source, target)}
+        throttle = "{:.0%} of indices.recovery.max_bytes_per_sec {}/s".format(node_rate / max_bytes_per_sec, formatBytes(max_bytes_per_sec)) if throttled_recoveries else "not throttled"
+        temp_obj['message'] = "node {} receives {}/s and sends {}/s of recoveries, {}, over {} links. disk {} and network {}/s in use".format(
+            node, formatBytes(received[node] / elapsed), formatBytes(sent[node] / elapsed), throttle, len(temp_obj['links']),
+            "{}/s".format(formatBytes(disk)) if has_disk_stats else "unknown", formatBytes(network))
+        recovery_data.append(temp_obj)
+
+    temp_obj = {}
+    temp_obj['type'] = 'cluster_level'
+    temp_obj['callout_type'] = 'recommendation' if throughput else 'warning'
+    temp_obj['callout_name'] = 'recovery_time_to_green'
+    temp_obj['value'] = remaining / throughput if throughput else None
+    temp_obj['remaining_bytes'] = remaining
+    temp_obj['waiting_replicas'] = len(waiting)
+    temp_obj['active_recoveries'] = len(second_recoveries)
+    temp_obj['bytes_per_sec'] = throughput
+    temp_obj['window_seconds'] = elapsed
+    temp_obj['top_links'] = [{'source_node': source, 'target_node': target, 'bytes_per_sec': copied / elapsed} for (source, target), copied in links.most_common(10)]
+    if throughput:
+        temp_obj['message'] = "{} left to recover ({} active recoveries, {} replicas waiting) at {}/s, green in about {:.0f} minutes".format(formatBytes(remaining), len(second_recoveries), len(waiting), formatBytes(throughput), remaining / throughput / 60)
+    elif not second_recoveries:
+        temp_obj['message'] = "{} replicas ({}) wait to be recovered and nothing recovers, the cluster will not turn green by itself. see the unassigned shard findings for why they are not allocated".format(len(waiting), formatBytes(remaining))
+    else:
+        temp_obj['message'] = "{} left to recover ({} active recoveries, {} replicas waiting) and no bytes copied in {:.0f}s, recoveries are stuck".format(formatBytes(remaining), len(second_recoveries), len(waiting), elapsed)
+    recovery_data.append(temp_obj)
+
+    settings = {}
+    reasons = []
+    busiest = max((rate for rate, headroom in node_rates.values()), default=0)
+    if throttled_recoveries and search_latency_ms is not None and search_latency_ms > max_search_latency_ms:
+        settings['indices.recovery.max_bytes_per_sec'] = roundedMb(min(max_bytes_per_sec, busiest) / 2)
+        reasons.append("searches take {:.0f}ms on average against {:.0f}ms allowed".format(search_latency_ms, max_search_latency_ms))
+    elif search_latency_ms is None or search_latency_ms <= max_search_latency_ms:
+        # without a throttle no node is held back by it
+        throttled = [headroom for rate, headroom in node_rates.values() if throttled_recoveries and rate >= 0.9 * max_bytes_per_sec]
+        if throttled and min(throttled) > 0:
+            settings['indices.recovery.max_bytes_per_sec'] = roundedMb(max_bytes_per_sec + min(throttled) / 2)
+            reasons.append("{} nodes recover at the throttle with at least {}/s of disk and network headroom".format(len(throttled), formatBytes(min(throttled))))
+        slots_full = [node for node, (rate, headroom) in node_rates.items() if (not throttled_recoveries or rate < 0.9 * max_bytes_per_sec) and incoming[node] >= concurrent_recoveries]
+        if slots_full and waiting:
+            settings['cluster.routing.allocation.node_concurrent_recoveries'] = concurrent_recoveries + 2
+            reasons.append("{} nodes run {} recoveries each{} while {} replicas wait".format(len(slots_full), concurrent_recoveries, " below the throttle" if throttled_recoveries else "", len(waiting)))
+    if settings:
+        temp_obj = {}
+        temp_obj['type'] = 'cluster_level'
+        temp_obj['callout_type'] = 'recommendation'
+        temp_obj['callout_name'] = 'recovery_settings_advice'
+        temp_obj['value'] = settings
+        temp_obj['search_latency_ms'] = search_latency_ms
+        temp_obj['max_bytes_per_sec'] = max_bytes_per_sec
+        temp_obj['node_concurrent_recoveries'] = concurrent_recoveries
+        temp_obj['commands'] = [
+            curlStep('PUT', "{}/_cluster/settings".format(snapshot.cluster_url), {'transient': settings}),
+            curlStep('PUT', "{}/_cluster/settings".format(snapshot.cluster_url), {'transient': {name: None for name in settings}}),
+        ]
+        temp_obj['message'] = "{}: set {} while recovering and back to null once green".format('; '.join(reasons), ', '.join("{} to {}".format(name, value) for name, value in settings.items()))
+        temp_obj['reference'] = "https://www.elastic.co/guide/en/elasticsearch/reference/current/recovery.html"
+        recovery_data.append(temp_obj)
+    findings.extend(recovery_data)
+    return findings
+
+
+"""
+per index cache stats of the primaries and replicas together, keyed by index name
+
+curl 'localhost:9200/_stats/query_cache,request_cache,fielddata?level=indices&filter_path=indices.*.total'
+{
+  "indices" : {
+    "my_index" : {
+      "total" : {
+        "query_cache" : { "memory_size_in_bytes" : 6186232, "total_count" : 49096, "hit_count" : 20746, "miss_count" : 28350, "cache_size" : 120, "cache_count" : 594, "evictions" : 474 },
+        "fielddata" : { "memory_size_in_bytes" : 0, "evictions" : 0 },
+        "request_cache" : { "memory_size_in_bytes" : 219340, "evictions" : 0, "hit_count" : 744, "miss_count" : 120 }
+      }
+    }
+  }
+}
+"""
+def getIndexCacheStats(cluster_url="http://localhost:9200"):
+    url = "{}/_stats/query_cache,request_cache,fielddata?level=indices&filter_path=indices.*.total".format(cluster_url)
+    response = transport.get(url)
+    if response.status_code == 200:
+        return {index: stats.get('total', {}) for index, stats in response.json().get('indices', {}).items()}
+    else:
+        return {}
+
+
+# value of a cluster setting the way elasticsearch resolves it, transient over persistent over the defaults
+def clusterSetting(cluster_settings, name, default=None):
+    for scope in ['transient', 'persistent', 'defaults']:
+        value = (cluster_settings.get(scope) or {}).get(name)
+        if value is not None:
+            return value
+    return default
+
+
+# size of a node cache setting like indices.queries.cache.size, either a percentage of the heap or an absolute size
+def cacheSizeBytes(value, heap):
+    value = str(value).strip()
+    if value.endswith('%'):
+        return float(value[:-1]) / 100 * heap
+    return parseByteSize(value)
+
+
+# (cache, node setting, default size, largest size recommended) of the caches analyzeCaches sizes
+CACHE_SETTINGS = [
+    ('query_cache', 'indices.queries.cache.size', '10%', 20),
+    ('request_cache', 'indices.requests.cache.size', '1%', 5),
+]
+
+"""
+cache effectiveness per node from the _cat/nodes cache columns and per index from _stats. all counters are since node start,
+rates are taken over the node uptime. the counters of an index add up the nodes holding its shards, its rates are taken
+over the longest node uptime so they are a lower bound when nodes restarted since.
+  a cache thrashes when entries are evicted about as often as new ones are added (evictions / misses >= thrash_ratio)
+  while lookups still hit often enough to be worth caching, the cache is too small and the recommendation is a bigger size.
+  a cache with a hit ratio below min_hit_ratio does not pay off, growing it would not help and the indices with the worst
+  ratio are the ones to turn it off for or to refresh less often (every refresh invalidates the request cache of an index).
+  fielddata evictions mean text fields are aggregated on with fielddata enabled and the heap can not hold it.
+caches with fewer than min_lookups lookups are not judged. indices.queries.cache.size and indices.requests.cache.size
+are static node settings, they go in elasticsearch.yml and need a rolling restart
+"""
+def analyzeCaches(snapshot, min_lookups=1000, min_hit_ratio=0.2, thrash_ratio=0.5):
+    cache_data = []
+    nodes = snapshot.nodes
+
+    def column(name):
+        return np.fromiter((node.get(name) or 0 for node in nodes), dtype=np.float64, count=len(nodes))
+
+    heap = column('heap.max')
+    uptime_seconds = column('uptime') / 1000
+    rules = []
+    stats = {}
+    rule_caches = {}
+    for cache, setting, default, largest in CACHE_SETTINGS:
+        hits = column(cache + '.hit_count')
+        misses = column(cache + '.miss_count')
+        evictions = column(cache + '.evictions')
+        lookups = hits + misses
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hit_ratio = hits / lookups
+            eviction_ratio = evictions / misses
+            eviction_rate = np.where(uptime_seconds > 0, evictions / uptime_seconds, np.nan)
+        judged = lookups >= min_lookups
+        stats[cache] = (hit_ratio, eviction_ratio, eviction_rate, lookups)
+        rule_caches[cache + '_thrashing'] = rule_caches[cache + '_low_hit_ratio'] = (cache, setting, default, largest)
+        rules.append((cache + '_thrashing', judged & (eviction_ratio >= thrash_ratio) & (hit_ratio >= min_hit_ratio)))
+        rules.append((cache + '_low_hit_ratio', judged & (hit_ratio < min_hit_ratio)))
+    fielddata_evictions = column('fielddata.evictions')
+    rules.append(('fielddata_evictions', fielddata_evictions > 0))
+
+    index_stats = snapshot.index_cache_stats
+    index_uptime_seconds = float(uptime_seconds.max()) if len(nodes) else 0
+
+    def indexEvictionRate(evictions):
+        return evictions / index_uptime_seconds if index_uptime_seconds > 0 else None
+
+    worst_indices = {}
+    for cache, setting, default, largest in CACHE_SETTINGS:
+        judged = [(index, stats.get(cache, {})) for index, stats in index_stats.items() if (stats.get(cache, {}).get('hit_count', 0) + stats.get(cache, {}).get('miss_count', 0)) >= min_lookups]
+        ratios = sorted((cache_stats.get('hit_count', 0) / (cache_stats.get('hit_count', 0) + cache_stats.get('miss_count', 0)), index) for index, cache_stats in judged)
+        worst_indices[cache] = [index for ratio, index in ratios if ratio < min_hit_ratio][:5]
+
+    settings = {cache: clusterSetting(snapshot.cluster_settings, setting, default) for cache, setting, default, largest in CACHE_SETTINGS}
+    for row, callout_name in matchingRows(rules):
+        node = nodes[row]
+        temp_obj = {}
+        temp_obj['type'] = 'node_level'
+        temp_obj['callout_name'] = callout_name
+        temp_obj['node'] = node.get('name')
+        temp_obj['http_address'] = node.get('http_address')
+        temp_obj['heap_bytes'] = node.get('heap.max')
+        if callout_name == 'fielddata_evictions':
+            temp_obj['callout_type'] = 'alert'
+            temp_obj['value'] = int(fielddata_evictions[row])
+            temp_obj['fielddata_bytes'] = node.get('fielddata.memory_size')
+            temp_obj['message'] = "node {} evicted fielddata {} times and holds {} of it. aggregations on text fields with fielddata enabled do not fit the heap, use keyword fields with doc_values instead".format(node.get('name'), int(fielddata_evictions[row]), formatBytes(node.get('fielddata.memory_size') or 0))
+            cache_data.append(temp_obj)
+            continue
+
+        cache, setting, default, largest = rule_caches[callout_name]
+        hit_ratio, eviction_ratio, eviction_rate, lookups = [float(values[row]) for values in stats[cache]]
+        configured = settings[cache]
+        capacity = cacheSizeBytes(configured, heap[row])
+        temp_obj['value'] = hit_ratio
+        temp_obj['hit_ratio'] = hit_ratio
+        temp_obj['eviction_ratio'] = eviction_ratio
+        temp_obj['evictions_per_second'] = eviction_rate
+        temp_obj['cache_bytes'] = node.get(cache + '.memory_size')
+        temp_obj['setting'] = setting
+        temp_obj['configured'] = configured
+        if callout_name.endswith('_thrashing'):
+            temp_obj['callout_type'] = 'recommendation'
+            current_percent = capacity / heap[row] * 100 if heap[row] else None
+            recommended = min(largest, max(current_percent * 2, 1)) if current_percent else largest
+            temp_obj['recommended'] = "{:g}%".format(round(recommended, 1))
+            if current_percent is not None and recommended > current_percent:
+                advice = "raise {} from {} to {} in elasticsearch.yml (static setting, needs a rolling restart)".format(setting, configured, temp_obj['recommended'])
+            else:
+                advice = "{} is already at {}, reduce what is cached instead".format(setting, configured)
+            temp_obj['message'] = "{} on node {} thrashes: {:.0%} hit ratio but it evicts {:.0%} as many entries as it misses ({:.2f} evictions/s) with {} of {} used. {}".format(cache, node.get('name'), hit_ratio, eviction_ratio, eviction_rate, formatBytes(node.get(cache + '.memory_size') or 0), formatBytes(capacity), advice)
+        else:
+            temp_obj['callout_type'] = 'warning'
+            temp_obj['worst_indices'] = worst_indices[cache]
+            if cache == 'query_cache':
+                advice = "a bigger {} would not help. turn index.queries.cache.enabled off for the indices with the worst ratio".format(setting)
+            else:
+                advice = "a bigger {} would not help. refresh the indices with the worst ratio less often or turn index.requests.cache.enable off for them".format(setting)
+            temp_obj['message'] = "{} on node {} has a {:.0%} hit ratio over {} lookups. {}{}".format(cache, node.get('name'), hit_ratio, int(lookups), advice, ": {}".format(', '.join(worst_indices[cache])) if worst_indices[cache] else "")
+        cache_data.append(temp_obj)
+
+    # per index, only the indices that waste the most cache are listed so the findings stay proportional to the problems
+    for cache, setting, default, largest in CACHE_SETTINGS:
+        for index in worst_indices[cache]:
+            cache_stats = index_stats[index].get(cache, {})
+            lookups = cache_stats.get('hit_count', 0) + cache_stats.get('miss_count', 0)
+            temp = {}
+            temp['type'] = 'index_level'
+            temp['callout_name'] = 'index_{}_low_hit_ratio'.format(cache)
+            temp['callout_type'] = 'recommendation'
+            temp['index'] = index
+            temp['value'] = cache_stats.get('hit_count', 0) / lookups
+            temp['cache_bytes'] = cache_stats.get('memory_size_in_bytes')
+            temp['evictions'] = cache_stats.get('evictions')
+            temp['evictions_per_second'] = indexEvictionRate(cache_stats.get('evictions') or 0)
+            temp['message'] = "index {} hits its {} on {:.0%} of {} lookups and holds {} of it{}".format(index, cache, temp['value'], lookups, formatBytes(cache_stats.get('memory_size_in_bytes') or 0),
+                ", {:.2f} evictions/s".format(temp['evictions_per_second']) if temp['evictions_per_second'] is not None else "")
+            cache_data.append(temp)
+    for index, stats in index_stats.items():
+        evictions = stats.get('fielddata', {}).get('evictions', 0)
+        if evictions:
+            temp = {}
+            temp['type'] = 'index_level'
+            temp['callout_name'] = 'index_fielddata_evictions'
+            temp['callout_type'] = 'alert'
+            temp['index'] = index
+            temp['evictions'] = evictions
+            temp['evictions_per_second'] = indexEvictionRate(evictions)
+            temp['value'] = temp['evictions_per_second'] if temp['evictions_per_second'] is not None else evictions
+            temp['message'] = "index {} had {} fielddata evictions{}, check its mapping for text fields with fielddata enabled".format(index, evictions,
+                " ({:.2f}/s)".format(temp['evictions_per_second']) if temp['evictions_per_second'] is not None else "")
+            cache_data.append(temp)
+    return cache_data
+
+
 """
 curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0' 'http://localhost:9200/_cluster/stats?pretty'
 
@@ -851,7 +2671,7 @@ curl -X GET  -H 'Connection: keep-alive' -H 'User-Agent: python-requests/2.31.0'
 # get cluster level details
 def getClusterLevelStats(cluster_url="http://localhost:9200"):
     url = "{}/_cluster/stats?pretty".format(cluster_url)
-    response = requests.get(url)
+    response = transport.get(url)
     if response.status_code == 200:
         # print(to_curl(response.request))
         return response.json()
@@ -860,7 +2680,7 @@ def getClusterLevelStats(cluster_url="http://localhost:9200"):
 
 def getClusterLevelSettings(cluster_url="http://localhost:9200"):
     url = "{}/_cluster/settings?include_defaults=true&pretty&flat_settings".format(cluster_url)
-    response = requests.get(url)
+    response = transport.get(url)
     if response.status_code == 200:
         # print(to_curl(response.request))
         return response.json()
@@ -874,31 +2694,35 @@ get cluster health
 
 def getClusterHealth(cluster_url="http://localhost:9200"):
     url = "{}/_cluster/health?pretty".format(cluster_url)
-    response = requests.get(url)
+    response = transport.get(url)
     if response.status_code == 200:
         # print(to_curl(response.request))
         return response.json()
     else:
         return {}
 
-def extractValueAndUnitInMb(value):
-    # if value is undefined then return 0
-    # AttributeError: 'NoneType' object has no attribute 'endswith'    
-    if value is None:
-        return None
-    if value.endswith("gb"):
-        return float(value.replace("gb","")) * 1024
-    elif value.endswith("tb"):
-        return float(value.replace("tb","")) * 1024 * 1024
-    elif value.endswith("kb"):
-        return float(value.replace("kb","")) / 1024
+"""
+version of the cluster state, it changes with every change to the cluster state including shard allocation
+
+curl 'http://localhost:9200/_cluster/state/version?filter_path=cluster_uuid,version,state_uuid'
+{
+  "cluster_uuid" : "wUrfObFwQlC0bdO16V2Rkg",
+  "version" : 4513,
+  "state_uuid" : "K6yq3BbsT4afEsaq3rgXyw"
+}
+"""
+def getClusterStateVersion(cluster_url="http://localhost:9200"):
+    url = "{}/_cluster/state/version?filter_path=cluster_uuid,version,state_uuid".format(cluster_url)
+    response = transport.get(url)
+    if response.status_code == 200:
+        return response.json()
     else:
-        return float(value.replace("mb",""))
-    
-def analyzeClusterLevelDetails(cluster_url="http://localhost:9200"):
-    cluster_stats = getClusterLevelStats(cluster_url)
-    cluster_settings = getClusterLevelSettings(cluster_url)
-    cluster_health = getClusterHealth(cluster_url)
+        return {}
+
+def analyzeClusterLevelDetails(snapshot):
+    cluster_stats = snapshot.cluster_stats
+    cluster_settings = snapshot.cluster_settings
+    cluster_health = snapshot.cluster_health
     # print(cluster_stats)
     cluster_data = []
     # identify what to analyse at cluster level
@@ -933,9 +2757,9 @@ def analyzeClusterLevelDetails(cluster_url="http://localhost:9200"):
         speed_persistent = None
         speed_transient = None
         if value_persistent is not None:
-            speed_persistent = extractValueAndUnitInMb(value_persistent)
+            speed_persistent = parseByteSize(value_persistent) / MB
         if value_transient is not None:
-            speed_transient = extractValueAndUnitInMb(value_transient)
+            speed_transient = parseByteSize(value_transient) / MB
 
         if (speed_persistent is not None and speed_persistent > 40) or (speed_transient is not None and speed_transient > 40):
             temp_obj = {}
@@ -949,11 +2773,348 @@ def analyzeClusterLevelDetails(cluster_url="http://localhost:9200"):
             cluster_data.append(temp_obj)
         
     return cluster_data
-    
 
 
-def generate_html_report(all_level_data):
-    html = """
+"""
+columnar views used by the analyzers. every rule is a numpy boolean mask over all the rows, and findings are only built
+for the rows a rule matched (see matchingRows). string columns with few distinct values (index, node, health ...)
+are stored as integer codes into a list of names
+"""
+class CategoricalColumn:
+    def __init__(self, values):
+        codes_by_name = {}
+        self.names = []
+        codes = []
+        for value in values:
+            code = codes_by_name.get(value)
+            if code is None:
+                code = codes_by_name[value] = len(self.names)
+                self.names.append(value)
+            codes.append(code)
+        self.codes_by_name = codes_by_name
+        self.codes = np.array(codes, dtype=np.int32)
+
+    def equals(self, value):
+        code = self.codes_by_name.get(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def value(self, row):
+        return self.names[self.codes[row]]
+
+
+class ShardColumns:
+    def __init__(self, shards):
+        count = len(shards)
+        self.index = CategoricalColumn(shard.index for shard in shards)
+        self.node = CategoricalColumn(shard.node for shard in shards)
+        self.shard = np.fromiter((shard.shard for shard in shards), dtype=np.int32, count=count)
+        self.primary = np.fromiter((shard.prirep == 'p' for shard in shards), dtype=bool, count=count)
+        self.unassigned = np.fromiter((shard.state == 'UNASSIGNED' for shard in shards), dtype=bool, count=count)
+        self.assigned = np.fromiter((shard.store is not None for shard in shards), dtype=bool, count=count)
+        self.store = np.fromiter((shard.store or 0 for shard in shards), dtype=np.int64, count=count)
+        self.docs = np.fromiter((shard.docs or 0 for shard in shards), dtype=np.int64, count=count)
+
+
+class IndexColumns:
+    def __init__(self, index_data):
+        rows = list(index_data.values())
+        count = len(rows)
+        self.names = list(index_data)
+        self.health = CategoricalColumn(row.get('health') for row in rows)
+        self.status = CategoricalColumn(row.get('status') for row in rows)
+        # -1 when the setting was not collected so that it never matches a rule
+        self.number_of_replicas = np.fromiter((int(row['number_of_replicas']) if row.get('number_of_replicas') is not None else -1 for row in rows), dtype=np.int32, count=count)
+        self.refresh_disabled = np.fromiter((str(row.get('refresh_interval')) == '-1' for row in rows), dtype=bool, count=count)
+        self.store_size = np.fromiter((row.get('store.size') or 0 for row in rows), dtype=np.int64, count=count)
+        self.pri_store_size = np.fromiter((row.get('pri.store.size') or 0 for row in rows), dtype=np.int64, count=count)
+        self.primaries = np.fromiter((int(row.get('pri') or row.get('number_of_shards') or 0) for row in rows), dtype=np.int32, count=count)
+        self.docs = np.fromiter((row.get('docs.count') or 0 for row in rows), dtype=np.int64, count=count)
+        # epoch ms, 0 when the setting was not collected
+        self.creation_date = np.fromiter((int(row.get('creation_date') or 0) for row in rows), dtype=np.int64, count=count)
+
+
+class NodeColumns:
+    def __init__(self, nodes):
+        count = len(nodes)
+        self.name = [node.get('name') for node in nodes]
+        # nan when heap.max is missing so that the node matches no heap rule
+        self.heap_max = np.fromiter((node.get('heap.max') or np.nan for node in nodes), dtype=np.float64, count=count)
+        self.ram_max = np.fromiter((node.get('ram.max') or np.nan for node in nodes), dtype=np.float64, count=count)
+        self.master_eligible = np.fromiter(('m' in (node.get('node.role') or '') for node in nodes), dtype=bool, count=count)
+
+
+"""
+rules is a list of (callout_name, mask). yields (row, callout_name) for every row a mask matched,
+ordered by row and then by the order of the rules, the same order a loop over the rows checking each rule would give
+"""
+def matchingRows(rules):
+    rows = [np.nonzero(mask)[0] for callout_name, mask in rules]
+    rule_positions = [np.full(len(matched), position) for position, matched in enumerate(rows)]
+    if not rows:
+        return
+    rows = np.concatenate(rows)
+    rule_positions = np.concatenate(rule_positions)
+    order = np.lexsort((rule_positions, rows))
+    for row, position in zip(rows[order].tolist(), rule_positions[order].tolist()):
+        yield row, rules[position][0]
+
+
+"""
+everything the analyzers read is collected once into a ClusterSnapshot so that no endpoint is hit twice in a run.
+the endpoints are independent of each other so they are fetched concurrently.
+only allocation explain is left to the unassigned shard analyzer as it depends on which shards are unassigned,
+and the second samples of rate based analyzers which have to be taken later
+
+the columnar views are built on first use and shared by the analyzers running in parallel
+"""
+class ClusterSnapshot:
+    def __init__(self, cluster_url):
+        self.cluster_url = cluster_url
+        self.nodes = []
+        self.shards = []
+        self.index_data = {}
+        self.cluster_stats = {}
+        self.cluster_settings = {}
+        self.cluster_health = {}
+        self.cluster_state_version = {}
+        self.index_cache_stats = {}
+        self.segment_stats = {}
+        self.thread_pools = []
+        self.node_attrs = {}
+        self.recoveries = []
+        self.node_io = {}
+        # time.monotonic() at which each collector's response arrived, analyzers which take a second sample measure from it
+        self.sampled_at = {}
+        self.columns = {}
+        self.columns_lock = threading.Lock()
+
+    def cachedColumns(self, name, build):
+        with self.columns_lock:
+            if name not in self.columns:
+                self.columns[name] = build()
+            return self.columns[name]
+
+    def shardColumns(self):
+        return self.cachedColumns('shards', lambda: ShardColumns(self.shards))
+
+    def indexColumns(self):
+        return self.cachedColumns('indices', lambda: IndexColumns(self.index_data))
+
+    def nodeColumns(self):
+        return self.cachedColumns('nodes', lambda: NodeColumns(self.nodes))
+
+
+# runs one collector of the snapshot, a collector which fails gives empty so the analyzers which need its data find nothing
+# and the rest of the report is still written
+def runCollector(name, collector, cluster_url, empty):
+    try:
+        return collector(cluster_url)
+    except Exception as e:
+        logging.warning("collecting {} failed, the findings which need it are left out: {}".format(name, e))
+        return empty
+
+
+def collectClusterSnapshot(cluster_url="http://localhost:9200", bulk_index_fetch=True, max_workers=8):
+    snapshot = ClusterSnapshot(cluster_url)
+    collectors = {
+        'nodes': getAllNodeLevelDetails,
+        'shards': getShardLevelData,
+        'cluster_stats': getClusterLevelStats,
+        'cluster_settings': getClusterLevelSettings,
+        'cluster_health': getClusterHealth,
+        'cluster_state_version': getClusterStateVersion,
+        'index_cache_stats': getIndexCacheStats,
+        'segment_stats': getSegmentStats,
+        'thread_pools': getThreadPoolStats,
+        'node_attrs': getNodeAttributes,
+        'recoveries': getActiveRecoveries,
+        'node_io': getNodeIoStats,
+    }
+    if bulk_index_fetch:
+        collectors['index_settings'] = getAllIndexLevelSettings
+        collectors['index_details'] = getAllIndexDetails
+    else:
+        collectors['index_data'] = lambda url: gatherIndexLevelData(url, bulk=False)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the empty value of a collector is the default of its snapshot attribute, {} for the index collectors
+        futures = {executor.submit(runCollector, name, collector, cluster_url, getattr(snapshot, name, {})): name for name, collector in collectors.items()}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Collecting cluster snapshot", disable=not show_progress):
+            results[futures[future]] = future.result()
+            snapshot.sampled_at[futures[future]] = time.monotonic()
+
+    snapshot.nodes = results['nodes']
+    snapshot.shards = results['shards']
+    snapshot.cluster_stats = results['cluster_stats']
+    snapshot.cluster_settings = results['cluster_settings']
+    snapshot.cluster_health = results['cluster_health']
+    snapshot.cluster_state_version = results['cluster_state_version']
+    snapshot.index_cache_stats = results['index_cache_stats']
+    snapshot.segment_stats = results['segment_stats']
+    snapshot.thread_pools = results['thread_pools']
+    snapshot.node_attrs = results['node_attrs']
+    snapshot.recoveries = results['recoveries']
+    snapshot.node_io = results['node_io']
+    if bulk_index_fetch:
+        snapshot.index_data = joinIndexLevelData(results['index_settings'], results['index_details'])
+    else:
+        snapshot.index_data = results['index_data']
+    return snapshot
+
+
+
+"""
+runs the analyzers concurrently on the snapshot and collects their findings into all_level_data keyed by level.
+analyzers is a list of (level, analyzer function, kwargs). every analyzer gets timeout seconds from the start,
+an analyzer which is not done by then gets an analyzer_timed_out warning in its level and the report goes ahead without waiting.
+analyzers which take findings and cancel arguments (like analyseUnassignedShards) keep the findings they produced before the timeout.
+the analyzer threads are daemon threads so a stuck analyzer cannot hold the process after the report is written
+"""
+def runAnalyzers(snapshot, analyzers, timeout=None, pbar=None):
+    done = queue.Queue()
+    partial = {}
+    cancels = {}
+
+    def run(level, analyzer, kwargs):
+        try:
+            done.put((level, analyzer(snapshot, **kwargs), None))
+        except Exception as e:
+            done.put((level, None, e))
+
+    started = time.monotonic()
+    for level, analyzer, kwargs in analyzers:
+        kwargs = dict(kwargs)
+        parameters = inspect.signature(analyzer).parameters
+        if 'findings' in parameters and 'cancel' in parameters:
+            partial[level] = kwargs['findings'] = []
+            cancels[level] = kwargs['cancel'] = threading.Event()
+        threading.Thread(target=run, args=(level, analyzer, kwargs), name=analyzer.__name__, daemon=True).start()
+
+    all_level_data = {}
+    pending = [level for level, analyzer, kwargs in analyzers]
+    while pending:
+        remaining = None if timeout is None else started + timeout - time.monotonic()
+        try:
+            level, level_findings, error = done.get(timeout=remaining if remaining is None else max(0, remaining))
+        except queue.Empty:
+            break
+        pending.remove(level)
+        if error is not None:
+            logging.error("analyzer for {} failed: {}".format(level, error))
+            level_findings = partial.get(level, [])
+            level_findings.append({'type': level, 'callout_type': 'warning', 'callout_name': 'analyzer_failed', 'message': "analyzer for {} failed with {}. findings for this level are incomplete".format(level, repr(error))})
+        all_level_data[level] = level_findings
+        if pbar is not None:
+            pbar.update(1)
+
+    for level in pending:
+        logging.warning("analyzer for {} did not finish in {}s, reporting partial findings".format(level, timeout))
+        if level in cancels:
+            cancels[level].set()
+        level_findings = list(partial.get(level, []))
+        level_findings.append({'type': level, 'callout_type': 'warning', 'callout_name': 'analyzer_timed_out', 'message': "analyzer for {} did not finish in {}s. findings for this level are partial, {} collected before the timeout".format(level, timeout, len(level_findings))})
+        all_level_data[level] = level_findings
+        if pbar is not None:
+            pbar.update(1)
+
+    # keep the levels in the order the analyzers were given
+    return {level: all_level_data[level] for level, analyzer, kwargs in analyzers}
+
+
+# histogram buckets as (upper bound, label). shard sizes follow the 10gb to 50gb recommendation,
+# heap sizes stop at 31gb above which the jvm can not use compressed object pointers
+SIZE_BUCKETS = [(1 * GB, '< 1gb'), (10 * GB, '1gb - 10gb'), (30 * GB, '10gb - 30gb'), (50 * GB, '30gb - 50gb'), (100 * GB, '50gb - 100gb'), (float('inf'), '>= 100gb')]
+HEAP_BUCKETS = [(4 * GB, '< 4gb'), (8 * GB, '4gb - 8gb'), (16 * GB, '8gb - 16gb'), (31 * GB, '16gb - 31gb'), (float('inf'), '>= 31gb')]
+
+def histogram(values, buckets):
+    values = np.asarray([value for value in values if value is not None], dtype=np.float64)
+    if not len(values):
+        return {}
+    counts = np.bincount(np.searchsorted([bound for bound, label in buckets], values, side='right'), minlength=len(buckets))
+    return {label: int(count) for (bound, label), count in zip(buckets, counts) if count}
+
+
+# the node a finding is about, shard findings carry the node name and node findings the name and http address
+def findingNode(finding):
+    return finding.get('node') or finding.get('http_address')
+
+
+"""
+rolls the findings of every level up into a summary whose size does not depend on the size of the cluster.
+for every callout_name it has the count, the indices and nodes with most findings, the largest offenders by store or heap
+and histograms of their sizes. across all callouts it has per index and per node totals, again limited to top_n.
+
+{
+  "levels": {
+    "shard_level": {
+      "shard_lt_10gb": {
+        "callout_type": "recommendation",
+        "count": 5120,
+        "example": "Index logs-1 shard 0 has store size 1.2gb which is less than 10gb",
+        "distinct_indices": 1024,
+        "distinct_nodes": 10,
+        "top_indices": [["logs-1", 5], ...],
+        "top_nodes": [["node-1", 520], ...],
+        "largest": [{"message": ..., "index": ..., "node": ..., "store_bytes": ...}, ...],
+        "size_histogram": {"< 1gb": 4000, "1gb - 10gb": 1120}
+      }
+    }
+  },
+  "indices": {"distinct": 1024, "top": [{"name": "logs-1", "total": 7, "callouts": {"shard_lt_10gb": 5, ...}}, ...]},
+  "nodes": {"distinct": 10, "top": [...]}
+}
+"""
+def aggregateFindings(all_level_data, top_n=10):
+    levels = {}
+    index_rollup = {}
+    node_rollup = {}
+    for level, findings in all_level_data.items():
+        categories = {}
+        for finding in findings:
+            categories.setdefault(finding.get('callout_name', 'Other'), []).append(finding)
+            index = finding.get('index')
+            if index is not None:
+                index_rollup.setdefault(index, Counter())[finding.get('callout_name', 'Other')] += 1
+            node = findingNode(finding)
+            if node is not None:
+                node_rollup.setdefault(node, Counter())[finding.get('callout_name', 'Other')] += 1
+
+        level_summary = {}
+        for callout_name, category_findings in categories.items():
+            indices = Counter(finding['index'] for finding in category_findings if finding.get('index') is not None)
+            nodes = Counter(findingNode(finding) for finding in category_findings if findingNode(finding) is not None)
+            summary = {
+                'callout_type': category_findings[0].get('callout_type', ''),
+                'count': len(category_findings),
+                'example': category_findings[0].get('message', ''),
+                'distinct_indices': len(indices),
+                'distinct_nodes': len(nodes),
+                'top_indices': indices.most_common(top_n),
+                'top_nodes': nodes.most_common(top_n),
+            }
+            # offenders are ranked by what they hold, store for shards and indices, heap for nodes
+            for field, buckets, name in [('store_bytes', SIZE_BUCKETS, 'size_histogram'), ('heap_bytes', HEAP_BUCKETS, 'heap_histogram')]:
+                sized = [finding for finding in category_findings if finding.get(field) is not None]
+                if not sized:
+                    continue
+                summary[name] = histogram((finding[field] for finding in sized), buckets)
+                if 'largest' not in summary:
+                    largest = sorted(sized, key=lambda finding: finding[field], reverse=True)[:top_n]
+                    summary['largest'] = [{key: finding.get(key) for key in ['message', 'index', 'shard', 'node', field] if finding.get(key) is not None} for finding in largest]
+            level_summary[callout_name] = summary
+        levels[level] = level_summary
+
+    def rollup(counters):
+        top = sorted(counters.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top_n]
+        return {'distinct': len(counters), 'top': [{'name': name, 'total': sum(callouts.values()), 'callouts': dict(callouts)} for name, callouts in top]}
+
+    return {'levels': levels, 'indices': rollup(index_rollup), 'nodes': rollup(node_rollup)}
+
+
+REPORT_HEAD = """
     <html>
     <head>
         <title>ES Health Check</title>
@@ -970,67 +3131,212 @@ def generate_html_report(all_level_data):
             .alert { background-color: #f8d7da; }
             .recommendation { background-color: #d4edda; }
             .occurrence { margin-top: 10px; padding-left: 20px; border-left: 3px solid #007bff; }
+            .summary { margin: 10px 0; }
+            .summary table { border-collapse: collapse; display: inline-table; margin: 0 20px 10px 0; vertical-align: top; }
+            .summary th, .summary td { border: 1px solid #ddd; padding: 2px 8px; text-align: left; }
         </style>
         <script>
+            var DETAILS_DIR = %s;
+            var PAGE_SIZE = 200;
+            var requested = {};
+
             function toggle(el) {
                 el.classList.toggle('open');
                 el.nextElementSibling.classList.toggle('show');
             }
+
+            // details of a category are only loaded the first time it is opened
+            function openCategory(el, id) {
+                toggle(el);
+                if (requested[id]) return;
+                requested[id] = true;
+                var script = document.createElement('script');
+                script.src = DETAILS_DIR + '/' + id + '.js';
+                document.head.appendChild(script);
+            }
+
+            // called by the details file of a category with its gzip compressed, base64 encoded json
+            function esDetails(id, data) {
+                var bytes = Uint8Array.from(atob(data), function(c) { return c.charCodeAt(0); });
+                var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+                new Response(stream).json().then(function(groups) {
+                    var container = document.getElementById('category-' + id);
+                    container.textContent = '';
+                    renderGroups(container, groups, 0);
+                });
+            }
+
+            function element(tag, className, text) {
+                var el = document.createElement(tag);
+                if (className) el.className = className;
+                if (text !== undefined) el.textContent = text;
+                return el;
+            }
+
+            function field(name, value) {
+                var p = element('p');
+                p.appendChild(element('strong', null, name + ':'));
+                p.appendChild(document.createTextNode(' ' + (typeof value === 'object' ? JSON.stringify(value) : value)));
+                return p;
+            }
+
+            // groups are rendered PAGE_SIZE at a time so that a category with a lot of findings stays responsive
+            function renderGroups(container, groups, start) {
+                groups.slice(start, start + PAGE_SIZE).forEach(function(group) {
+                    var issue = element('div', 'issue ' + group.callout_type);
+                    issue.appendChild(field('Message', group.message));
+                    issue.appendChild(field('Occurrences', group.occurrences.length));
+                    var details = element('div', 'toggle', 'Show Details');
+                    details.setAttribute('onclick', 'toggle(this)');
+                    issue.appendChild(details);
+                    var content = element('div', 'content');
+                    group.occurrences.forEach(function(occurrence) {
+                        var div = element('div', 'occurrence');
+                        Object.keys(occurrence).forEach(function(key) { div.appendChild(field(key, occurrence[key])); });
+                        content.appendChild(div);
+                    });
+                    issue.appendChild(content);
+                    container.appendChild(issue);
+                });
+                if (start + PAGE_SIZE < groups.length) {
+                    var more = element('button', null, 'Show ' + Math.min(PAGE_SIZE, groups.length - start - PAGE_SIZE) + ' more of ' + (groups.length - start - PAGE_SIZE));
+                    more.onclick = function() { more.remove(); renderGroups(container, groups, start + PAGE_SIZE); };
+                    container.appendChild(more);
+                }
+            }
         </script>
     </head>
     <body>
         <h1>Elasticsearch Health Check Report</h1>
     """
 
-    for level, issues in all_level_data.items():
-        if issues:
-            html += f"<div class='level'>"
-            html += f"<h2 class='toggle' onclick='toggle(this)'>{level.replace('_', ' ').title()}</h2>"
-            html += f"<div class='content'>"
-            
+REPORT_TAIL = """
+    </body>
+    </html>
+    """
+
+# rows are written to f as they come, rows can be a generator
+def summaryTable(f, title, headers, rows):
+    f.write("<table><tr><th colspan='{}'>{}</th></tr>".format(len(headers), escape(title)))
+    f.write("<tr>" + "".join("<th>{}</th>".format(escape(header)) for header in headers) + "</tr>")
+    for row in rows:
+        f.write("<tr>" + "".join("<td>{}</td>".format(escape(str(cell))) for cell in row) + "</tr>")
+    f.write("</table>")
+
+
+def rollupRows(rollups):
+    return ([rollup['name'], rollup['total'], ', '.join("{} {}".format(name, count) for name, count in rollup['callouts'].items())] for rollup in rollups)
+
+
+# writes the aggregateFindings summary of one callout_name to f
+def categorySummaryHtml(f, summary):
+    f.write("<div class='summary'><p><strong>Example:</strong> {}</p>".format(escape(summary['example'])))
+    f.write("<p>{} findings across {} indices and {} nodes</p>".format(summary['count'], summary['distinct_indices'], summary['distinct_nodes']))
+    if summary['top_indices']:
+        summaryTable(f, 'Top indices', ['index', 'findings'], summary['top_indices'])
+    if summary['top_nodes']:
+        summaryTable(f, 'Top nodes', ['node', 'findings'], summary['top_nodes'])
+    if summary.get('largest'):
+        field = 'store_bytes' if 'store_bytes' in summary['largest'][0] else 'heap_bytes'
+        summaryTable(f, 'Largest', ['index', 'shard', 'node', field.split('_')[0]], ([offender.get('index', ''), offender.get('shard', ''), offender.get('node', ''), formatBytes(offender.get(field))] for offender in summary['largest']))
+    for name in ['size_histogram', 'heap_histogram']:
+        if summary.get(name):
+            summaryTable(f, name.replace('_', ' ').title(), ['bucket', 'findings'], summary[name].items())
+    f.write("</div>")
+
+
+"""
+writes the report to report_path piece by piece. the page has the aggregateFindings summary of every category,
+the raw occurrences of every category go to <report name>_details/<category id>.js as gzip compressed json which the page
+loads when they are asked for, so the page opens instantly however many findings there are.
+everything is written to the files as it is produced, the details are compressed and encoded on the way out
+"""
+def writeHtmlReport(all_level_data, report_path="es_health_check.html", summary=None):
+    if summary is None:
+        summary = aggregateFindings(all_level_data)
+    details_dir = os.path.splitext(report_path)[0] + '_details'
+    os.makedirs(details_dir, exist_ok=True)
+    category_id = 0
+    with open(report_path, 'w') as f:
+        f.write(REPORT_HEAD % json.dumps(os.path.basename(details_dir)))
+        f.write("<div class='summary'>")
+        summaryTable(f, 'Indices with most findings ({} with findings)'.format(summary['indices']['distinct']), ['index', 'findings', 'callouts'], rollupRows(summary['indices']['top']))
+        summaryTable(f, 'Nodes with most findings ({} with findings)'.format(summary['nodes']['distinct']), ['node', 'findings', 'callouts'], rollupRows(summary['nodes']['top']))
+        f.write("</div>")
+        for level, issues in all_level_data.items():
+            if not issues:
+                continue
+            f.write("<div class='level'>")
+            f.write("<h2 class='toggle' onclick='toggle(this)'>{}</h2>".format(escape(level.replace('_', ' ').title())))
+            f.write("<div class='content'>")
+
             categories = {}
             for issue in issues:
-                category = issue.get('callout_name', 'Other')
-                if category not in categories:
-                    categories[category] = []
-                categories[category].append(issue)
-            
+                categories.setdefault(issue.get('callout_name', 'Other'), []).append(issue)
+
             for category, category_issues in categories.items():
-                html += f"<div class='category'>"
-                html += f"<h3 class='toggle' onclick='toggle(this)'>{category.replace('_', ' ').title()} ({len(category_issues)})</h3>"
-                html += f"<div class='content'>"
-                
-                unique_messages = {}
-                for issue in category_issues:
-                    message = issue.get('message', '')
-                    if message not in unique_messages:
-                        unique_messages[message] = []
-                    unique_messages[message].append(issue)
-                
-                for message, occurrences in unique_messages.items():
-                    html += f"<div class='issue {occurrences[0].get('callout_type', '')}'>"
-                    html += f"<p><strong>Message:</strong> {message}</p>"
-                    html += f"<p><strong>Occurrences:</strong> {len(occurrences)}</p>"
-                    html += f"<div class='toggle' onclick='toggle(this)'>Show Details</div>"
-                    html += f"<div class='content'>"
-                    for occurrence in occurrences:
-                        html += f"<div class='occurrence'>"
-                        for key, value in occurrence.items():
-                            if key not in ['message', 'callout_type', 'callout_name']:
-                                html += f"<p><strong>{key}:</strong> {value}</p>"
-                        html += "</div>"
-                    html += "</div>"
-                    html += "</div>"
-                
-                html += "</div></div>"
-            
-            html += "</div></div>"
+                category_id += 1
+                writeReportDetails(os.path.join(details_dir, "{}.js".format(category_id)), category_id, category_issues)
+                f.write("<div class='category'>")
+                f.write("<h3 class='toggle' onclick='toggle(this)'>{} ({})</h3>".format(escape(category.replace('_', ' ').title()), len(category_issues)))
+                f.write("<div class='content'>")
+                categorySummaryHtml(f, summary['levels'][level][category])
+                f.write("<div class='toggle' onclick='openCategory(this, {})'>Show All Occurrences</div>".format(category_id))
+                f.write("<div class='content' id='category-{}'><p>Loading...</p></div>".format(category_id))
+                f.write("</div></div>")
 
-    html += """
-    </body>
-    </html>
-    """
-    return html
+            f.write("</div></div>")
+        f.write(REPORT_TAIL)
+
+
+"""
+file like object for gzip.GzipFile which base64 encodes what is written to it straight into the text file f.
+base64 turns every 3 bytes into 4 characters, so up to 2 bytes are kept back until more come or close is called
+"""
+class Base64Writer:
+    def __init__(self, f):
+        self.f = f
+        self.pending = b''
+
+    def write(self, data):
+        written = len(data)
+        data = self.pending + bytes(data)
+        aligned = len(data) - len(data) % 3
+        self.f.write(base64.b64encode(data[:aligned]).decode('ascii'))
+        self.pending = data[aligned:]
+        return written
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.f.write(base64.b64encode(self.pending).decode('ascii'))
+        self.pending = b''
+
+
+# occurrences of a category grouped by message, json encoded straight into a gzip stream which is base64 encoded into the file
+def writeReportDetails(details_path, category_id, category_issues):
+    unique_messages = {}
+    for issue in category_issues:
+        unique_messages.setdefault(issue.get('message', ''), []).append(issue)
+    groups = ({
+        'message': message,
+        'callout_type': occurrences[0].get('callout_type', ''),
+        'occurrences': [{key: value for key, value in occurrence.items() if key not in ['message', 'callout_type', 'callout_name']} for occurrence in occurrences],
+    } for message, occurrences in unique_messages.items())
+
+    with open(details_path, 'w') as f:
+        f.write("esDetails({}, \"".format(category_id))
+        encoded = Base64Writer(f)
+        with gzip.GzipFile(fileobj=encoded, mode='wb') as gz:
+            gz.write(b'[')
+            for position, group in enumerate(groups):
+                if position:
+                    gz.write(b',')
+                gz.write(json.dumps(group, default=str).encode('utf-8'))
+            gz.write(b']')
+        encoded.close()
+        f.write("\");\n")
 
 # print(gatherIndexLevelData(args.cluster_url))
 # print(getIndexLevelSettings('mktorders-10005', args.cluster_url))
@@ -1040,42 +3346,302 @@ def generate_html_report(all_level_data):
 
 # keep appending recommmendations from all analyzers into an array
 
-def main():
+# watch mode
+
+"""
+gauges for the metrics endpoint of --watch. a family is replaced as a whole so that label values which are gone
+(a callout with no findings left) disappear from the output instead of keeping their last value
+"""
+class WatchMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+
+    def setFamily(self, name, help_text, values):
+        with self.lock:
+            self.families[name] = (help_text, dict(values))
+
+    def set(self, name, help_text, value):
+        self.setFamily(name, help_text, {(): value})
+
+    def increment(self, name, help_text, labels=()):
+        with self.lock:
+            values = self.families.get(name, (help_text, {}))[1]
+            values[labels] = values.get(labels, 0) + 1
+            self.families[name] = (help_text, values)
+
+    # prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, values) in sorted(self.families.items()):
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} gauge".format(name))
+                for labels, value in values.items():
+                    label_text = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"')) for key, label in labels)
+                    lines.append("{}{} {}".format(name, "{" + label_text + "}" if label_text else "", float(value)))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startMetricsServer(metrics, host="127.0.0.1", port=9108):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+CLUSTER_STATUS_VALUES = {'green': 0, 'yellow': 1, 'red': 2}
+HEALTH_GAUGES = ['number_of_nodes', 'number_of_data_nodes', 'active_shards', 'relocating_shards', 'initializing_shards', 'unassigned_shards', 'delayed_unassigned_shards', 'number_of_pending_tasks', 'active_shards_percent_as_number']
+
+def updateHealthMetrics(metrics, health):
+    metrics.set('es_validate_cluster_status', "cluster health status, 0 green, 1 yellow, 2 red, -1 unknown", CLUSTER_STATUS_VALUES.get(health.get('status'), -1))
+    for field in HEALTH_GAUGES:
+        if health.get(field) is not None:
+            metrics.set('es_validate_cluster_' + field, "{} from _cluster/health".format(field), health[field])
+
+
+# what a finding is about, without the parts of the message (sizes, counts) which change between scans
+def findingKey(finding):
+    return (finding.get('type'), finding.get('callout_name'), finding.get('index'), finding.get('shard'), finding.get('primary_or_replica'), findingNode(finding))
+
+
+"""
+compares the findings of a scan with the previous scan. returns (new, resolved) lists of findings,
+a finding which is still there with a different message (like a grown shard) is neither
+"""
+def diffFindings(previous, current):
+    new = [finding for key, finding in current.items() if key not in previous]
+    resolved = [finding for key, finding in previous.items() if key not in current]
+    return new, resolved
+
+
+"""
+polls the cluster until interrupted, with tiered intervals:
+  every health_interval  _cluster/health on a thread of its own, the metrics are updated and status changes are logged
+  every scan_interval    _cluster/state/version, a full scan (snapshot and analyzers) runs only when the version or the health status changed
+  every full_scan_interval  a full scan runs anyway as shard sizes and node stats change without a new cluster state version
+a full scan logs only the findings which are new or resolved since the previous scan, and appends them to events_file as json lines.
+every request goes through the same transport so connections are kept alive between polls.
+a poll or scan which fails (the cluster does not answer during a rolling restart, retries ran out) is logged and counted in
+es_validate_watch_errors, the status becomes unknown (-1) and the next poll tries again.
+
+curl localhost:9108/metrics
+"""
+def watchCluster(cluster_url, analyzers, health_interval=5, scan_interval=60, full_scan_interval=600, metrics_host="127.0.0.1", metrics_port=9108, events_file=None, analyzer_timeout=None, bulk_index_fetch=True):
+    global show_progress
+    show_progress = False
+    metrics = WatchMetrics()
+    server = startMetricsServer(metrics, metrics_host, metrics_port)
+    logging.info("Watching {}, metrics on http://{}:{}/metrics".format(cluster_url, metrics_host, server.server_address[1]))
+
+    # the health polls run on their own thread so that a long scan (the rate analyzers wait for their second sample) does not hold them up
+    health_state = {'status': None}
+    stop = threading.Event()
+    health_thread = threading.Thread(target=watchHealth, args=(cluster_url, metrics, health_state, health_interval, stop), name='watchHealth', daemon=True)
+    health_thread.start()
+
+    previous_findings = None
+    scanned_status = None
+    scanned_version = None
+    next_full_scan = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            next_scan = now + scan_interval
+            try:
+                state_version = getClusterStateVersion(cluster_url)
+                status = health_state['status']
+                changed = (state_version.get('cluster_uuid'), state_version.get('version')) != scanned_version or status != scanned_status
+                if changed or now >= next_full_scan:
+                    previous_findings = watchScan(cluster_url, analyzers, metrics, previous_findings, events_file, analyzer_timeout, bulk_index_fetch)
+                    next_full_scan = now + full_scan_interval
+                    scanned_version = (state_version.get('cluster_uuid'), state_version.get('version'))
+                    scanned_status = status
+            except Exception as e:
+                watchError(metrics, 'scan', e)
+            time.sleep(max(0, next_scan - time.monotonic()))
+    except KeyboardInterrupt:
+        logging.info("Stopped watching {}".format(cluster_url))
+    finally:
+        stop.set()
+        health_thread.join(timeout=health_interval)
+        server.shutdown()
+
+
+# the health tier of watchCluster, polls _cluster/health every health_interval until stop is set
+def watchHealth(cluster_url, metrics, health_state, health_interval, stop):
+    while not stop.is_set():
+        try:
+            health = getClusterHealth(cluster_url)
+        except Exception as e:
+            watchError(metrics, 'health', e)
+            health = {}
+        updateHealthMetrics(metrics, health)
+        if health.get('status') != health_state['status']:
+            if health_state['status'] is not None:
+                logging.warning("cluster status changed from {} to {}".format(health_state['status'], health.get('status')))
+            health_state['status'] = health.get('status')
+        stop.wait(health_interval)
+
+
+def watchError(metrics, phase, error):
+    metrics.increment('es_validate_watch_errors', "failed health polls and scans since the watch started", (('phase', phase),))
+    logging.error("{} failed with {}: {}, trying again with the next poll".format(phase, error.__class__.__name__, error))
+
+
+# one full scan of watchCluster, returns the findings keyed by findingKey for the next diff
+def watchScan(cluster_url, analyzers, metrics, previous_findings, events_file, analyzer_timeout, bulk_index_fetch):
+    started = time.monotonic()
+    snapshot = collectClusterSnapshot(cluster_url, bulk_index_fetch=bulk_index_fetch)
+    all_level_data = runAnalyzers(snapshot, analyzers, timeout=analyzer_timeout)
+    duration = time.monotonic() - started
+
+    current = {}
+    counts = Counter()
+    for level, findings in all_level_data.items():
+        for finding in findings:
+            current[findingKey(finding)] = finding
+            counts[(('level', level), ('callout_name', finding.get('callout_name', 'Other')))] += 1
+    metrics.setFamily('es_validate_findings', "findings of the last scan per level and callout_name", counts)
+    metrics.set('es_validate_scan_duration_seconds', "duration of the last full scan", duration)
+    metrics.set('es_validate_last_scan_timestamp_seconds', "unix time of the last full scan", time.time())
+    metrics.set('es_validate_cluster_state_version', "cluster state version of the last full scan", (snapshot.cluster_state_version or {}).get('version') or 0)
+
+    if previous_findings is None:
+        logging.info("Initial scan took {:.1f}s with {} findings".format(duration, len(current)))
+        return current
+
+    new, resolved = diffFindings(previous_findings, current)
+    for finding in new:
+        logging.warning("new: {}".format(finding.get('message')))
+    for finding in resolved:
+        logging.info("resolved: {}".format(finding.get('message')))
+    logging.info("Scan took {:.1f}s, {} new and {} resolved of {} findings".format(duration, len(new), len(resolved), len(current)))
+    if events_file and (new or resolved):
+        with open(events_file, 'a') as f:
+            for change, findings in [('new', new), ('resolved', resolved)]:
+                for finding in findings:
+                    f.write(json.dumps({'time': time.time(), 'change': change, 'finding': finding}, default=str) + "\n")
+    return current
+
+
+def buildArgParser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--cluster_url", help="provide cluster url")
-    args = parser.parse_args()
+    parser.add_argument("--calls_per_second", type=float, default=10, help="max requests per second sent to the cluster, 0 disables the limit")
+    parser.add_argument("--max_retries", type=int, default=3, help="retries on 429, 5xx and timeouts")
+    parser.add_argument("--request_timeout", type=float, default=30, help="timeout in seconds for each request")
+    parser.add_argument("--explain_concurrency", type=int, default=8, help="parallel allocation explain calls for unassigned shards, 1 makes them serial")
+    parser.add_argument("--explain_calls_per_second", type=float, default=5, help="budget for allocation explain calls, 0 disables it. the --calls_per_second limit still applies and wins when it is lower")
+    parser.add_argument("--analyzer_timeout", type=float, default=None, help="seconds each analyzer may run before the report goes ahead with its partial findings")
+    parser.add_argument("--record", metavar="FILE", help="save every raw response from the cluster to FILE (gzip json lines) for offline runs")
+    parser.add_argument("--replay", metavar="FILE", help="run all the analyzers from a file saved with --record, without any request to the cluster")
+    parser.add_argument("--incremental_state", metavar="FILE", help="keep unassigned shard explanations in FILE between runs and only explain shards which became unassigned since the last run")
+    parser.add_argument("--incremental_max_age", type=float, default=None, help="seconds after which a cached explanation is refreshed")
+    parser.add_argument("--explain_every_shard", action="store_true", help="explain every unassigned shard instead of one shard per index, unassigned reason and primary/replica group")
+    parser.add_argument("--watch", action="store_true", help="keep polling the cluster, log only changed findings and serve metrics instead of writing a report")
+    parser.add_argument("--health_interval", type=float, default=5, help="seconds between _cluster/health polls in --watch mode")
+    parser.add_argument("--scan_interval", type=float, default=60, help="seconds between checks for a new cluster state version, which trigger a full scan in --watch mode")
+    parser.add_argument("--full_scan_interval", type=float, default=600, help="seconds after which --watch mode runs a full scan even without a new cluster state version")
+    parser.add_argument("--metrics_host", default="127.0.0.1", help="address of the --watch metrics endpoint")
+    parser.add_argument("--metrics_port", type=int, default=9108, help="port of the --watch metrics endpoint")
+    parser.add_argument("--watch_events", metavar="FILE", help="append new and resolved findings of --watch mode to FILE as json lines")
+    parser.add_argument("--sample_window", type=float, default=None, help="seconds between the two samples of the rate based analyzers (hot nodes, thread pools, tiering, recoveries). they wait that long, so they only run when it or their own window is given")
+    parser.add_argument("--hot_node_window", type=float, default=None, help="seconds between the two _cat/nodes samples the hot node rates are computed from, default --sample_window")
+    parser.add_argument("--hot_node_skew", type=float, default=2.0, help="a data node is hot when its rate is more than this many times the median of the data nodes")
+    parser.add_argument("--thread_pool_window", type=float, default=None, help="seconds between the two _cat/thread_pool samples the rejection and queue rates are computed from, default --sample_window")
+    parser.add_argument("--recovery_window", type=float, default=None, help="seconds between the two _cat/recovery samples the recovery throughput is computed from, default --sample_window")
+    parser.add_argument("--max_search_latency_ms", type=float, default=100, help="average search latency above which recoveries should be slowed down")
+    parser.add_argument("--disk_mb_per_sec", type=float, default=500, help="disk throughput a data node can sustain, for the recovery headroom")
+    parser.add_argument("--network_mb_per_sec", type=float, default=1250, help="network throughput of a data node (1250 is 10gbit), for the recovery headroom")
+    parser.add_argument("--balance_tolerance", type=float, default=0.1, help="how far from the mean shard count and bytes a data node may be before it is skewed and the rebalance plan moves shards off it")
+    parser.add_argument("--max_moves", type=int, default=200, help="most shard moves in the rebalance plan")
+    parser.add_argument("--target_shard_gb", type=float, default=30, help="primary shard size the sizing plans aim for")
+    parser.add_argument("--growth_horizon_days", type=float, default=30, help="days of growth the sizing plans make room for")
+    parser.add_argument("--tier_window", type=float, default=None, help="seconds between the two _cat/indices samples the search and indexing rates of the tiering plan are computed from, default --sample_window")
+    parser.add_argument("--warm_after_days", type=float, default=30, help="age from which an index that is barely searched or written moves to the warm tier")
+    parser.add_argument("--tier_budget_share", type=float, default=0.5, help="share of indices.recovery.max_bytes_per_sec the tiering relocations may use")
+    parser.add_argument("--min_deleted_ratio", type=float, default=0.2, help="deleted docs share from which an index is worth expunging")
+    parser.add_argument("--max_segments_per_shard", type=int, default=50, help="segments per shard copy above which an index is worth merging")
+    parser.add_argument("--top_n", type=int, default=10, help="indices, nodes and offenders listed per finding in the summary")
+    parser.add_argument("--per_index_fetch", action="store_true", help="fetch settings and details index by index instead of in bulk (2 requests per index)")
+    return parser
+
+
+# the analyzers main runs, as (level, analyzer, kwargs) for runAnalyzers. also used by benchmark.py.
+# the rate based analyzers wait window seconds for their second sample and are left out when they have no window
+def buildAnalyzers(args):
+    def window(own):
+        return own if own is not None else args.sample_window
+    analyzers = [
+        ('node_level', analyzeAllNodeLevelDetails, {}),
+        ('hot_node_level', analyzeHotNodes, {'window': window(args.hot_node_window), 'skew': args.hot_node_skew}),
+        ('thread_pool_level', analyzeThreadPools, {'window': window(args.thread_pool_window)}),
+        ('shard_level', analyzeShardLevelDetails, {}),
+        ('sizing_level', analyzeShardSizing, {'target_gb': args.target_shard_gb, 'horizon_days': args.growth_horizon_days}),
+        ('tier_level', analyzeTiering, {'window': window(args.tier_window), 'warm_after_days': args.warm_after_days, 'budget_share': args.tier_budget_share}),
+        ('balance_level', analyzeShardBalance, {'tolerance': args.balance_tolerance, 'max_moves': args.max_moves}),
+        ('cluster_level', analyzeClusterLevelDetails, {}),
+        ('recovery_level', analyzeRecoveries, {'window': window(args.recovery_window), 'max_search_latency_ms': args.max_search_latency_ms, 'disk_mb_per_sec': args.disk_mb_per_sec, 'network_mb_per_sec': args.network_mb_per_sec}),
+        ('cache_level', analyzeCaches, {}),
+        ('index_level', analyzeIndexLevelDetails, {}),
+        ('merge_level', analyzeSegments, {'min_deleted_ratio': args.min_deleted_ratio, 'max_segments_per_shard': args.max_segments_per_shard}),
+        ('unassigned_shard_data', analyseUnassignedShards, {'max_concurrency': args.explain_concurrency, 'calls_per_second': args.explain_calls_per_second, 'state_file': args.incremental_state, 'max_age': args.incremental_max_age, 'group': not args.explain_every_shard}),
+    ]
+    return [(level, analyzer, kwargs) for level, analyzer, kwargs in analyzers if 'window' not in kwargs or kwargs['window'] is not None]
+
+
+def main():
+    args = buildArgParser().parse_args()
+    configureTransport(record_file=args.record, replay_file=args.replay, cluster_url=args.cluster_url, calls_per_second=args.calls_per_second, max_retries=args.max_retries, timeout=args.request_timeout, pool_maxsize=max(16, args.explain_concurrency))
+    if args.replay:
+        # urls are matched without the host, the recorded one is only used for display
+        args.cluster_url = args.cluster_url or transport.header.get('cluster_url')
+        logging.info("Replaying {} recorded at {}".format(args.replay, time.ctime(transport.header.get('recorded_at'))))
 
     logging.info(f"Starting ES health check for cluster: {args.cluster_url}")
 
-    with tqdm(total=5, desc="Overall Progress") as pbar:
-        node_level = analyzeAllNodeLevelDetails(args.cluster_url)
-        pbar.update(1)
+    analyzers = buildAnalyzers(args)
 
-        shard_level = analyzeShardLevelDetails(args.cluster_url)
-        pbar.update(1)
+    if args.watch:
+        watchCluster(args.cluster_url, analyzers, health_interval=args.health_interval, scan_interval=args.scan_interval, full_scan_interval=args.full_scan_interval, metrics_host=args.metrics_host, metrics_port=args.metrics_port, events_file=args.watch_events, analyzer_timeout=args.analyzer_timeout, bulk_index_fetch=not args.per_index_fetch)
+        transport.close()
+        return
 
-        cluster_level = analyzeClusterLevelDetails(args.cluster_url)
+    with tqdm(total=len(analyzers) + 1, desc="Overall Progress") as pbar:
+        snapshot = collectClusterSnapshot(args.cluster_url, bulk_index_fetch=not args.per_index_fetch)
         pbar.update(1)
 
-        index_level = analyzeIndexLevelDetails(args.cluster_url)
-        pbar.update(1)
+        all_level_data = runAnalyzers(snapshot, analyzers, timeout=args.analyzer_timeout, pbar=pbar)
 
-        unassigned_shard_data = analyseUnassignedShards(args.cluster_url)
-        pbar.update(1)
+    transport.close()
+    if args.record:
+        logging.info("Responses recorded in {}".format(args.record))
 
-    all_level_data = {
-        'node_level': node_level,
-        'shard_level': shard_level,
-        'cluster_level': cluster_level,
-        'index_level': index_level,
-        'unassigned_shard_data': unassigned_shard_data
-    }
+    summary = aggregateFindings(all_level_data, top_n=args.top_n)
+    with open("es_health_check_summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    logging.info("Summary saved as es_health_check_summary.json")
 
     logging.info("Generating HTML report...")
-    html_str = generate_html_report(all_level_data)
-
-    with open("es_health_check.html", "w") as f:
-        f.write(html_str)
+    writeHtmlReport(all_level_data, "es_health_check.html", summary=summary)
 
     logging.info("ES health check completed. Report saved as es_health_check.html")
 
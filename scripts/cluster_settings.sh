@@ -1,3 +1,4 @@
+#cluster_validate/validate_cluster.py (recovery_level) estimates time to green and advises node_concurrent_recoveries and the recovery throttle while shards recover
 #curl -H "Content-Type: application/json" -XPUT localhost:9200/_cluster/settings -d '{"transient":{"cluster.routing.allocation.cluster_concurrent_rebalance":10}}'
 
 #####for adding nodes and speeding up the rebalance
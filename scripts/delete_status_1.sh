@@ -1,3 +1,4 @@
+#cluster_validate/bulk_maintenance.py delete runs this sliced and throttled by the cluster load, with the temporary settings restored afterwards
 #deletes item status 1 items from indices
 echo "curl -H \"Content-Type: application/json\" -XGET  localhost:9200/$1/_count  -d'{\"query\":{\"bool\":{\"must\":[{\"terms\":{\"payment_status\":[4]}},{\"range\":{\"created_at\":{\"lt\":\"now-6M\"}}}]}}}'"
 echo "\n"
@@ -1 +1,2 @@
+#cluster_validate/tier_planner.py decides hot and warm indices from age and search/indexing rates and applies the box_type updates in paced batches
 for i in  mktorders-555; do  echo "curl -XPUT -H \"Content-Type: application/json\" localhost:9200/$i/_settings -d'{\"index.routing.allocation.include.box_type\":\"warm\"}'"; done;
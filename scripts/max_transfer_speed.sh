@@ -1 +1,2 @@
+#cluster_validate/validate_cluster.py (recovery_level) measures the recovery throughput per node and link and advises this throttle from the disk, network and search latency headroom
 curl -H "Content-Type: application/json" -XPUT localhost:9200/_cluster/settings -d'{    "transient" : {        "indices.recovery.max_bytes_per_sec" : "200mb"    }}'
@@ -1,3 +1,4 @@
+#cluster_validate/bulk_maintenance.py delete runs this sliced and throttled by the cluster load, with the temporary settings restored afterwards
 #finds the exinsting status 1 docs
 #deletes the documents by query
 #then check if count is 0 for status 1 items
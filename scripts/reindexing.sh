@@ -1,3 +1,4 @@
+#cluster_validate/bulk_maintenance.py reindex --remote_host runs this throttled by the cluster load, with replicas and refresh_interval restored afterwards
 host=`node -e "host=['','pawslmktorderes04','pawslmktorderes05','pawslmktorderes07'];index=Math.ceil(Math.random()*(host.length-1));console.log(host[index])"`
 echo "curl -H \"Content-Type: application/json\" -XPOST \"$host:9200/_reindex?wait_for_completion=false\" -d '{\"conflicts\": \"proceed\",\"source\": {\"remote\": {\"socket_timeout\": \"2m\",\"host\": \"http://10.0.45.65:80\"},\"index\": \"$1\"},\"dest\": {\"index\": \"$1\",\"type\": \"doc\"}}'"
 echo "\n"
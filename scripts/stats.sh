@@ -1,3 +1,4 @@
+#cluster_validate/task_monitor.py watch shows all running reindex and by query tasks with one _tasks call per interval, with rates and eta
 #gets stats for a task id
 for i in G78YGQBuTsKwIcJpMQeDbQ:84504291 G78YGQBuTsKwIcJpMQeDbQ:84521552 7gJwzus4Td6iN0pwSOg0Ug:67863878 7gJwzus4Td6iN0pwSOg0Ug:67864228 7gJwzus4Td6iN0pwSOg0Ug:67865720 ugOfqFWySZi7vpfSxKTi0A:78389591 7gJwzus4Td6iN0pwSOg0Ug:67870213 ugOfqFWySZi7vpfSxKTi0A:78396374 ugOfqFWySZi7vpfSxKTi0A:78397882 ugOfqFWySZi7vpfSxKTi0A:78403144 ugOfqFWySZi7vpfSxKTi0A:78406895 ugOfqFWySZi7vpfSxKTi0A:78408417 CpQy288ITiy_QEIERnLDWw:74985529 CpQy288ITiy_QEIERnLDWw:74985531 CpQy288ITiy_QEIERnLDWw:74985533 CpQy288ITiy_QEIERnLDWw:74985535 CpQy288ITiy_QEIERnLDWw:74987838 CpQy288ITiy_QEIERnLDWw:74987840 CpQy288ITiy_QEIERnLDWw:74987842 CpQy288ITiy_QEIERnLDWw:74987845 CpQy288ITiy_QEIERnLDWw:74987847 CpQy288ITiy_QEIERnLDWw:74987851; do curl  -s -XGET localhost:9200/_tasks/$i | jq '"\(.completed),\(.response.took),\(.task.status.total),\(.task.status.created),\(.task.status.updated),\(.task.status.batches),\(.task.failures)"' | sed 's/"//g'; done;
 